@@ -0,0 +1,199 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+# 応答の1トークン分として返す語
+REPLY_WORDS: List[str] = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+
+class FakeServerConfig:
+    def __init__(
+        self,
+        time_to_first_token: float = 0.05,
+        inter_token_delay: float = 0.005,
+        reply_tokens: int = 100,
+        rate_limit_every: int = 0,
+        retry_after_ms: int = 50,
+    ) -> None:
+        # リクエストを受信してから最初のチャンクを送信するまでの待機時間（秒）
+        self.time_to_first_token = time_to_first_token
+        # 2つ目以降のチャンクを送信する間隔（秒）
+        self.inter_token_delay = inter_token_delay
+        # 応答のトークン数（1チャンクにつき1トークン）
+        self.reply_tokens = reply_tokens
+        # n件に1件のリクエストに429エラーを返す（0の場合は返さない）
+        self.rate_limit_every = rate_limit_every
+        # 429エラーのretry-after-msヘッダーの値
+        self.retry_after_ms = retry_after_ms
+
+
+class FakeOpenAIServer:
+    """
+    Azure OpenAIのChat APIを模倣するローカルのHTTPサーバー。
+
+    /openai/deployments/{deployment}/chat/completions へのリクエストに対し、
+    stream=True の場合はServer-Sent Eventsで1トークンずつ、それ以外の場合はまとめて応答を返す。
+    最初のトークンまでの待機時間・トークン間の間隔・応答のトークン数・429エラーの頻度は config で指定する。
+    ベンチマークで実際のAPIを呼び出さずにアプリの処理を計測するために使用する。
+    """
+
+    def __init__(
+        self, config: Optional[FakeServerConfig] = None, host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        self.config = config or FakeServerConfig()
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-openai-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def next_request_is_rate_limited(self) -> bool:
+        """受信したリクエストを数え、そのリクエストに429エラーを返す場合はTrueを返す。"""
+        with self._lock:
+            self.request_count += 1
+            every = self.config.rate_limit_every
+            is_rate_limited = every > 0 and self.request_count % every == 0
+            if is_rate_limited:
+                self.rate_limited_count += 1
+            return is_rate_limited
+
+    def reply_chunks(self, deployment: str) -> Iterator[Dict[str, Any]]:
+        """ストリーミングで返すチャンクを順に返す。"""
+        created = int(time.time())
+
+        def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        yield chunk({"role": "assistant"})
+        for i in range(self.config.reply_tokens):
+            yield chunk({"content": f"{REPLY_WORDS[i % len(REPLY_WORDS)]} "})
+        yield chunk({}, "stop")
+
+    def reply_text(self) -> str:
+        return "".join(
+            f"{REPLY_WORDS[i % len(REPLY_WORDS)]} " for i in range(self.config.reply_tokens)
+        )
+
+
+def _make_handler(server: FakeOpenAIServer) -> type:
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # リクエストごとのアクセスログは計測の妨げになるため出力しない
+            pass
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if len(parts) != 5 or parts[:2] != ["openai", "deployments"] or parts[3:] != [
+                "chat",
+                "completions",
+            ]:
+                self._send_json(404, {"error": {"message": "Not found", "code": "404"}})
+                return
+            deployment = parts[2]
+
+            config = server.config
+            if server.next_request_is_rate_limited():
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit is exceeded.", "code": "429"}},
+                    {"retry-after-ms": str(config.retry_after_ms)},
+                )
+                return
+
+            params = json.loads(body or b"{}")
+            time.sleep(config.time_to_first_token)
+            if params.get("stream"):
+                self._send_stream(deployment)
+            else:
+                self._send_json(
+                    200,
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": deployment,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": server.reply_text()},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": 0,
+                            "completion_tokens": config.reply_tokens,
+                            "total_tokens": config.reply_tokens,
+                        },
+                    },
+                )
+
+        def _send_stream(self, deployment: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for i, chunk in enumerate(server.reply_chunks(deployment)):
+                    if i > 0:
+                        time.sleep(server.config.inter_token_delay)
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントが受信を打ち切った場合
+                pass
+
+        def _send_json(
+            self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None
+        ) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return FakeOpenAIHandler
@@ -0,0 +1,216 @@
+"""
+複数のユーザーが同時にチャット画面を操作した場合の負荷を計測する負荷試験。
+
+ローカルの偽のサーバー（FakeOpenAIServer）を起動し、Streamlitのヘッドレス実行（AppTest）で main.py を操作する
+セッションを同時に複数実行する。同時実行数ごとに、スクリプトの再実行にかかる時間・チャットの送信から
+応答の表示完了までの時間・セッションごとのメモリ使用量を集計する。
+
+    python -m benchmarks.load_test --concurrency 1 2 4 8
+    python -m benchmarks.load_test --concurrency 4 --turns 10 --save-baseline
+
+AppTestは実行のたびにプロセス全体で共有するStreamlitのランタイムを差し替えるため、
+同じプロセスの複数のスレッドからは同時に実行できない。そのため、セッションごとに別のプロセスで実行する。
+メモリ使用量は、各プロセスで最初の実行（モジュールのインポート）を終えた時点からの最大RSSの増加量とする。
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from benchmarks.report import (
+    DEFAULT_TOLERANCE,
+    find_regressions,
+    format_results,
+    load_baseline,
+    save_baseline,
+    summarize,
+)
+from benchmarks.run_benchmarks import configure_environment, quiet_app_logging
+
+DEFAULT_BASELINE_PATH: str = os.path.join(os.path.dirname(__file__), "load_baseline.json")
+MAIN_SCRIPT_PATH: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "main.py")
+# 1回の実行を待機する最大秒数（応答の受信を含む）
+RUN_TIMEOUT_SECONDS: float = 120.0
+
+
+def get_max_rss_bytes() -> int:
+    """このプロセスの最大RSS（バイト）を返す。"""
+    import resource
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxではキロバイト、macOSではバイト単位
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def find_widget(widgets: Any, label: str) -> Any:
+    """ラベルが一致するウィジェットを返す。"""
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"Widget not found: {label!r}")
+
+
+class SessionResult:
+    def __init__(self) -> None:
+        # ウィジェットの操作によるスクリプトの再実行にかかった時間（秒）
+        self.rerun_seconds: List[float] = []
+        # チャットを送信してから応答の表示が完了するまでの時間（秒）
+        self.reply_seconds: List[float] = []
+        # 最初の実行を終えた時点からの最大RSSの増加量（バイト）
+        self.memory_bytes = 0
+        self.errors: List[str] = []
+
+
+def run_session(session_id: int, turns: int, barrier: Optional[Any] = None) -> SessionResult:
+    """
+    1人のユーザーのチャット画面の操作を模倣する。
+
+    モデルの切り替え・スライダーの操作・メッセージの送信を turns 回繰り返した後、
+    会話履歴をダウンロードし、会話履歴を削除する。
+    barrier を指定した場合は、すべてのセッションの最初の実行が終わるまで待機してから操作を始める。
+    """
+    from streamlit.testing.v1 import AppTest
+
+    from data_source.openai_data_source import MODELS
+
+    quiet_app_logging()
+    result = SessionResult()
+    rng = random.Random(session_id)
+    app = AppTest.from_file(MAIN_SCRIPT_PATH, default_timeout=RUN_TIMEOUT_SECONDS).run()
+    baseline_rss = get_max_rss_bytes()
+    if barrier is not None:
+        barrier.wait()
+
+    def rerun(widget: Any) -> None:
+        started_at = time.perf_counter()
+        widget.run()
+        result.rerun_seconds.append(time.perf_counter() - started_at)
+        if app.exception:
+            result.errors.append(str(app.exception[0].message))
+
+    model_keys = list(MODELS.keys())
+    for turn in range(turns):
+        rerun(find_widget(app.radio, "Select a model:").set_value(model_keys[turn % len(model_keys)]))
+        rerun(find_widget(app.slider, "temperature: ").set_value(round(rng.uniform(0.0, 1.0), 1)))
+
+        started_at = time.perf_counter()
+        app.chat_input[0].set_value(f"Session {session_id}, turn {turn}: tell me a story.").run()
+        result.reply_seconds.append(time.perf_counter() - started_at)
+        messages = app.session_state["messages"]
+        if app.exception:
+            result.errors.append(str(app.exception[0].message))
+        elif not messages or messages[-1]["role"] != "assistant":
+            result.errors.append(f"No assistant reply on turn {turn}")
+
+    # 同時に実行している他のセッションと同じファイルに書き込まないよう、セッションごとのファイル名にする
+    find_widget(app.text_input, "Enter filename for download:").input(f"loadtest-session-{session_id}")
+    rerun(find_widget(app.button, "Generate History Log").click())
+    rerun(app.button(key="clear").click())
+
+    result.memory_bytes = get_max_rss_bytes() - baseline_rss
+    return result
+
+
+def run_load(concurrency: int, turns: int) -> List[SessionResult]:
+    """concurrency 個のセッションを、それぞれ別のプロセスで同時に実行する。"""
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        barrier = manager.Barrier(concurrency)
+        with ProcessPoolExecutor(max_workers=concurrency, mp_context=context) as executor:
+            futures = [
+                executor.submit(run_session, session_id, turns, barrier)
+                for session_id in range(concurrency)
+            ]
+            return [future.result() for future in futures]
+
+
+def summarize_load(
+    concurrency: int, sessions: List[SessionResult], elapsed: float
+) -> Dict[str, Dict[str, float]]:
+    """同時実行数ごとの再実行・応答の時間と、セッションごとのメモリ使用量（バイト）を集計する。"""
+    rerun_seconds = [seconds for session in sessions for seconds in session.rerun_seconds]
+    reply_seconds = [seconds for session in sessions for seconds in session.reply_seconds]
+    memory_bytes = [float(session.memory_bytes) for session in sessions]
+    return {
+        f"load[c={concurrency}].rerun": summarize(rerun_seconds, elapsed),
+        f"load[c={concurrency}].reply": summarize(reply_seconds, elapsed),
+        f"load[c={concurrency}].session_memory_bytes": summarize(memory_bytes, elapsed),
+    }
+
+
+def format_memory(results: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'session memory':<40} {'mean MB':>10} {'max MB':>10}"]
+    for name, summary in results.items():
+        if name.endswith(".session_memory_bytes"):
+            lines.append(
+                f"{name.rsplit('.', 1)[0]:<40} {summary['mean'] / 2**20:>10.1f} "
+                f"{summary['max'] / 2**20:>10.1f}"
+            )
+    return "\n".join(lines)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="同時実行数")
+    parser.add_argument("--turns", type=int, default=5, help="セッションごとのチャットの送信回数")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="ベースラインのファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument("--compare", action="store_true", help="ベースラインと比較する")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="劣化とみなす増加率")
+    # 偽のサーバーの設定
+    parser.add_argument("--ttft", type=float, default=0.3, help="最初のトークンまでの時間（秒）")
+    parser.add_argument("--inter-token-delay", type=float, default=0.02, help="トークン間の間隔（秒）")
+    parser.add_argument("--reply-tokens", type=int, default=150, help="応答のトークン数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="n件に1件429エラーを返す")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    config = FakeServerConfig(
+        time_to_first_token=args.ttft,
+        inter_token_delay=args.inter_token_delay,
+        reply_tokens=args.reply_tokens,
+        rate_limit_every=args.rate_limit_every,
+    )
+    results: Dict[str, Dict[str, float]] = {}
+    errors: List[str] = []
+    with FakeOpenAIServer(config) as server:
+        # セッションのプロセスは起動時の環境変数を引き継ぐため、起動前に接続先を設定する
+        configure_environment(server.base_url)
+        for concurrency in args.concurrency:
+            started_at = time.perf_counter()
+            sessions = run_load(concurrency, args.turns)
+            results.update(summarize_load(concurrency, sessions, time.perf_counter() - started_at))
+            errors.extend(error for session in sessions for error in session.errors)
+
+        latency_results = {
+            name: summary
+            for name, summary in results.items()
+            if not name.endswith(".session_memory_bytes")
+        }
+        print(format_results(latency_results))
+        print(format_memory(results))
+        print(f"fake server: {server.request_count} requests, {server.rate_limited_count} rate limited")
+    for error in errors:
+        print(f"ERROR: {error}")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        regressions = find_regressions(results, load_baseline(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
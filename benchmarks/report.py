@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import platform
+from typing import Any, Dict, List, Sequence
+
+# ベースラインより遅くなった場合に劣化とみなす割合（0.2 の場合は20%以上の増加）
+DEFAULT_TOLERANCE: float = 0.2
+# 劣化の判定に使用する指標（いずれも小さいほど良い）
+COMPARED_METRICS: Sequence[str] = ("p50", "p90")
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """昇順に並んだ観測値の q パーセンタイル（0 <= q <= 100）を線形補間で求める。観測値がない場合は 0.0 を返す。"""
+    if not sorted_samples:
+        return 0.0
+    rank = (len(sorted_samples) - 1) * q / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (rank - lower)
+
+
+def summarize(samples: Sequence[float], elapsed: float) -> Dict[str, float]:
+    """
+    1回あたりの処理時間（秒）の観測値から、件数・スループットとレイテンシのパーセンタイルを求める。
+
+    Args:
+        samples (Sequence[float]): 1回あたりの処理時間（秒）。
+        elapsed (float): すべての観測にかかった時間（秒）。並列に実行した場合は処理時間の合計より短くなる。
+
+    Returns:
+        Dict[str, float]: count・throughput（1秒あたりの回数）・mean・min・max・p50・p90・p99。
+    """
+    sorted_samples = sorted(samples)
+    count = len(sorted_samples)
+    return {
+        "count": count,
+        "throughput": count / elapsed if elapsed > 0 else 0.0,
+        "mean": sum(sorted_samples) / count if count else 0.0,
+        "min": sorted_samples[0] if count else 0.0,
+        "max": sorted_samples[-1] if count else 0.0,
+        "p50": percentile(sorted_samples, 50),
+        "p90": percentile(sorted_samples, 90),
+        "p99": percentile(sorted_samples, 99),
+    }
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    """ベンチマークごとの集計結果を表形式の文字列にする（レイテンシはミリ秒で表示する）。"""
+    lines = [
+        f"{'benchmark':<40} {'count':>7} {'ops/s':>10} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}"
+    ]
+    for name, summary in results.items():
+        lines.append(
+            f"{name:<40} {int(summary['count']):>7} {summary['throughput']:>10.1f} "
+            f"{summary['p50'] * 1000:>10.3f} {summary['p90'] * 1000:>10.3f} "
+            f"{summary['p99'] * 1000:>10.3f}"
+        )
+    return "\n".join(lines)
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]) -> None:
+    """集計結果を、計測した環境の情報とともにベースラインとしてJSONファイルに保存する。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "environment": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpu_count": os.cpu_count(),
+                },
+                "results": results,
+            },
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    """save_baseline で保存したベースラインの集計結果を読み込む。"""
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)["results"]
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """
+    ベースラインと比べて指標が tolerance の割合を超えて増加したベンチマークを返す。
+
+    ベースラインに含まれないベンチマークは比較しない。
+
+    Returns:
+        List[str]: 劣化した指標ごとの説明（劣化がない場合は空のリスト）。
+    """
+    regressions = []
+    for name, summary in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if expected[metric] > 0 and summary[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {metric}: {summary[metric]:.6g} "
+                    f"(baseline {expected[metric]:.6g}, "
+                    f"+{(summary[metric] / expected[metric] - 1) * 100:.0f}%)"
+                )
+    return regressions
@@ -0,0 +1,347 @@
+"""
+アプリの主要な処理の性能を計測するベンチマーク。
+
+Azure OpenAIの代わりにローカルの偽のサーバー（FakeOpenAIServer）を起動し、実際のAPIを呼び出さずに計測する。
+
+    python -m benchmarks.run_benchmarks                      # 計測して結果を表示
+    python -m benchmarks.run_benchmarks --save-baseline      # 結果をベースラインとして保存
+    python -m benchmarks.run_benchmarks --compare            # ベースラインより劣化した場合は終了コード1
+    python -m benchmarks.run_benchmarks --only chat pdf      # 一部のベンチマークのみ実行
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from benchmarks.report import (
+    DEFAULT_TOLERANCE,
+    find_regressions,
+    format_results,
+    load_baseline,
+    save_baseline,
+    summarize,
+)
+
+DEFAULT_BASELINE_PATH: str = os.path.join(os.path.dirname(__file__), "baseline.json")
+# ベンチマークで使用するモデル
+BENCHMARK_MODEL: str = "gpt-3.5-turbo"
+
+# MODELSの接続情報を読み込む環境変数の接頭辞（モデルごとにコストの環境変数名のみ異なる）
+_MODEL_ENV_PREFIXES: List[Tuple[str, str]] = [
+    ("GPT_3_5_TURBO", "GPT_3_5"),
+    ("GPT_4_TURBO", "GPT_4_TURBO"),
+]
+
+Results = Dict[str, Dict[str, float]]
+
+
+def configure_environment(base_url: str) -> None:
+    """
+    MODELSのすべてのモデルの接続先を偽のサーバーに向ける。
+
+    MODELSはインポート時に環境変数から読み込まれるため、アプリのモジュールをインポートする前に呼び出す。
+    .envのレート制限の設定で計測が律速されないよう、RPM・TPMの上限は設定しない。
+    """
+    for prefix, cost_prefix in _MODEL_ENV_PREFIXES:
+        os.environ[f"{prefix}_API_KEY"] = "fake-key"
+        os.environ[f"{prefix}_BASE_URL"] = base_url
+        os.environ[f"{prefix}_API_VERSION"] = "2023-05-15"
+        os.environ[f"{prefix}_API_TYPE"] = "azure"
+        os.environ[f"{prefix}_API_DEPLOYMENT_NAME"] = f"fake-{prefix.lower()}"
+        os.environ[f"{prefix}_API_MODEL_VERSION"] = "0613"
+        os.environ[f"{prefix}_REQUESTS_PER_MINUTE"] = ""
+        os.environ[f"{prefix}_TOKENS_PER_MINUTE"] = ""
+        os.environ[f"{cost_prefix}_PROMPT_COST"] = "0.0000015"
+        os.environ[f"{cost_prefix}_COMPLETION_COST"] = "0.000002"
+
+
+def quiet_app_logging() -> None:
+    """アプリのログ出力で計測が律速されないよう、アプリのロガーは警告以上のみ出力するようにする。"""
+    from logs.app_logger import METRICS_LOGGER_NAME, configure_logging
+
+    configure_logging()
+    for name in ("__main__", "same_hierarchy", "lower.sub", METRICS_LOGGER_NAME):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 1) -> Tuple[List[float], float]:
+    """func を warmup 回実行した後に iterations 回実行し、1回ごとの処理時間と全体の経過時間を返す。"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        call_started_at = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_started_at)
+    return samples, time.perf_counter() - started_at
+
+
+def measure_concurrently(
+    func: Callable[[], Any], iterations: int, concurrency: int
+) -> Tuple[List[float], float]:
+    """func を concurrency 個のスレッドで合計 iterations 回実行し、1回ごとの処理時間と全体の経過時間を返す。"""
+
+    def timed_call(_: int) -> float:
+        call_started_at = time.perf_counter()
+        func()
+        return time.perf_counter() - call_started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed_call, range(iterations)))
+    return samples, time.perf_counter() - started_at
+
+
+def _chat_turn_script() -> None:
+    # AppTestで実行するスクリプト（関数の本体のみが実行されるため、必要なモジュールはここでインポートする）
+    import time
+
+    import streamlit as st
+    from chat_session.ChatSession import ChatSession
+    from costs.calculate_cost import calculate_cost
+    from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+    from data_source.openai_data_source import MODELS
+
+    model_version = st.session_state.benchmark_model
+    parameter = MODELS[model_version]["parameter"]
+    llm = ModelParameters(
+        max_tokens=parameter["max_response_tokens"],
+        temperature=0.0,
+        top_p=1.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        deployment_name=MODELS[model_version]["config"]["deployment_name"],
+    )
+    chat_session = ChatSession()
+    chat_session.display_conversations(st.session_state.messages, False)
+    chat_session.add_user_chat_message(st.session_state.benchmark_input, model_version)
+
+    started_at = time.perf_counter()
+    is_error, prompt_tokens, completion_tokens = chat_session.generate_assistant_chat_response(
+        model_version, llm
+    )
+    generated_at = time.perf_counter()
+    calculate_cost(prompt_tokens, completion_tokens, model_version, is_error)
+    st.session_state.benchmark_timings = (
+        generated_at - started_at,
+        time.perf_counter() - generated_at,
+        is_error,
+    )
+
+
+def bench_chat(args: argparse.Namespace) -> Results:
+    """
+    Streamlitのヘッドレス実行（AppTest）で1ターンずつ会話し、
+    generate_assistant_chat_response と calculate_cost の処理時間を計測する。
+
+    会話履歴はターンごとに長くなるため、履歴の詰め込みやトークン数の集計の負荷も含めて計測される。
+    """
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_function(_chat_turn_script, default_timeout=60)
+    app.session_state["benchmark_model"] = BENCHMARK_MODEL
+    generation_samples: List[float] = []
+    cost_samples: List[float] = []
+    # AppTestはスクリプトを __main__ として実行したままにするため、
+    # 後続のベンチマークが起動するspawnのワーカーがこのスクリプトを実行しないよう元に戻す
+    main_module = sys.modules["__main__"]
+    try:
+        for turn in range(args.chat_turns):
+            app.session_state["benchmark_input"] = f"Question {turn}: please answer in detail."
+            app.run()
+            if app.exception:
+                raise RuntimeError(f"Chat turn {turn} failed: {app.exception}")
+            generation_seconds, cost_seconds, is_error = app.session_state["benchmark_timings"]
+            if is_error:
+                raise RuntimeError(f"Chat turn {turn} returned an error")
+            generation_samples.append(generation_seconds)
+            cost_samples.append(cost_seconds)
+    finally:
+        sys.modules["__main__"] = main_module
+    # ターン全体の経過時間ではなく、それぞれの処理にかかった時間の合計からスループットを求める
+    return {
+        "chat.generate_assistant_chat_response": summarize(
+            generation_samples, sum(generation_samples)
+        ),
+        "chat.calculate_cost": summarize(cost_samples, sum(cost_samples)),
+    }
+
+
+def bench_chat_stream(args: argparse.Namespace) -> Results:
+    """
+    複数のスレッドから同時にChat APIをストリーミングで呼び出し、応答を最後まで受信する時間を計測する。
+
+    クライアントの接続プール・レート制限・429エラー時の再試行の負荷を、Streamlitを介さずに計測する。
+    """
+    from chat_session.ChatSession import ChatSession
+    from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+
+    messages = [{"role": "user", "content": "Hello"}]
+    llm = ModelParameters(
+        max_tokens=args.reply_tokens,
+        temperature=0.0,
+        top_p=1.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        deployment_name="",
+    )
+
+    def stream_reply() -> None:
+        for _ in ChatSession.stream_chat_completion(BENCHMARK_MODEL, messages, llm):
+            pass
+
+    samples, elapsed = measure_concurrently(
+        stream_reply, args.stream_requests, args.stream_concurrency
+    )
+    return {f"chat.stream x{args.stream_concurrency}": summarize(samples, elapsed)}
+
+
+def bench_tokens(args: argparse.Namespace) -> Results:
+    """get_tiktoken_count の処理時間を、短いメッセージと長いメッセージで計測する。"""
+    from costs.get_token_count import get_tiktoken_count
+
+    results = {}
+    for label, text in [
+        ("short", "こんにちは、今日の天気を教えてください。"),
+        ("long", "これは非常に長いメッセージです。The quick brown fox jumps over the lazy dog. " * 200),
+    ]:
+        samples, elapsed = measure(
+            lambda: get_tiktoken_count(text, BENCHMARK_MODEL), args.micro_iterations
+        )
+        results[f"tokens.get_tiktoken_count[{label}]"] = summarize(samples, elapsed)
+    return results
+
+
+def bench_log_decorator(args: argparse.Namespace) -> Results:
+    """log_decorator を付けた関数の呼び出しの処理時間を、ログを出力する場合としない場合で計測する。"""
+    from logs.log_decorator import log_decorator
+
+    results = {}
+    payload = {"messages": [{"role": "user", "content": "x" * 1000}] * 50}
+    for label, level in [("enabled", logging.DEBUG), ("disabled", logging.WARNING)]:
+        logger = logging.getLogger(f"benchmarks.log_decorator.{label}")
+        logger.setLevel(level)
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+        @log_decorator(logger, level=logging.INFO)
+        def decorated(value: Dict[str, Any]) -> int:
+            return len(value)
+
+        samples, elapsed = measure(lambda: decorated(payload), args.micro_iterations)
+        results[f"log_decorator[{label}]"] = summarize(samples, elapsed)
+    return results
+
+
+def make_synthetic_pdf(page_count: int, lines_per_page: int = 40) -> bytes:
+    """ページごとに異なるテキストを持つPDFを生成する。"""
+    import fitz
+
+    pdf = fitz.open()
+    for page_number in range(page_count):
+        text = "\n".join(
+            f"Page {page_number + 1} line {line}: lorem ipsum dolor sit amet, consectetur elit."
+            for line in range(lines_per_page)
+        )
+        pdf.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=9)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def bench_pdf(args: argparse.Namespace) -> Results:
+    """
+    PDFQASession.get_pdf_text が使用する extract_pdf の処理時間を、合成したPDFで計測する。
+
+    キャッシュが空の場合（抽出）と、同じ内容のPDFを再度アップロードした場合（キャッシュの再利用）を計測する。
+    file_uploader はヘッドレス実行では操作できないため、PDFQASession を介さずに extract_pdf を呼び出す。
+    """
+    from pdf_qa_service.pdf_extractor import PDFTextCache, extract_pdf, get_pdf_process_pool
+
+    data = make_synthetic_pdf(args.pdf_pages)
+    file_name = f"synthetic-{args.pdf_pages}.pdf"
+    # プロセスプールの起動時間を計測に含めないよう、事前に起動しておく
+    extract_pdf(make_synthetic_pdf(args.pdf_pages), "warmup.pdf", cache=PDFTextCache())
+
+    cold_samples, cold_elapsed = measure(
+        lambda: extract_pdf(data, file_name, cache=PDFTextCache()), args.pdf_iterations, warmup=0
+    )
+    cache = PDFTextCache()
+    warm_samples, warm_elapsed = measure(
+        lambda: extract_pdf(data, file_name, cache=cache), args.micro_iterations
+    )
+    get_pdf_process_pool().shutdown()
+    return {
+        f"pdf.extract_pdf[{args.pdf_pages} pages]": summarize(cold_samples, cold_elapsed),
+        f"pdf.extract_pdf[{args.pdf_pages} pages, cached]": summarize(warm_samples, warm_elapsed),
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Results]] = {
+    "chat": bench_chat,
+    "stream": bench_chat_stream,
+    "tokens": bench_tokens,
+    "log": bench_log_decorator,
+    "pdf": bench_pdf,
+}
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="実行するベンチマーク")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="ベースラインのファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument("--compare", action="store_true", help="ベースラインと比較する")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="劣化とみなす増加率")
+    # 偽のサーバーの設定
+    parser.add_argument("--ttft", type=float, default=0.05, help="最初のトークンまでの時間（秒）")
+    parser.add_argument("--inter-token-delay", type=float, default=0.002, help="トークン間の間隔（秒）")
+    parser.add_argument("--reply-tokens", type=int, default=100, help="応答のトークン数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="n件に1件429エラーを返す")
+    # 計測回数
+    parser.add_argument("--chat-turns", type=int, default=20)
+    parser.add_argument("--stream-requests", type=int, default=64)
+    parser.add_argument("--stream-concurrency", type=int, default=8)
+    parser.add_argument("--micro-iterations", type=int, default=2000)
+    parser.add_argument("--pdf-pages", type=int, default=64)
+    parser.add_argument("--pdf-iterations", type=int, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    config = FakeServerConfig(
+        time_to_first_token=args.ttft,
+        inter_token_delay=args.inter_token_delay,
+        reply_tokens=args.reply_tokens,
+        rate_limit_every=args.rate_limit_every,
+    )
+    with FakeOpenAIServer(config) as server:
+        configure_environment(server.base_url)
+        quiet_app_logging()
+
+        results: Results = {}
+        for name in args.only or list(BENCHMARKS):
+            results.update(BENCHMARKS[name](args))
+        print(format_results(results))
+        print(f"fake server: {server.request_count} requests, {server.rate_limited_count} rate limited")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        regressions = find_regressions(results, load_baseline(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
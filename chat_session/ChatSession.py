@@ -1,11 +1,21 @@
 # ユーザーのチャット入力を会話に追加する関数
 from logging import Logger
 import traceback
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import openai
 import streamlit as st
+from chat_session.GenerationJob import GenerationJob, get_generation_job_pool
 from chat_session.initialize_chat_page import initialize_sidebar, select_model
+from chat_session.history_packer import pack_history
+from chat_session.history_view import render_history_page, split_history_window
+from chat_session.ResponseCache import get_response_cache, make_request_key
+from chat_session.SingleFlight import Subscription, get_single_flight
+from chat_session.StreamingRenderer import StreamingRenderer
+from chat_session.stream_metrics import StreamMetrics
+from chat_session.SummaryMemory import SummaryMemory, create_openai_summarizer
+from costs.get_token_count import TOKEN_COUNT_KEY, get_message_token_counts
 from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+from data_source.openai_client_registry import ChatCompletionStream, get_openai_client
 from data_source.openai_data_source import MODELS, Role
 from logs.app_logger import set_logging
 from logs.log_decorator import log_decorator
@@ -13,11 +23,20 @@ from logs.log_decorator import log_decorator
 logger: Logger = set_logging("lower.sub")
 
 
+def get_delta_content(response: Any) -> Optional[str]:
+    """ストリーミングで受信したチャンクから、応答の差分を取り出します。"""
+    if response.choices:
+        return response.choices[0].delta.get("content", "")
+    return None
+
+
 class ChatSession:
     def __init__(self):
         # self.is_error = False
         if "messages" not in st.session_state:
             st.session_state.messages = [{"role": Role.SYSTEM.value, "content": ""}]
+        if "summary_memory" not in st.session_state:
+            st.session_state.summary_memory = SummaryMemory()
 
     @log_decorator(logger)
     def initialize_chat_page_element(self) -> Tuple[ModelParameters, str]:
@@ -48,11 +67,29 @@ class ChatSession:
         """
         会話を表示します。エラーが発生した場合も含みます。
 
+        再実行のたびにすべてのメッセージを描画しないよう、直近のメッセージのみを表示します。
+        それより前のメッセージは「Load earlier messages」で1ページずつ読み込み、
+        ページ単位でキャッシュしたマークダウンとして表示します。
+
         Args:
             messages (List[Dict[str, Any]]): 会話のメッセージリスト。
             is_error (bool): エラーが発生したかどうかのフラグ。
         """
-        for message in messages:
+        loaded_pages = st.session_state.get("history_loaded_pages", 0)
+        recent_start, page_ranges = split_history_window(len(messages), loaded_pages)
+        # まだ表示していない過去のメッセージがある場合のみ、読み込みボタンを表示する
+        oldest_displayed_index = page_ranges[0][0] if page_ranges else recent_start
+        if oldest_displayed_index > 0 and st.button("Load earlier messages"):
+            loaded_pages += 1
+            st.session_state.history_loaded_pages = loaded_pages
+            recent_start, page_ranges = split_history_window(len(messages), loaded_pages)
+
+        for page_start, page_end in page_ranges:
+            page = tuple((m["role"], m["content"]) for m in messages[page_start:page_end])
+            with st.expander(f"Messages {page_start + 1}-{page_end}", expanded=True):
+                st.markdown(render_history_page(page))
+
+        for message in messages[recent_start:]:
             role, content = message["role"], message["content"]
             if role == "user" or role == "assistant":
                 with st.chat_message(role):
@@ -62,76 +99,275 @@ class ChatSession:
                     with st.chat_message(role):
                         st.markdown(content)
 
+    def append_message(self, role: str, content: str, model_version: str) -> Dict[str, Any]:
+        """
+        メッセージを会話履歴に追加します。
+
+        追加時に一度だけ本文のトークン数を計算し、メッセージにキャッシュします。
+
+        Args:
+            role (str): メッセージのロール。
+            content (str): メッセージの本文。
+            model_version (str): 選択された言語モデルのキー。
+
+        Returns:
+            Dict[str, Any]: 追加されたメッセージ。
+        """
+        message: Dict[str, Any] = {"role": role, "content": content}
+        get_message_token_counts([message], model_version)
+        st.session_state.messages.append(message)
+        return message
+
     @log_decorator(logger)
-    def add_user_chat_message(self, user_input: str) -> None:
+    def add_user_chat_message(self, user_input: str, model_version: str) -> None:
         """
         ユーザーのチャット入力を会話に追加します。
 
         Args:
             user_input (str): ユーザーのチャット入力。
+            model_version (str): 選択された言語モデルのキー。
         """
-        st.session_state.messages.append({"role": Role.USER.value, "content": user_input})
+        self.append_message(Role.USER.value, user_input, model_version)
         st.chat_message(Role.USER.value).markdown(user_input)
 
-    # アシスタントのチャット応答を生成する関数
+    @staticmethod
+    def stream_chat_completion(
+        model_version: str,
+        messages: List[Dict[str, Any]],
+        llm: ModelParameters,
+        prompt_tokens: int = 0,
+    ) -> ChatCompletionStream:
+        """
+        OpenAIのChat APIをストリーミングで呼び出し、受信した応答の差分を順に返すストリームを返します。
+
+        Args:
+            model_version (str): 選択された言語モデルのキー。
+            messages (List[Dict[str, Any]]): 送信するメッセージリスト。
+            llm(ModelParameters): 会話を行う際のGPTモデルとそのパラメータ
+            prompt_tokens (int): 送信するメッセージのトークン数（レート制限の見積もりに使用）。
+
+        Returns:
+            ChatCompletionStream: 受信した応答の差分を返すストリーム。close で受信を打ち切ることができる。
+        """
+        stream = get_openai_client(model_version).create_chat_completion(
+            estimated_tokens=prompt_tokens + llm.max_tokens,
+            messages=messages,
+            temperature=llm.temperature,
+            max_tokens=llm.max_tokens,
+            top_p=llm.top_p,
+            frequency_penalty=llm.frequency_penalty,
+            presence_penalty=llm.presence_penalty,
+            stream=True,
+            stop=None,
+        )
+        return stream.map(get_delta_content)
+
     @log_decorator(logger)
-    def generate_assistant_chat_response(
+    def submit_assistant_chat_response(
         self, model_version: str, llm: ModelParameters
-    ) -> Tuple[bool, str, str]:
+    ) -> GenerationJob:
         """
-        OpenAIのChat APIを使用してアシスタントのチャット応答を生成します。
+        アシスタントのチャット応答を生成するジョブをワーカープールに投入します。
+
+        生成はワーカースレッドで行うため、ウィジェットの操作でスクリプトが再実行されても中断されません。
+        投入したジョブはセッションステートに保持し、再実行後は attach_generation_job で表示を再開します。
 
         Args:
             model_version (str): 選択された言語モデルのキー。
-            temperature (float): テキスト生成のためのtemperatureパラメータ。
             llm(ModelParameters): 会話を行う際のGPTモデルとそのパラメータ
 
+        Returns:
+            GenerationJob: 投入したジョブ。
+        """
+        # これまでの会話履歴もアシスタントに送信する必要があるため
+        # 要約メモリが有効な場合は、古い会話を要約に置き換えた履歴を使用する
+        history = st.session_state.messages
+        if st.session_state.get("use_summary_memory"):
+            history = st.session_state.summary_memory.build_history(history)
+        # プロンプトのトークン数の上限に収まる範囲で新しい履歴から選択する
+        packed_history = pack_history(
+            history,
+            model_version,
+            MODELS[model_version]["parameter"]["max_prompt_tokens"],
+        )
+        st.session_state.dropped_messages = packed_history.dropped_messages
+        messages_with_history = packed_history.messages
+        request_key = make_request_key(messages_with_history, llm)
+        # 応答キャッシュが有効な場合は、同一のリクエストに対する応答を再利用する
+        use_response_cache = st.session_state.get("use_response_cache", False)
+        cached_response = get_response_cache().get(request_key) if use_response_cache else None
+        if cached_response is not None:
+            job = GenerationJob(
+                model_version,
+                lambda: [cached_response],
+                dropped_message_count=len(packed_history.dropped_messages),
+                is_cached=True,
+            )
+        else:
+            # OpenAIのChat APIを呼び出して応答を生成
+            # 他のセッションから同一のリクエストが実行中の場合は、その応答を共有する
+            def save_to_cache(response: str) -> None:
+                if use_response_cache and response:
+                    get_response_cache().set(request_key, response)
+
+            def start() -> Subscription:
+                subscription = get_single_flight().stream(
+                    request_key,
+                    lambda: self.stream_chat_completion(
+                        model_version, messages_with_history, llm, packed_history.prompt_tokens
+                    ),
+                )
+                job.is_shared = not subscription.is_leader
+                return subscription
+
+            job = GenerationJob(
+                model_version,
+                start,
+                prompt_tokens=packed_history.prompt_tokens,
+                dropped_message_count=len(packed_history.dropped_messages),
+                on_complete=save_to_cache,
+                metrics=StreamMetrics(model_version),
+            )
+
+        get_generation_job_pool().submit(job)
+        # 表示を終えていないジョブが残っている場合は、新しいジョブに置き換える前に打ち切る
+        previous_job = st.session_state.get("generation_job")
+        if previous_job is not None:
+            previous_job.cancel()
+        st.session_state.generation_job = job
+        return job
+
+    @log_decorator(logger)
+    def attach_generation_job(self, job: GenerationJob) -> Tuple[bool, int, int]:
+        """
+        応答生成のジョブが受信済みの差分から表示を再開し、完了したら会話に追加します。
+
+        スクリプトの再実行で表示が中断された場合も、ジョブはそのまま生成を続けるため、
+        次の実行で再びこのメソッドを呼び出すと続きから表示されます。
+        生成中は停止ボタンを表示し、押された場合は受信済みの部分までで応答を打ち切ります。
+        会話への追加とトークン数の集計は、ジョブごとに1回だけ行います。
+        ジョブに計測が設定されている場合は、受信の待ち時間と描画の時間も計測し、完了時に記録します。
+
+        Args:
+            job (GenerationJob): 表示するジョブ。
+
         Returns:
             bool: エラーが発生した場合はTrue、それ以外はFalse。
+            int: 送信したプロンプトのトークン数。
+            int: 受信したコンプリーションのトークン数。
         """
+        model_version = job.model_version
         try:
             with st.chat_message(Role.ASSISTANT.value):
-                message_placeholder = st.empty()
-                assistant_chat = ""
-                # これまでの会話履歴もアシスタントに送信する必要があるため
-                messages_with_history = [
-                    {"role": m["role"], "content": m["content"]} for m in st.session_state.messages
-                ]
-                # OpenAIのChat APIを呼び出して応答を生成
-                for response in openai.ChatCompletion.create(
-                    engine=MODELS[model_version]["config"]["deployment_name"],
-                    messages=messages_with_history,
-                    temperature=llm.temperature,
-                    max_tokens=llm.max_tokens,
-                    top_p=llm.top_p,
-                    frequency_penalty=llm.frequency_penalty,
-                    presence_penalty=llm.presence_penalty,
-                    stream=True,
-                    stop=None,
-                ):
-                    if response.choices:  # type: ignore
-                        assistant_chat += response.choices[0].delta.get("content", "")  # type: ignore
-                        message_placeholder.markdown(assistant_chat + "▌")
-                message_placeholder.markdown(assistant_chat)
-
-            st.session_state.messages.append({"role": Role.ASSISTANT.value, "content": assistant_chat})
+                if job.dropped_message_count:
+                    st.caption(
+                        f"{job.dropped_message_count} earlier messages were not sent "
+                        "to fit the prompt token limit."
+                    )
+                renderer = StreamingRenderer(st.empty())
+                # 停止ボタンを押すとスクリプトが再実行されるため、再実行後のこの位置でジョブを打ち切る
+                stop_placeholder = st.empty()
+                # 同じ実行で複数のジョブを表示してもキーが重複しないよう、ジョブごとのキーにする
+                if stop_placeholder.button("Stop", key=f"stop_generation_{job.job_id}"):
+                    job.cancel()
+                deltas = job.subscribe()
+                if job.metrics is not None:
+                    deltas = job.metrics.track(deltas)
+                for delta in deltas:
+                    renderer.append(delta)
+                stop_placeholder.empty()
+                assistant_chat = renderer.finish()
+                if job.is_cancelled:
+                    st.caption("Generation was stopped.")
+
+            # 打ち切った応答は受信済みの部分のみを会話に追加し、その分のトークン数のみを集計する
+            completion_tokens = 0
+            if assistant_chat or not job.is_cancelled:
+                assistant_message = self.append_message(
+                    Role.ASSISTANT.value, assistant_chat, model_version
+                )
+                completion_tokens = assistant_message[TOKEN_COUNT_KEY][model_version]
+            # 会話に追加した後で、次の実行で再表示しないようジョブを削除する
+            # （追加より前に再実行で中断された場合は、次の実行で最初から表示し直して追加する）
+            self.release_generation_job(job)
+            if job.metrics is not None:
+                job.metrics.record(completion_tokens)
+            # キャッシュから応答した場合や、実行中の同一リクエストの応答を共有した場合は
+            # Chat APIを呼び出していないため課金されない
+            if job.is_cached or job.is_shared:
+                prompt_tokens, completion_tokens = 0, 0
+            else:
+                prompt_tokens = job.prompt_tokens
+
+            # 応答の表示後に、必要に応じて古い会話の要約をバックグラウンドで開始する
+            if st.session_state.get("use_summary_memory"):
+                max_prompt_tokens = MODELS[model_version]["parameter"]["max_prompt_tokens"]
+                st.session_state.summary_memory.maybe_summarize(
+                    st.session_state.messages,
+                    model_version,
+                    int(max_prompt_tokens * st.session_state.summary_threshold_ratio),
+                    create_openai_summarizer(model_version),
+                )
+            # バックグラウンドで完了した要約で消費したトークン数も、このターンの分として集計する
+            summary_memory: SummaryMemory = st.session_state.summary_memory
+            summary_prompt_tokens, summary_completion_tokens = summary_memory.take_usage(model_version)
+            prompt_tokens += summary_prompt_tokens
+            completion_tokens += summary_completion_tokens
 
         except openai.error.RateLimitError as e:  # type: ignore
-            logger.warn(traceback.format_exc())
+            logger.warning(traceback.format_exc())
+            # エラーで完了したジョブは、エラーを表示したものとして次の実行で再表示しない
+            if job.is_done:
+                self.release_generation_job(job)
             err_content_message = "The execution interval is too short. Wait a minute and try again."
             with st.chat_message(Role.SYSTEM.value):
                 st.markdown(err_content_message)
-            return True, "", ""
+            return True, 0, 0
 
         except Exception as e:
-            logger.warn(traceback.format_exc())
+            logger.warning(traceback.format_exc())
+            if job.is_done:
+                self.release_generation_job(job)
             err_content_message = "Unexpected error. Contact the administrator."
             with st.chat_message(Role.SYSTEM.value):
                 st.markdown(err_content_message)
-            return True, "", ""
+            return True, 0, 0
+
+        return False, prompt_tokens, completion_tokens
+
+    @staticmethod
+    def release_generation_job(job: GenerationJob) -> None:
+        """表示を終えたジョブをセッションステートから削除します（後から投入された別のジョブは削除しません）。"""
+        if st.session_state.get("generation_job") is job:
+            del st.session_state["generation_job"]
 
-        # 会話履歴のトークン数を取得するため、文字列に変換
-        converted_historys = [item["content"] for item in messages_with_history]
-        converted_history = " ".join(converted_historys)
+    # アシスタントのチャット応答を生成する関数
+    @log_decorator(logger)
+    def generate_assistant_chat_response(
+        self, model_version: str, llm: ModelParameters
+    ) -> Tuple[bool, int, int]:
+        """
+        OpenAIのChat APIを使用してアシスタントのチャット応答を生成します。
+
+        応答の生成をワーカープールに投入し、完了するまで受信した応答を表示します。
+
+        Args:
+            model_version (str): 選択された言語モデルのキー。
+            llm(ModelParameters): 会話を行う際のGPTモデルとそのパラメータ
+
+        Returns:
+            bool: エラーが発生した場合はTrue、それ以外はFalse。
+            int: 送信したプロンプトのトークン数。
+            int: 受信したコンプリーションのトークン数。
+        """
+        try:
+            job = self.submit_assistant_chat_response(model_version, llm)
+        except openai.error.RateLimitError as e:  # type: ignore
+            # ワーカープールが満杯の場合
+            logger.warning(traceback.format_exc())
+            err_content_message = "The execution interval is too short. Wait a minute and try again."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            return True, 0, 0
 
-        return False, converted_history, assistant_chat
+        return self.attach_generation_job(job)
@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+from logging import Logger
+import os
+import threading
+import uuid
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import openai
+
+from chat_session.SingleFlight import Flight
+from chat_session.stream_metrics import StreamMetrics
+from logs.app_logger import set_logging
+
+logger: Logger = set_logging("lower.sub")
+
+# 同時に応答を生成するワーカー数と、空きを待つことができるジョブ数の既定値
+DEFAULT_MAX_WORKERS: int = 16
+DEFAULT_MAX_QUEUED_JOBS: int = 32
+
+
+class GenerationJob:
+    """
+    1回のアシスタントの応答生成を表すジョブ。
+
+    応答はワーカースレッドで生成し、受信した差分はジョブ内に保持する。
+    Streamlitのスクリプトが再実行されても生成は中断されず、再実行後のスクリプトは
+    subscribe で受信済みの差分から表示を再開できる。
+    cancel で生成を打ち切った場合は、それまでに受信した応答を text に保持する。
+    metrics を指定した場合は、差分の受信とストリーミングの終了を記録する。
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        start: Callable[[], Iterable[Optional[str]]],
+        prompt_tokens: int = 0,
+        dropped_message_count: int = 0,
+        is_cached: bool = False,
+        on_complete: Optional[Callable[[str], None]] = None,
+        metrics: Optional[StreamMetrics] = None,
+    ) -> None:
+        self.model_version = model_version
+        # ジョブごとに異なるウィジェットのキーなどに使用する識別子
+        self.job_id = uuid.uuid4().hex
+        self.prompt_tokens = prompt_tokens
+        self.dropped_message_count = dropped_message_count
+        # キャッシュした応答を返すジョブかどうか（Chat APIを呼び出さないため課金されない）
+        self.is_cached = is_cached
+        # 他のセッションで実行中の同一リクエストの応答を共有したジョブかどうか（同様に課金されない）
+        self.is_shared = False
+        self.text = ""
+        self.error: Optional[BaseException] = None
+        self.is_cancelled = False
+        self.metrics = metrics
+        self._start = start
+        self._on_complete = on_complete
+        self._chunks: List[str] = []
+        self._stream: Optional[Iterable[Optional[str]]] = None
+        self._flight = Flight()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def run(self) -> None:
+        """応答を最後まで受信する。ワーカースレッドから呼び出される。"""
+        error: Optional[BaseException] = None
+        try:
+            with self._lock:
+                if self.is_cancelled:
+                    return
+            self._stream = self._start()
+            for delta in self._stream:
+                if not delta:
+                    continue
+                with self._lock:
+                    if self.is_cancelled:
+                        return
+                    self._chunks.append(delta)
+                if self.metrics is not None:
+                    self.metrics.observe_delta()
+                self._flight.publish(delta)
+            with self._lock:
+                if self.is_cancelled:
+                    return
+                self.text = "".join(self._chunks)
+            if self._on_complete is not None:
+                self._on_complete(self.text)
+        except BaseException as e:
+            error = e
+        finally:
+            if self.is_cancelled:
+                # 受信の開始前に打ち切られた場合や、ジェネレーターのため cancel で閉じられなかった場合
+                close = getattr(self._stream, "close", None)
+                if close is not None:
+                    close()
+            self._complete(error)
+
+    def cancel(self) -> bool:
+        """
+        生成を打ち切る。購読者にはそれまでに受信した応答の後に終了を通知し、上流のストリームを閉じる。
+
+        Returns:
+            bool: 打ち切った場合はTrue、すでに完了していた場合はFalse。
+        """
+        with self._lock:
+            if self._done.is_set() or self.is_cancelled:
+                return False
+            self.is_cancelled = True
+            self.text = "".join(self._chunks)
+        self._complete(None)
+        close = getattr(self._stream, "close", None)
+        if close is not None and not inspect.isgenerator(self._stream):
+            close()
+        logger.info(f"Cancelled generation for {self.model_version} after {len(self.text)} characters")
+        return True
+
+    def _complete(self, error: Optional[BaseException]) -> None:
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.error = error
+            self._done.set()
+        if self.metrics is not None:
+            if error is not None:
+                self.metrics.finish("error")
+            else:
+                self.metrics.finish("cancelled" if self.is_cancelled else "completed")
+        self._flight.finish(error)
+
+    def subscribe(self) -> Iterator[Optional[str]]:
+        """受信済みの差分を先頭から返し、以降は受信するたびに返す。生成時のエラーはそのまま送出する。"""
+        return self._flight.subscribe()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """生成が完了するまで待機する。完了した場合はTrueを返す。"""
+        return self._done.wait(timeout)
+
+
+class GenerationJobPool:
+    """
+    応答生成のジョブを実行するプロセス全体で共有するワーカープール。
+
+    実行中と待機中のジョブの合計が上限に達している場合は、新しいジョブを受け付けずに
+    RateLimitErrorを送出する。これにより、負荷が高い場合でもワーカーの待ち行列が際限なく伸びない。
+    """
+
+    def __init__(
+        self, max_workers: int = DEFAULT_MAX_WORKERS, max_queued_jobs: int = DEFAULT_MAX_QUEUED_JOBS
+    ) -> None:
+        self.max_jobs = max_workers + max_queued_jobs
+        # 受け付けなかったジョブ数（計測用）
+        self.rejected_jobs = 0
+        self._active_jobs = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+
+    @property
+    def active_jobs(self) -> int:
+        """実行中と待機中のジョブ数を返す。"""
+        with self._lock:
+            return self._active_jobs
+
+    def submit(self, job: GenerationJob) -> GenerationJob:
+        """
+        ジョブをワーカーに投入する。
+
+        Raises:
+            openai.error.RateLimitError: 実行中と待機中のジョブ数が上限に達している場合。
+        """
+        with self._lock:
+            if self._active_jobs >= self.max_jobs:
+                self.rejected_jobs += 1
+                raise openai.error.RateLimitError(  # type: ignore
+                    f"Too many generation jobs are running ({self._active_jobs}): retry later"
+                )
+            self._active_jobs += 1
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: GenerationJob) -> None:
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._active_jobs -= 1
+
+
+_generation_job_pool: Optional[GenerationJobPool] = None
+_generation_job_pool_lock = threading.Lock()
+
+
+def get_generation_job_pool() -> GenerationJobPool:
+    """
+    プロセス全体で共有するワーカープールを返す。
+
+    ワーカー数と待機できるジョブ数は、環境変数 GENERATION_MAX_WORKERS・GENERATION_MAX_QUEUED_JOBS から読み込む。
+    """
+    global _generation_job_pool
+    if _generation_job_pool is None:
+        with _generation_job_pool_lock:
+            if _generation_job_pool is None:
+                _generation_job_pool = GenerationJobPool(
+                    max_workers=int(os.getenv("GENERATION_MAX_WORKERS", str(DEFAULT_MAX_WORKERS))),
+                    max_queued_jobs=int(
+                        os.getenv("GENERATION_MAX_QUEUED_JOBS", str(DEFAULT_MAX_QUEUED_JOBS))
+                    ),
+                )
+    return _generation_job_pool
@@ -0,0 +1,279 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+from decimal import Decimal
+import inspect
+from logging import Logger
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import streamlit as st
+
+from chat_session.ChatSession import ChatSession
+from chat_session.StreamingRenderer import StreamingRenderer
+from costs.get_conversation_cost import get_conversation_cost
+from costs.get_token_count import get_prompt_token_count, get_tiktoken_count
+from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+from data_source.openai_data_source import MODELS, Role
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+
+logger: Logger = set_logging("lower.sub")
+
+# 同時に比較できるモデル数の上限（MODELSの全モデルを同時に実行できる数）
+_comparison_executor = ThreadPoolExecutor(
+    max_workers=max(len(MODELS), 1) * 4, thread_name_prefix="model-comparison"
+)
+
+
+class StreamEvent:
+    DELTA = "delta"
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(
+        self,
+        model_version: str,
+        kind: str,
+        elapsed: float,
+        delta: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        self.model_version = model_version
+        self.kind = kind
+        # 比較の開始からの経過秒数
+        self.elapsed = elapsed
+        self.delta = delta
+        self.error = error
+
+
+class ComparisonResult:
+    def __init__(self, model_version: str) -> None:
+        self.model_version = model_version
+        self.text = ""
+        self.time_to_first_token: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost: Optional[Decimal] = None
+        self.error: Optional[BaseException] = None
+
+
+def fan_out_streams(
+    streams: Dict[str, Callable[[], Iterable[Optional[str]]]],
+    executor: ThreadPoolExecutor = _comparison_executor,
+    clock: Callable[[], float] = time.perf_counter,
+) -> Iterator[StreamEvent]:
+    """
+    複数のストリームを並行して受信し、受信したイベントを到着順に返す。
+
+    各ストリームはワーカースレッドで受信し、受信した差分はキューを通じて呼び出し元のスレッドに渡す。
+    すべてのストリームが完了（またはエラー）した時点で終了する。
+    完了前に呼び出し元が受信をやめた場合（再実行でスクリプトが中断された場合など）は、
+    受信中のストリームを閉じて打ち切り、上流での生成と課金を止める。
+
+    Args:
+        streams (Dict[str, Callable[[], Iterable[Optional[str]]]]): モデルのキーと、
+            そのモデルのストリームを開始する関数。
+        executor (ThreadPoolExecutor): ストリームを受信するワーカー。
+        clock (Callable[[], float]): 経過時間の計測に使用する時計。
+
+    Yields:
+        StreamEvent: 受信した差分、完了、エラーのいずれかのイベント。
+    """
+    events: "queue.Queue[StreamEvent]" = queue.Queue()
+    started_at = clock()
+    cancelled = threading.Event()
+    # 受信中のストリーム（打ち切る際に閉じる）
+    upstreams: List[Iterable[Optional[str]]] = []
+    upstreams_lock = threading.Lock()
+
+    def receive(model_version: str, start: Callable[[], Iterable[Optional[str]]]) -> None:
+        upstream: Optional[Iterable[Optional[str]]] = None
+        try:
+            if cancelled.is_set():
+                return
+            upstream = start()
+            with upstreams_lock:
+                upstreams.append(upstream)
+            # 登録より前に打ち切られた場合は、呼び出し元では閉じられないためここで閉じる
+            if cancelled.is_set():
+                return
+            for delta in upstream:
+                if cancelled.is_set():
+                    return
+                if delta:
+                    events.put(
+                        StreamEvent(model_version, StreamEvent.DELTA, clock() - started_at, delta)
+                    )
+            events.put(StreamEvent(model_version, StreamEvent.DONE, clock() - started_at))
+        except BaseException as e:
+            events.put(StreamEvent(model_version, StreamEvent.ERROR, clock() - started_at, error=e))
+        finally:
+            if cancelled.is_set():
+                # ジェネレーターは受信中のスレッドでのみ閉じることができるため、ここで閉じる
+                close = getattr(upstream, "close", None)
+                if close is not None:
+                    close()
+
+    for model_version, start in streams.items():
+        executor.submit(receive, model_version, start)
+
+    remaining = len(streams)
+    try:
+        while remaining:
+            event = events.get()
+            if event.kind != StreamEvent.DELTA:
+                remaining -= 1
+            yield event
+    finally:
+        if remaining:
+            with upstreams_lock:
+                cancelled.set()
+                abandoned_upstreams = list(upstreams)
+            for upstream in abandoned_upstreams:
+                close = getattr(upstream, "close", None)
+                if close is not None and not inspect.isgenerator(upstream):
+                    close()
+
+
+class ModelComparisonSession:
+    @log_decorator(logger)
+    def initialize_page_element(self) -> Tuple[List[str], int, float]:
+        """
+        比較ページの基本構成と、比較するモデル・パラメータを選択するサイドバーを初期化します。
+
+        Returns:
+            Tuple[List[str], int, float]: 比較するモデルのキー、max_tokens、temperature。
+        """
+        st.header("Stream-AI-Compare")
+        st.sidebar.title("Options")
+        model_versions: List[str] = st.sidebar.multiselect(
+            "Models to compare:", list(MODELS.keys()), default=list(MODELS.keys())
+        )
+        max_tokens = st.sidebar.slider(
+            "max_tokens: ",
+            min_value=1,
+            max_value=min(MODELS[key]["parameter"]["max_tokens"] for key in MODELS),
+            value=1024,
+            step=1,
+        )
+        temperature = st.sidebar.slider(
+            "temperature: ",
+            min_value=0.0,
+            max_value=min(MODELS[key]["parameter"]["max_temperature"] for key in MODELS),
+            value=0.0,
+            step=0.1,
+        )
+        return model_versions, max_tokens, temperature
+
+    @log_decorator(logger)
+    def compare(
+        self, prompt: str, model_versions: List[str], max_tokens: int, temperature: float
+    ) -> List[ComparisonResult]:
+        """
+        同じプロンプトを複数のモデルに同時に送信し、それぞれの応答を列ごとにストリーミング表示します。
+
+        各列には、最初のトークンを受信するまでの時間、応答全体の時間、トークン数、コストを表示します。
+        全体の所要時間は、最も遅いモデルの応答時間となります。
+
+        Args:
+            prompt (str): ユーザーの入力。
+            model_versions (List[str]): 比較するモデルのキー。
+            max_tokens (int): 応答の最大トークン数。
+            temperature (float): テキスト生成のためのtemperatureパラメータ。
+
+        Returns:
+            List[ComparisonResult]: モデルごとの応答と計測結果。
+        """
+        st.chat_message(Role.USER.value).markdown(prompt)
+        messages = [
+            {"role": Role.SYSTEM.value, "content": ""},
+            {"role": Role.USER.value, "content": prompt},
+        ]
+        # トークン数のキャッシュは messages に書き込まれるため、Chat APIには role と content のみを送信する
+        request_messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+
+        results: Dict[str, ComparisonResult] = {}
+        renderers: Dict[str, StreamingRenderer] = {}
+        metric_placeholders = {}
+        streams: Dict[str, Callable[[], Iterable[Optional[str]]]] = {}
+        for column, model_version in zip(st.columns(len(model_versions)), model_versions):
+            with column:
+                st.markdown(f"**{model_version}**")
+                renderers[model_version] = StreamingRenderer(st.empty())
+                metric_placeholders[model_version] = st.empty()
+
+            result = ComparisonResult(model_version)
+            result.prompt_tokens = get_prompt_token_count(messages, model_version)
+            results[model_version] = result
+            llm = ModelParameters(
+                max_tokens=min(max_tokens, MODELS[model_version]["parameter"]["max_tokens"]),
+                temperature=temperature,
+                top_p=0.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                deployment_name=MODELS[model_version]["config"]["deployment_name"],
+            )
+            streams[model_version] = functools.partial(
+                ChatSession.stream_chat_completion,
+                model_version,
+                request_messages,
+                llm,
+                result.prompt_tokens,
+            )
+
+        elapsed = 0.0
+        # 再実行でスクリプトが中断された場合も、受信中のストリームをすぐに打ち切るよう閉じる
+        with contextlib.closing(fan_out_streams(streams)) as events:
+            for event in events:
+                result = results[event.model_version]
+                renderer = renderers[event.model_version]
+                elapsed = event.elapsed
+                if event.kind == StreamEvent.DELTA:
+                    if result.time_to_first_token is None:
+                        result.time_to_first_token = event.elapsed
+                    renderer.append(event.delta)
+                    continue
+
+                result.text = renderer.finish()
+                result.duration = event.elapsed
+                if event.kind == StreamEvent.ERROR:
+                    result.error = event.error
+                    logger.warning(
+                        "".join(traceback.format_exception(event.error))  # type: ignore
+                    )
+                    metric_placeholders[event.model_version].error("Failed to generate a response.")
+                    continue
+                result.completion_tokens = get_tiktoken_count(result.text, event.model_version)
+                result.cost = self.calculate_cost(result)
+                metric_placeholders[event.model_version].caption(self.format_metrics(result))
+
+        st.caption(f"Total: {elapsed:.2f}s")
+        return list(results.values())
+
+    def calculate_cost(self, result: ComparisonResult) -> Optional[Decimal]:
+        """応答のコストを計算します。モデルの単価が設定されていない場合はNoneを返します。"""
+        config = MODELS[result.model_version]["config"]
+        if config["prompt_cost"] is None or config["completion_cost"] is None:
+            return None
+        return get_conversation_cost(
+            result.prompt_tokens,
+            result.completion_tokens,
+            config["prompt_cost"],
+            config["completion_cost"],
+        )
+
+    def format_metrics(self, result: ComparisonResult) -> str:
+        """応答の計測結果を表示用の文字列に変換します。"""
+        time_to_first_token = (
+            f"{result.time_to_first_token:.2f}s" if result.time_to_first_token is not None else "-"
+        )
+        cost = f"{result.cost} YEN" if result.cost is not None else "-"
+        return (
+            f"TTFT: {time_to_first_token} · Total: {result.duration:.2f}s · "
+            f"Tokens: {result.completion_tokens} · Cost: {cost}"
+        )
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+from data_source.lru_disk_cache import LRUDiskCache
+
+
+def make_request_key(messages: List[Dict[str, Any]], llm: ModelParameters) -> str:
+    """
+    Chat APIへのリクエストを一意に表すキーを生成する。
+
+    デプロイ名を含むModelParametersのすべての項目と、送信するメッセージの role・content から
+    安定したハッシュ値を計算する。
+
+    Args:
+        messages (List[Dict[str, Any]]): 送信するメッセージリスト。
+        llm (ModelParameters): 会話を行う際のGPTモデルとそのパラメータ。
+
+    Returns:
+        str: リクエストのキー（SHA-256の16進数表記）。
+    """
+    payload = {
+        "parameters": vars(llm),
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(LRUDiskCache[str]):
+    """
+    同一のリクエストに対するアシスタントの応答をキャッシュするクラス。
+
+    メモリ上のLRUキャッシュと、cache_dir を指定した場合はディスク上のキャッシュの2段構成とする。
+    エントリは ttl_seconds 秒経過すると無効になる。複数のスレッドから同時に使用しても安全。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: Optional[float] = 3600.0,
+        cache_dir: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__(
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+            cache_dir=cache_dir,
+            clock=clock,
+            value_field="response",
+        )
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    プロセス全体で共有する応答キャッシュを返す。
+
+    設定は環境変数 RESPONSE_CACHE_MAX_ENTRIES・RESPONSE_CACHE_TTL_SECONDS・RESPONSE_CACHE_DIR から読み込む。
+    RESPONSE_CACHE_DIR を指定しない場合はメモリ上のキャッシュのみを使用する。
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256")),
+                    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+                    cache_dir=os.getenv("RESPONSE_CACHE_DIR") or None,
+                )
+    return _response_cache
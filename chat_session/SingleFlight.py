@@ -0,0 +1,210 @@
+import inspect
+from logging import Logger
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from logs.app_logger import set_logging
+
+logger: Logger = set_logging("lower.sub")
+
+
+class Flight:
+    """
+    1つの上流ストリームの受信結果を保持し、複数の購読者に配信するクラス。
+
+    受信した差分はすべて保持するため、途中から購読を開始した場合も最初の差分から受け取れる。
+    受信中にすべての購読者が購読を解除した場合は、on_abandoned で登録した処理を呼び出す。
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[Optional[str]] = []
+        self._is_done = False
+        self._error: Optional[BaseException] = None
+        self._subscribers = 0
+        self._is_abandoned = False
+        self._abandoned_callbacks: List[Callable[[], None]] = []
+        self._condition = threading.Condition()
+
+    def publish(self, chunk: Optional[str]) -> None:
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            if self._is_done:
+                return
+            self._is_done = True
+            self._error = error
+            self._condition.notify_all()
+
+    @property
+    def is_abandoned(self) -> bool:
+        with self._condition:
+            return self._is_abandoned
+
+    def subscribe(self, is_leader: bool = True) -> "Subscription":
+        """受信済みの差分を先頭から返し、以降は受信するたびに返す購読を開始する。"""
+        with self._condition:
+            self._subscribers += 1
+        return Subscription(self, is_leader)
+
+    def on_abandoned(self, callback: Callable[[], None]) -> None:
+        """すべての購読者が受信中に購読を解除した場合に呼び出す処理を登録する。"""
+        with self._condition:
+            is_abandoned = self._is_abandoned
+            if not is_abandoned:
+                self._abandoned_callbacks.append(callback)
+        if is_abandoned:
+            callback()
+
+    def _unsubscribe(self) -> None:
+        with self._condition:
+            self._subscribers -= 1
+            # 購読の解除を待っている受信処理を起こす
+            self._condition.notify_all()
+            if self._subscribers > 0 or self._is_done or self._is_abandoned:
+                return
+            self._is_abandoned = True
+            callbacks, self._abandoned_callbacks = self._abandoned_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _iterate(self, subscription: "Subscription") -> Iterator[Optional[str]]:
+        index = 0
+        while True:
+            with self._condition:
+                while (
+                    index >= len(self._chunks) and not self._is_done and not subscription.is_closed
+                ):
+                    self._condition.wait()
+                if subscription.is_closed:
+                    return
+                chunks = self._chunks[index:]
+                is_done, error = self._is_done, self._error
+            # ロックを保持したまま呼び出し元に制御を戻さないよう、ロックの外で返す
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if is_done and index >= len(self._chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class Subscription:
+    """
+    Flightの1つの購読。上流のエラーはそのまま送出する。
+
+    close を呼び出すと購読を解除し、受信を待っている場合はその時点で終了する。
+    close は受信中のスレッドとは別のスレッドから呼び出してもよい。
+    """
+
+    def __init__(self, flight: Flight, is_leader: bool = True) -> None:
+        self.is_closed = False
+        # 上流を呼び出したリクエストの購読かどうか（Falseの場合は受信中のストリームに相乗りした購読）
+        self.is_leader = is_leader
+        self._flight = flight
+        self._iterator = flight._iterate(self)
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> "Subscription":
+        return self
+
+    def __next__(self) -> Optional[str]:
+        return next(self._iterator)
+
+    def close(self) -> None:
+        with self._lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+        self._flight._unsubscribe()
+
+
+class SingleFlight:
+    """
+    同一キーのリクエストが同時に実行されている場合に、上流の呼び出しを1回にまとめるクラス。
+
+    最初のリクエストがバックグラウンドスレッドで上流のストリームを受信し、
+    受信中に届いた同一キーのリクエストはその受信結果を購読する。
+    受信が完了したキーは破棄されるため、以降のリクエストは再び上流を呼び出す。
+    受信中にすべての購読者が購読を解除した場合は、上流のストリームを閉じて受信を打ち切る。
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        # 上流を呼び出したリクエスト数と、受信中のストリームに相乗りしたリクエスト数
+        self.leaders = 0
+        self.followers = 0
+
+    def stream(self, key: str, start: Callable[[], Iterable[Optional[str]]]) -> Subscription:
+        """
+        キーに対応するストリームを購読する。受信中のストリームがなければ start を呼び出して開始する。
+
+        Args:
+            key (str): リクエストのキー。
+            start (Callable[[], Iterable[Optional[str]]]): 上流のストリームを開始する関数。
+                戻り値が close を持つ場合、購読者がいなくなった時点で呼び出す。
+
+        Returns:
+            Subscription: 受信した差分を順に返す購読。相乗りした購読は is_leader がFalseとなる。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = Flight()
+                self._flights[key] = flight
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if is_leader:
+            threading.Thread(
+                target=self._drive, args=(key, flight, start), name="single-flight", daemon=True
+            ).start()
+        else:
+            logger.info(f"Joined in-flight request {key[:12]}")
+        return flight.subscribe(is_leader)
+
+    def _drive(self, key: str, flight: Flight, start: Callable[[], Iterable[Optional[str]]]) -> None:
+        error: Optional[BaseException] = None
+        try:
+            upstream = start()
+            flight.on_abandoned(lambda: self._abandon(key, flight, upstream))
+            for chunk in upstream:
+                if flight.is_abandoned:
+                    break
+                flight.publish(chunk)
+        except BaseException as e:
+            error = e
+        finally:
+            self._forget(key, flight)
+            flight.finish(error)
+
+    def _abandon(self, key: str, flight: Flight, upstream: Iterable[Optional[str]]) -> None:
+        # 打ち切るストリームには新たな購読者を追加しない
+        self._forget(key, flight)
+        logger.info(f"Closing abandoned request {key[:12]}")
+        # ジェネレーターは受信中のスレッド以外から閉じることができないため、
+        # 受信処理が次の差分を受け取った時点で打ち切る
+        close = getattr(upstream, "close", None)
+        if close is not None and not inspect.isgenerator(upstream):
+            close()
+
+    def _forget(self, key: str, flight: Flight) -> None:
+        # 完了したストリームには新たな購読者を追加しない
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+
+# プロセス全体で共有するインスタンス
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """プロセス全体で共有するSingleFlightを返す。"""
+    return _single_flight
@@ -0,0 +1,77 @@
+import time
+from typing import Any, Callable, List, Optional
+
+# ストリーミング中の再描画の最大回数（1秒あたり）
+DEFAULT_FRAME_RATE: float = 10.0
+# 前回の描画からこの文字数以上溜まった場合は、フレーム間隔を待たずに再描画する
+DEFAULT_CHAR_THRESHOLD: int = 500
+# ストリーミング中であることを示すカーソル
+STREAMING_CURSOR: str = "▌"
+
+
+class StreamingRenderer:
+    """
+    ストリーミングで受信したテキストを間引いてプレースホルダーに描画するクラス。
+
+    受信した差分はリストに溜めておき、一定のフレームレート、または一定の文字数が溜まった時点で
+    まとめて連結して描画する。これにより、差分ごとの再描画と文字列の再生成を避ける。
+    finishを呼び出すと、最後に受信したテキストまで必ず描画する。
+    """
+
+    def __init__(
+        self,
+        placeholder: Any,
+        frame_rate: float = DEFAULT_FRAME_RATE,
+        char_threshold: Optional[int] = DEFAULT_CHAR_THRESHOLD,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.placeholder = placeholder
+        self.frame_interval = 1.0 / frame_rate if frame_rate > 0 else 0.0
+        self.char_threshold = char_threshold
+        self.clock = clock
+        # 描画回数（計測用）
+        self.render_count = 0
+        self._text = ""
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_rendered_at: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        """これまでに受信したテキスト全体を返す。"""
+        self._merge_pending()
+        return self._text
+
+    def append(self, delta: Optional[str]) -> None:
+        """受信した差分を追加し、必要であれば再描画する。"""
+        if not delta:
+            return
+        self._pending.append(delta)
+        self._pending_chars += len(delta)
+
+        now = self.clock()
+        is_frame_elapsed = (
+            self._last_rendered_at is None or now - self._last_rendered_at >= self.frame_interval
+        )
+        is_threshold_reached = (
+            self.char_threshold is not None and self._pending_chars >= self.char_threshold
+        )
+        if is_frame_elapsed or is_threshold_reached:
+            self._render(self.text + STREAMING_CURSOR, now)
+
+    def finish(self) -> str:
+        """カーソルを外して最終的なテキストを描画し、そのテキストを返す。"""
+        text = self.text
+        self._render(text, self.clock())
+        return text
+
+    def _merge_pending(self) -> None:
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+
+    def _render(self, text: str, now: float) -> None:
+        self.placeholder.markdown(text)
+        self.render_count += 1
+        self._last_rendered_at = now
@@ -0,0 +1,221 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import Logger
+import threading
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chat_session.history_packer import get_cached_token_count
+from costs.get_token_count import TOKENS_PER_MESSAGE, get_prompt_token_count, get_tiktoken_count
+from data_source.openai_client_registry import get_openai_client
+from data_source.openai_data_source import MODELS, Role
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+
+logger: Logger = set_logging("lower.sub")
+
+# 要約を生成するバックグラウンドワーカー（プロセス全体で共有）
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary-memory")
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages below. Keep facts, decisions, names, numbers "
+    "and open questions that later turns may depend on, and keep the summary concise."
+)
+
+# (これまでの要約, 要約に取り込むメッセージ) を受け取り、
+# (新しい要約, 送信したプロンプトのトークン数, 受信したコンプリーションのトークン数) を返す関数
+Summarizer = Callable[[str, List[Dict[str, Any]]], Tuple[str, int, int]]
+
+
+def create_openai_summarizer(model_version: str) -> Summarizer:
+    """
+    OpenAIのChat APIを使用して会話を要約する関数を生成する。
+
+    応答の最大トークン数はモデルの max_response_tokens とし、チャットと同様に
+    プロンプトと最大トークン数の合計をレート制限の見積もりとして送信前に枠を確保する。
+
+    Args:
+        model_version (str): 要約に使用する言語モデルのキー。
+
+    Returns:
+        Summarizer: これまでの要約と新しいメッセージから新しい要約を生成する関数。
+    """
+    max_tokens = MODELS[model_version]["parameter"]["max_response_tokens"]
+
+    def summarize(previous_summary: str, messages: List[Dict[str, Any]]) -> Tuple[str, int, int]:
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        request_messages = [
+            {"role": Role.SYSTEM.value, "content": SUMMARY_PROMPT},
+            {
+                "role": Role.USER.value,
+                "content": f"Current summary:\n{previous_summary}\n\nNew messages:\n{conversation}",
+            },
+        ]
+        # トークン数のキャッシュが書き込まれるため、送信するメッセージとは別のコピーで数える
+        prompt_tokens = get_prompt_token_count([dict(m) for m in request_messages], model_version)
+        response = get_openai_client(model_version).create_chat_completion(
+            estimated_tokens=prompt_tokens + max_tokens,
+            messages=request_messages,
+            temperature=0,
+            max_tokens=max_tokens,
+        )
+        summary = response.choices[0].message.content  # type: ignore
+        return summary, prompt_tokens, get_tiktoken_count(summary, model_version)
+
+    return summarize
+
+
+class SummaryMemory:
+    """
+    古い会話を要約に畳み込み、要約と直近の会話だけをプロンプトとして送信するためのメモリ。
+
+    要約はバックグラウンドのワーカーで生成されるため、ストリーミング中の応答を妨げない。
+    要約が完了するまでは、それまでの要約と未要約の会話がそのまま使用される。
+    要約に消費したトークン数はモデルごとに保持し、take_usage で取り出してチャットのターンと同様に集計する。
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor = _summary_executor) -> None:
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._pending: Optional[Future] = None
+        # 要約済みのメッセージの末尾（このインデックス未満のメッセージは要約に含まれる）
+        self.summarized_until = 0
+        self.summary = ""
+        # トークン数をキャッシュするため、送信用の要約はメッセージ形式で保持する
+        self._summary_message: Optional[Dict[str, Any]] = None
+        # まだ集計していない要約のトークン数（モデルのキー -> (プロンプト, コンプリーション)）
+        self._unbilled_usage: Dict[str, Tuple[int, int]] = {}
+
+    @property
+    def is_summarizing(self) -> bool:
+        return self._pending is not None and not self._pending.done()
+
+    def build_history(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        先頭のシステムメッセージ、これまでの要約、未要約の会話からなるメッセージリストを返す。
+
+        Args:
+            messages (List[Dict[str, Any]]): 会話のメッセージリスト（古い順）。
+
+        Returns:
+            List[Dict[str, Any]]: 送信する会話履歴。
+        """
+        first_index = 1 if messages and messages[0]["role"] == Role.SYSTEM.value else 0
+        with self._lock:
+            summary_message = self._summary_message
+            start_index = max(self.summarized_until, first_index)
+        history = messages[:first_index]
+        if summary_message:
+            history.append(summary_message)
+        return history + messages[start_index:]
+
+    @log_decorator(logger)
+    def maybe_summarize(
+        self,
+        messages: List[Dict[str, Any]],
+        model_version: str,
+        threshold_tokens: int,
+        summarizer: Summarizer,
+    ) -> bool:
+        """
+        未要約の会話のトークン数が閾値を超えた場合に、古い会話の要約をバックグラウンドで開始する。
+
+        直近の会話は閾値の半分に収まる範囲で要約せずに残す。
+        既に要約を生成中の場合は何もしない。
+
+        Args:
+            messages (List[Dict[str, Any]]): 会話のメッセージリスト（古い順）。
+            model_version (str): 使用するモデルのバージョン。
+            threshold_tokens (int): 要約を開始する未要約の会話のトークン数。
+            summarizer (Summarizer): 要約を生成する関数。
+
+        Returns:
+            bool: 要約を開始した場合はTrue、それ以外はFalse。
+        """
+        if self.is_summarizing:
+            return False
+
+        first_index = 1 if messages and messages[0]["role"] == Role.SYSTEM.value else 0
+        with self._lock:
+            start_index = max(self.summarized_until, first_index)
+            previous_summary = self.summary
+
+        token_counts = [
+            get_cached_token_count(message, model_version) + TOKENS_PER_MESSAGE
+            for message in messages[start_index:]
+        ]
+        if sum(token_counts) <= threshold_tokens:
+            return False
+
+        # 直近の会話を閾値の半分に収まる範囲で残し、それより古い会話を要約する
+        recent_tokens = 0
+        cutoff_index = len(messages)
+        for i in range(len(messages) - 1, start_index - 1, -1):
+            recent_tokens += token_counts[i - start_index]
+            if recent_tokens > threshold_tokens // 2:
+                break
+            cutoff_index = i
+        if cutoff_index <= start_index:
+            return False
+
+        messages_to_summarize = [
+            {"role": m["role"], "content": m["content"]} for m in messages[start_index:cutoff_index]
+        ]
+        logger.info(f"Summarizing messages [{start_index}, {cutoff_index}) in background")
+        self._pending = self._executor.submit(
+            self._summarize,
+            summarizer,
+            model_version,
+            previous_summary,
+            messages_to_summarize,
+            cutoff_index,
+        )
+        return True
+
+    def take_usage(self, model_version: str) -> Tuple[int, int]:
+        """
+        完了した要約で消費した、まだ集計していないトークン数を返し、集計済みとする。
+
+        Args:
+            model_version (str): 要約に使用した言語モデルのキー。
+
+        Returns:
+            Tuple[int, int]: プロンプトとコンプリーションのトークン数。
+        """
+        with self._lock:
+            return self._unbilled_usage.pop(model_version, (0, 0))
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """生成中の要約があれば完了まで待機する。"""
+        pending = self._pending
+        if pending is not None:
+            pending.exception(timeout=timeout)
+
+    def _summarize(
+        self,
+        summarizer: Summarizer,
+        model_version: str,
+        previous_summary: str,
+        messages: List[Dict[str, Any]],
+        cutoff_index: int,
+    ) -> None:
+        try:
+            summary, prompt_tokens, completion_tokens = summarizer(previous_summary, messages)
+        except Exception:
+            # 要約に失敗した場合は未要約の会話をそのまま送信し続け、次のターンで再試行する
+            logger.warning(traceback.format_exc())
+            return
+        with self._lock:
+            unbilled_prompt_tokens, unbilled_completion_tokens = self._unbilled_usage.get(
+                model_version, (0, 0)
+            )
+            self._unbilled_usage[model_version] = (
+                unbilled_prompt_tokens + prompt_tokens,
+                unbilled_completion_tokens + completion_tokens,
+            )
+            self.summary = summary
+            self._summary_message = {
+                "role": Role.SYSTEM.value,
+                "content": f"Summary of the earlier conversation:\n{summary}",
+            }
+            self.summarized_until = cutoff_index
@@ -0,0 +1,95 @@
+from logging import Logger
+from typing import Any, Dict, List
+
+from costs.get_token_count import (
+    TOKEN_COUNT_KEY,
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+    get_message_token_counts,
+)
+from data_source.openai_data_source import Role
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+
+logger: Logger = set_logging("lower.sub")
+
+
+class PackedHistory:
+    def __init__(
+        self,
+        messages: List[Dict[str, Any]],
+        dropped_messages: List[Dict[str, Any]],
+        prompt_tokens: int,
+    ) -> None:
+        # Chat APIに送信するメッセージ（role と content のみ）
+        self.messages = messages
+        # トークン数の上限に収まらず、送信対象から外れたメッセージ（古い順）
+        self.dropped_messages = dropped_messages
+        # 送信するメッセージのプロンプトのトークン数
+        self.prompt_tokens = prompt_tokens
+
+
+def get_cached_token_count(message: Dict[str, Any], model_version: str) -> int:
+    """
+    メッセージにキャッシュされた本文のトークン数を返す。未計算の場合はその場で計算する。
+
+    Args:
+        message (Dict[str, Any]): 会話のメッセージ。
+        model_version (str): 使用するモデルのバージョン。
+
+    Returns:
+        int: メッセージの本文のトークン数。
+    """
+    token_count = message.get(TOKEN_COUNT_KEY, {}).get(model_version)
+    if token_count is None:
+        token_count = get_message_token_counts([message], model_version)[0]
+    return token_count
+
+
+@log_decorator(logger)
+def pack_history(
+    messages: List[Dict[str, Any]], model_version: str, max_prompt_tokens: int
+) -> PackedHistory:
+    """
+    プロンプトのトークン数の上限に収まるように、送信する会話履歴を選択する。
+
+    先頭のシステムメッセージは常に送信対象とし、残りの予算に収まる範囲で新しいメッセージから順に選択する。
+    各メッセージのトークン数はキャッシュ済みの値を使用し、予算を超えた時点で走査を打ち切るため、
+    計算量は送信対象となるメッセージ数に比例する。
+    最新のメッセージは予算を超える場合でも必ず送信対象とする。
+
+    Args:
+        messages (List[Dict[str, Any]]): 会話のメッセージリスト（古い順）。
+        model_version (str): 使用するモデルのバージョン。
+        max_prompt_tokens (int): プロンプトのトークン数の上限。
+
+    Returns:
+        PackedHistory: 送信するメッセージと送信対象から外れたメッセージ。
+    """
+    # 先頭のシステムメッセージは常に送信対象とする
+    has_system_message = bool(messages) and messages[0]["role"] == Role.SYSTEM.value
+    first_index = 1 if has_system_message else 0
+    prompt_tokens = TOKENS_PER_REPLY
+    if has_system_message:
+        prompt_tokens += get_cached_token_count(messages[0], model_version) + TOKENS_PER_MESSAGE
+
+    # 新しいメッセージから順に、予算に収まる範囲で選択する
+    oldest_selected_index = len(messages)
+    for i in range(len(messages) - 1, first_index - 1, -1):
+        message_tokens = get_cached_token_count(messages[i], model_version) + TOKENS_PER_MESSAGE
+        is_latest = i == len(messages) - 1
+        if prompt_tokens + message_tokens > max_prompt_tokens and not is_latest:
+            break
+        prompt_tokens += message_tokens
+        oldest_selected_index = i
+
+    selected_messages = messages[:first_index] + messages[oldest_selected_index:]
+    packed_messages = [{"role": m["role"], "content": m["content"]} for m in selected_messages]
+    dropped_messages = messages[first_index:oldest_selected_index]
+
+    if dropped_messages:
+        logger.info(
+            f"{len(dropped_messages)} messages were dropped to fit max_prompt_tokens={max_prompt_tokens}"
+        )
+
+    return PackedHistory(packed_messages, dropped_messages, prompt_tokens)
@@ -0,0 +1,63 @@
+import functools
+from typing import List, Tuple
+
+from data_source.openai_data_source import Role
+
+# 通常表示する直近のメッセージ数
+HISTORY_WINDOW_SIZE: int = 20
+# 「Load earlier messages」を1回押すごとに追加で表示するメッセージ数
+HISTORY_PAGE_SIZE: int = 20
+
+# (role, content) のタプル
+HistoryItem = Tuple[str, str]
+
+
+def split_history_window(
+    message_count: int, loaded_pages: int, window_size: int = HISTORY_WINDOW_SIZE
+) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    会話履歴を、直近のウィンドウと読み込み済みの過去ページの範囲に分割する。
+
+    過去ページの境界は会話の先頭から HISTORY_PAGE_SIZE 件ごとに固定するため、
+    会話が増えても確定したページの内容は変わらず、描画結果のキャッシュを再利用できる。
+
+    Args:
+        message_count (int): 会話のメッセージ数。
+        loaded_pages (int): 読み込み済みの過去ページ数。
+        window_size (int): 通常表示する直近のメッセージ数。
+
+    Returns:
+        Tuple[int, List[Tuple[int, int]]]: 直近のウィンドウの開始位置と、
+        表示する過去ページの (開始位置, 終了位置) のリスト（古い順）。
+    """
+    recent_start = max(0, message_count - window_size)
+    page_ranges: List[Tuple[int, int]] = []
+    page_end = recent_start
+    while page_end > 0 and len(page_ranges) < loaded_pages:
+        # 直近のウィンドウに接するページは、ページ境界からウィンドウの開始位置までの端数となる
+        page_start = ((page_end - 1) // HISTORY_PAGE_SIZE) * HISTORY_PAGE_SIZE
+        page_ranges.append((page_start, page_end))
+        page_end = page_start
+    page_ranges.reverse()
+    return recent_start, page_ranges
+
+
+@functools.lru_cache(maxsize=256)
+def render_history_page(page: Tuple[HistoryItem, ...]) -> str:
+    """
+    過去ページのメッセージを1つのマークダウンに変換する。
+
+    同じ内容のページは再実行のたびに変換せず、キャッシュした結果を返す。
+
+    Args:
+        page (Tuple[HistoryItem, ...]): ページ内のメッセージの (role, content) のタプル。
+
+    Returns:
+        str: ページ全体のマークダウン。
+    """
+    blocks = [
+        f"**{role.title()}:** {content}"
+        for role, content in page
+        if role in (Role.USER.value, Role.ASSISTANT.value)
+    ]
+    return "\n\n---\n\n".join(blocks)
@@ -3,9 +3,10 @@ import datetime
 from logging import Logger
 import os
 from typing import Any, Dict, List, Tuple, Union
-import openai
 
 import streamlit as st
+from chat_session.ResponseCache import get_response_cache
+from chat_session.SummaryMemory import SummaryMemory
 from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
 from data_source.openai_data_source import MODELS, Role
 from logs.app_logger import set_logging
@@ -109,6 +110,55 @@ def clear_conversations() -> None:
         st.session_state.costs = []
         st.session_state.prompt_tokens = []
         st.session_state.completion_tokens = []
+        st.session_state.dropped_messages = []
+        st.session_state.history_loaded_pages = 0
+        st.session_state.summary_memory = SummaryMemory()
+        # 生成中の応答は打ち切って破棄し、削除後の会話に追加しない
+        # （打ち切らない場合、ワーカーは上流のストリームを最後まで受信し続けて課金される）
+        generation_job = st.session_state.pop("generation_job", None)
+        if generation_job is not None:
+            generation_job.cancel()
+
+
+# 古い会話を要約して送信するメモリの設定を初期化する関数
+@log_decorator(logger)
+def initialize_memory_options() -> None:
+    """
+    サイドバーに会話の要約メモリの設定を追加する。
+
+    有効にすると、未要約の会話のトークン数がモデルのmax_prompt_tokensに対して
+    指定した割合を超えた時点で、古い会話がバックグラウンドで要約に畳み込まれる。
+    設定値はウィジェットのキーを通じてセッションステートに保存される。
+    """
+    st.sidebar.markdown("## Memory")
+    st.sidebar.checkbox("Summarize older turns", value=False, key="use_summary_memory")
+    st.sidebar.slider(
+        "Summarize when history exceeds (ratio of max_prompt_tokens): ",
+        min_value=0.1,
+        max_value=1.0,
+        value=0.75,
+        step=0.05,
+        key="summary_threshold_ratio",
+    )
+
+
+# 同一リクエストの応答キャッシュの設定を初期化する関数
+@log_decorator(logger)
+def initialize_response_cache_options() -> None:
+    """
+    サイドバーに応答キャッシュの設定と、キャッシュのヒット数・ミス数を表示する。
+
+    有効にすると、送信する会話履歴とモデルのパラメータがすべて一致するリクエストには
+    Chat APIを呼び出さず、キャッシュした応答を返す。設定値はセッションステートに保存される。
+    """
+    st.sidebar.markdown("## Response Cache")
+    st.sidebar.checkbox(
+        "Reuse responses for identical requests",
+        value=os.getenv("RESPONSE_CACHE_ENABLED", "").lower() in ("1", "true"),
+        key="use_response_cache",
+    )
+    cache_stats = get_response_cache().stats()
+    st.sidebar.caption(f"Hits: {cache_stats['hits']} / Misses: {cache_stats['misses']}")
 
 
 @log_decorator(logger)
@@ -159,13 +209,8 @@ def select_model(
     model_config: Dict[str, Any] = MODELS[model_version]["config"]
 
     # OpenAI APIの設定をセッションステートに保存
+    # 接続情報はモデルごとのクライアント（get_openai_client）が保持するため、openaiモジュールには設定しない
     st.session_state["openai_model"] = model_config["model_version"]
-    openai.api_type, openai.api_base, openai.api_version, openai.api_key = (
-        model_config["api_type"],
-        model_config["base_url"],
-        model_config["api_version"],
-        model_config["api_key"],
-    )
 
     # 選択されたモデルのパラメータを設定
     language_model_parameters = ModelParameters(
@@ -213,6 +258,14 @@ def initialize_sidebar() -> Tuple[Union[str, Any], int, float, float, float, flo
     display_total_costs()
     draw_sidebar_divider()  # セクションの区切り線
 
+    # 会話の要約メモリの設定
+    initialize_memory_options()
+    draw_sidebar_divider()
+
+    # 応答キャッシュの設定
+    initialize_response_cache_options()
+    draw_sidebar_divider()
+
     # セクション2: モデルパラメータ
     st.sidebar.header("Model Parameters")
     model_parameter = MODELS[model_version]["parameter"]
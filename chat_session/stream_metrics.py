@@ -0,0 +1,160 @@
+from logging import Logger
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from logs.app_logger import METRICS_LOGGER_NAME, set_logging
+from logs.metrics import REGISTRY, MetricsRegistry
+
+# 計測値はApplication Insightsのハンドラを設定した専用のロガーに出力する
+metrics_logger: Logger = set_logging(METRICS_LOGGER_NAME)
+
+T = TypeVar("T")
+
+TIME_TO_FIRST_TOKEN_METRIC = "chat_time_to_first_token_seconds"
+INTER_TOKEN_GAP_METRIC = "chat_inter_token_gap_seconds"
+STREAM_DURATION_METRIC = "chat_stream_duration_seconds"
+TOKENS_PER_SECOND_METRIC = "chat_completion_tokens_per_second"
+RENDER_TIME_METRIC = "chat_render_seconds"
+NETWORK_WAIT_METRIC = "chat_network_wait_seconds"
+STREAMS_METRIC = "chat_streams_total"
+COMPLETION_TOKENS_METRIC = "chat_completion_tokens_total"
+
+# 差分の受信間隔は数ミリ秒から数十ミリ秒が中心となるため、既定より細かいバケットを使用する
+INTER_TOKEN_GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class StreamMetrics:
+    """
+    1回のアシスタントの応答のストリーミングを計測し、モデルごとのメトリクスに記録するクラス。
+
+    最初の差分までの時間（TTFT）は生成されたとき（ジョブの投入時）から計測するため、
+    ワーカーの空き待ちやレート制限による待機も含む。
+    ワーカースレッドで observe_delta・finish を、表示するスレッドで track・record を呼び出す。
+    record はジョブごとに1回だけメトリクスに記録し、計測値のロガー（lower.sub.metrics）に
+    custom_dimensions として出力する。INSTRUMENTATION_KEY を設定している場合は、
+    このロガーのAzureLogHandlerからApplication Insightsにも送信する。
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        registry: MetricsRegistry = REGISTRY,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.model_version = model_version
+        self.clock = clock
+        self.started_at = clock()
+        self.first_delta_at: Optional[float] = None
+        self.last_delta_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.delta_count = 0
+        self.status: Optional[str] = None
+        # 表示するスレッドで差分の受信を待った時間と、受信した差分の描画にかかった時間（秒）
+        self.network_wait_seconds = 0.0
+        self.render_seconds = 0.0
+        self.is_recorded = False
+
+        labels = {"model": model_version}
+        self._registry = registry
+        self._time_to_first_token = registry.histogram(TIME_TO_FIRST_TOKEN_METRIC, labels)
+        self._inter_token_gap = registry.histogram(
+            INTER_TOKEN_GAP_METRIC, labels, INTER_TOKEN_GAP_BUCKETS
+        )
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_delta_at is None:
+            return None
+        return self.first_delta_at - self.started_at
+
+    @property
+    def stream_duration(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def observe_delta(self) -> None:
+        """差分を受信したときに呼び出す。最初の差分まではTTFT、以降は前回の差分からの間隔を記録する。"""
+        now = self.clock()
+        if self.last_delta_at is None:
+            self.first_delta_at = now
+            self._time_to_first_token.observe(now - self.started_at)
+        else:
+            self._inter_token_gap.observe(now - self.last_delta_at)
+        self.last_delta_at = now
+        self.delta_count += 1
+
+    def finish(self, status: str) -> None:
+        """ストリーミングが終了したときに呼び出す。status は completed・cancelled・error のいずれか。"""
+        if self.finished_at is not None:
+            return
+        self.finished_at = self.clock()
+        self.status = status
+        labels = {"model": self.model_version}
+        self._registry.histogram(STREAM_DURATION_METRIC, labels).observe(
+            self.finished_at - self.started_at
+        )
+        self._registry.counter(STREAMS_METRIC, {**labels, "status": status}).inc()
+
+    def track(self, deltas: Iterable[T]) -> Iterator[T]:
+        """
+        deltas をそのまま返し、差分の受信を待った時間と、呼び出し元が差分を処理（描画）した時間を計測する。
+        """
+        iterator = iter(deltas)
+        while True:
+            waiting_since = self.clock()
+            try:
+                delta = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                resumed_at = self.clock()
+                self.network_wait_seconds += resumed_at - waiting_since
+            yield delta
+            self.render_seconds += self.clock() - resumed_at
+
+    def record(self, completion_tokens: int) -> None:
+        """
+        応答の表示が完了したときに呼び出し、1秒あたりのコンプリーションのトークン数と表示にかかった時間を記録する。
+
+        1秒あたりのトークン数は、最初の差分から最後の差分までの時間で求める。
+        """
+        if self.is_recorded:
+            return
+        self.is_recorded = True
+        labels = {"model": self.model_version}
+        self._registry.counter(COMPLETION_TOKENS_METRIC, labels).inc(completion_tokens)
+        self._registry.histogram(RENDER_TIME_METRIC, labels).observe(self.render_seconds)
+        self._registry.histogram(NETWORK_WAIT_METRIC, labels).observe(self.network_wait_seconds)
+        tokens_per_second = self.tokens_per_second(completion_tokens)
+        if tokens_per_second is not None:
+            self._registry.histogram(
+                TOKENS_PER_SECOND_METRIC, labels, TOKENS_PER_SECOND_BUCKETS
+            ).observe(tokens_per_second)
+        metrics_logger.info(
+            f"Chat stream metrics: {self.model_version}",
+            extra={"custom_dimensions": self.to_dimensions(completion_tokens)},
+        )
+
+    def tokens_per_second(self, completion_tokens: int) -> Optional[float]:
+        if self.first_delta_at is None or self.last_delta_at is None:
+            return None
+        generation_seconds = self.last_delta_at - self.first_delta_at
+        if generation_seconds <= 0:
+            return None
+        return completion_tokens / generation_seconds
+
+    def to_dimensions(self, completion_tokens: int) -> Dict[str, Any]:
+        """Application Insightsの custom_dimensions として送信する計測値を返す。"""
+        return {
+            "model": self.model_version,
+            "status": self.status,
+            "time_to_first_token": self.time_to_first_token,
+            "stream_duration": self.stream_duration,
+            "delta_count": self.delta_count,
+            "completion_tokens": completion_tokens,
+            "completion_tokens_per_second": self.tokens_per_second(completion_tokens),
+            "network_wait_seconds": self.network_wait_seconds,
+            "render_seconds": self.render_seconds,
+        }
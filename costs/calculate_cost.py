@@ -1,15 +1,13 @@
 import streamlit as st
 from costs.get_conversation_cost import get_conversation_cost
-from costs.get_token_count import get_tiktoken_count
 from data_source.openai_data_source import MODELS
 
 
 def calculate_cost(
-    converted_history: str, assistant_chat: str, model_version: str, is_error: bool
+    prompt_tokens: int, completion_tokens: int, model_version: str, is_error: bool
 ) -> None:
-    prompt_tokens: int = get_tiktoken_count(converted_history, model_version)
-    completion_tokens: int = get_tiktoken_count(assistant_chat, model_version)
-    if not is_error:
+    # エラーの場合も、エラーまでに消費したトークン数がある場合は集計する
+    if not is_error or prompt_tokens or completion_tokens:
         total_cost = get_conversation_cost(
             prompt_tokens,
             completion_tokens,
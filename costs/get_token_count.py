@@ -1,12 +1,57 @@
 from logging import Logger
-import tiktoken as tk
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List
 from logs.app_logger import set_logging
 
 from logs.log_decorator import log_decorator
 
 
+if TYPE_CHECKING:
+    import tiktoken as tk
+
 logger: Logger = set_logging("lower.sub")
 
+# バッチエンコード時に使用するスレッド数
+DEFAULT_NUM_THREADS: int = 8
+
+# ChatML形式（<|im_start|>{role}\n{content}<|im_end|>\n）で本文以外にメッセージごとに付与されるトークン数
+TOKENS_PER_MESSAGE: int = 4
+# アシスタントの返答の先頭（<|im_start|>assistant）に付与されるトークン数
+TOKENS_PER_REPLY: int = 3
+# メッセージにトークン数のキャッシュを保持する際のキー
+TOKEN_COUNT_KEY: str = "tokens"
+
+# モデルごとのエンコーダをプロセス全体で共有するレジストリ
+_encodings: Dict[str, "tk.Encoding"] = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model_version: str) -> "tk.Encoding":
+    """
+    指定されたモデルバージョンのエンコーダを返す。
+
+    エンコーダはモデルごとにプロセス内で一度だけ解決され、以降の呼び出しでは
+    キャッシュされたインスタンスを返す。複数のスレッドから同時に呼び出しても安全。
+
+    Args:
+        model_version (str): 使用するモデルのバージョン。
+
+    Returns:
+        tk.Encoding: モデルに対応するエンコーダ。
+    """
+    encoding = _encodings.get(model_version)
+    if encoding is None:
+        with _encodings_lock:
+            # ロック取得待ちの間に他のスレッドが登録している可能性があるため再確認する
+            encoding = _encodings.get(model_version)
+            if encoding is None:
+                # 起動時間を短くするため、最初にトークン数を計算するときにtiktokenをインポートする
+                import tiktoken
+
+                encoding = tiktoken.encoding_for_model(model_version)
+                _encodings[model_version] = encoding
+    return encoding
+
 
 @log_decorator(logger)
 def get_tiktoken_count(target_message: str, model_version: str) -> int:
@@ -20,5 +65,76 @@ def get_tiktoken_count(target_message: str, model_version: str) -> int:
     Returns:
         int: エンコードされたメッセージのトークン数。
     """
-    encoding = tk.encoding_for_model(model_version)
-    return len(encoding.encode(target_message))
+    return len(get_encoding(model_version).encode_ordinary(target_message))
+
+
+@log_decorator(logger)
+def get_tiktoken_counts(
+    target_messages: List[str], model_version: str, num_threads: int = DEFAULT_NUM_THREADS
+) -> List[int]:
+    """
+    複数のメッセージのトークン数をまとめて計算する。
+
+    tiktokenのバッチエンコードを使用し、スレッドプールで並列にエンコードする。
+    メッセージが1件以下の場合はスレッドプールを起動せずにそのままエンコードする。
+
+    Args:
+        target_messages (List[str]): トークン数を計算する対象のメッセージのリスト。
+        model_version (str): 使用するモデルのバージョン。
+        num_threads (int): エンコードに使用するスレッド数。
+
+    Returns:
+        List[int]: 各メッセージのトークン数（入力と同じ順序）。
+    """
+    encoding = get_encoding(model_version)
+    if len(target_messages) <= 1:
+        return [len(encoding.encode_ordinary(message)) for message in target_messages]
+    encoded_messages = encoding.encode_ordinary_batch(target_messages, num_threads=num_threads)
+    return [len(tokens) for tokens in encoded_messages]
+
+
+@log_decorator(logger)
+def get_message_token_counts(messages: List[Dict[str, Any]], model_version: str) -> List[int]:
+    """
+    会話の各メッセージの本文のトークン数を返す。
+
+    計算結果はメッセージ自身の "tokens" キーにモデルごとにキャッシュされるため、
+    各メッセージは一度だけエンコードされる。未計算のメッセージはまとめてバッチで計算する。
+
+    Args:
+        messages (List[Dict[str, Any]]): 会話のメッセージリスト。
+        model_version (str): 使用するモデルのバージョン。
+
+    Returns:
+        List[int]: 各メッセージの本文のトークン数（入力と同じ順序）。
+    """
+    uncounted_messages = [
+        message
+        for message in messages
+        if model_version not in message.setdefault(TOKEN_COUNT_KEY, {})
+    ]
+    if uncounted_messages:
+        token_counts = get_tiktoken_counts(
+            [message["content"] for message in uncounted_messages], model_version
+        )
+        for message, token_count in zip(uncounted_messages, token_counts):
+            message[TOKEN_COUNT_KEY][model_version] = token_count
+    return [message[TOKEN_COUNT_KEY][model_version] for message in messages]
+
+
+def get_prompt_token_count(messages: List[Dict[str, Any]], model_version: str) -> int:
+    """
+    メッセージリストをChat APIに送信した際のプロンプトのトークン数を返す。
+
+    キャッシュ済みの各メッセージのトークン数に、ChatML形式でメッセージごとに付与される
+    トークン数と、返答の先頭に付与されるトークン数を加算する。
+
+    Args:
+        messages (List[Dict[str, Any]]): 送信するメッセージリスト。
+        model_version (str): 使用するモデルのバージョン。
+
+    Returns:
+        int: プロンプトのトークン数。
+    """
+    token_counts = get_message_token_counts(messages, model_version)
+    return sum(token_counts) + TOKENS_PER_MESSAGE * len(messages) + TOKENS_PER_REPLY
@@ -1,7 +1,9 @@
-from typing import Any, Dict, Union
-from langchain.chat_models import AzureChatOpenAI
+from typing import TYPE_CHECKING, Any, Dict, Union
 
-from data_source.openai_data_source import MODELS
+from data_source.openai_client_registry import get_openai_client
+
+if TYPE_CHECKING:
+    from langchain.chat_models import AzureChatOpenAI
 
 
 class ModelParameters:
@@ -25,20 +27,24 @@ class ModelParameters:
 
 class LangchainChatModelFactory:
     @staticmethod
-    def create_instance(temperature: float, model: Union[str, Any]) -> AzureChatOpenAI:
-        config_key: str = "config"
+    def create_instance(temperature: float, model: Union[str, Any]) -> "AzureChatOpenAI":
         """
         NOTE:
         mypyで指摘が入っているが、誤検知と思われる
         継承元のChatOpenAIクラスにはプロパティとして指摘事項の要素を受け取る記載がされている
+
+        ModelParametersのみを使用するページでlangchainを読み込まないよう、生成時にインポートする
         """
+        from langchain.chat_models import AzureChatOpenAI
+
+        client = get_openai_client(model)
         return AzureChatOpenAI(
-            openai_api_base=MODELS[model][config_key]["base_url"],  # type: ignore
-            openai_api_version=MODELS[model][config_key]["api_version"],  # type: ignore
-            deployment_name=MODELS[model][config_key]["deployment_name"],  # type: ignore
-            openai_api_key=MODELS[model][config_key]["api_key"],  # type: ignore
-            openai_api_type=MODELS[model][config_key]["api_type"],
-            model_version=MODELS[model][config_key]["model_version"],
+            openai_api_base=client.api_base,  # type: ignore
+            openai_api_version=client.api_version,  # type: ignore
+            deployment_name=client.deployment_name,  # type: ignore
+            openai_api_key=client.api_key,  # type: ignore
+            openai_api_type=client.api_type,
+            model_version=client.model_version,
             # tiktoken_model_name=os.environ.get("AZURE_OPENAI_TIKTOKEN_MODEL_NAME", "", ""),
             temperature=temperature,
         )
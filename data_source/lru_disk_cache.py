@@ -0,0 +1,131 @@
+from collections import OrderedDict
+import json
+from logging import Logger
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from logs.app_logger import set_logging
+
+logger: Logger = set_logging("lower.sub")
+
+V = TypeVar("V")
+
+
+class LRUDiskCache(Generic[V]):
+    """
+    キーごとにJSONに変換できる値をキャッシュするクラス。
+
+    メモリ上のLRUキャッシュと、cache_dir を指定した場合はディスク上のキャッシュの2段構成とする。
+    ttl_seconds を指定した場合、エントリはその秒数が経過すると無効になる。
+    ディスク上のファイルは {"created_at": 作成時刻, value_field: 値} の形式で保存する。
+    複数のスレッドから同時に使用しても安全。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: Optional[float] = None,
+        cache_dir: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+        value_field: str = "value",
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.clock = clock
+        self.value_field = value_field
+        self.hits = 0
+        self.misses = 0
+        # キー -> (作成時刻, 値)
+        self._entries: "OrderedDict[str, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[V]:
+        """キャッシュされた値を返す。存在しない、または期限切れの場合はNoneを返す。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        entry = self._read_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            # ディスクから読み込んだエントリはメモリにも保持する
+            self._store_in_memory(key, entry)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: V) -> None:
+        """値をキャッシュに保存する。"""
+        entry = (self.clock(), value)
+        with self._lock:
+            self._store_in_memory(key, entry)
+        self._write_to_disk(key, entry)
+
+    def stats(self) -> Dict[str, int]:
+        """キャッシュのヒット数・ミス数・メモリ上のエントリ数を返す。"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def clear(self) -> None:
+        """メモリ上のキャッシュとカウンタを初期化する（ディスク上のキャッシュは削除しない）。"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and self.clock() - created_at > self.ttl_seconds
+
+    def _store_in_memory(self, key: str, entry: Tuple[float, V]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")  # type: ignore
+
+    def _read_from_disk(self, key: str) -> Optional[Tuple[float, V]]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as file:
+                data: Dict[str, Any] = json.load(file)
+            # 作成時刻のないファイルは、期限を設定している場合は期限切れとして扱う
+            created_at = data.get("created_at", 0.0)
+            if self._is_expired(created_at):
+                return None
+            return created_at, data[self.value_field]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # 読み込めない、または形式の異なるファイルはキャッシュミスとして扱う
+            return None
+
+    def _write_to_disk(self, key: str, entry: Tuple[float, V]) -> None:
+        if not self.cache_dir:
+            return
+        temp_path: Optional[str] = None
+        try:
+            # 書き込み途中のファイルを読まれないよう、一時ファイルに書き込んでから置き換える
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"created_at": entry[0], self.value_field: entry[1]}, file, ensure_ascii=False)
+            os.replace(temp_path, self._disk_path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write {type(self).__name__} to disk: {e!r}")
+        finally:
+            # 置き換える前に失敗した場合は一時ファイルを残さない
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,201 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import openai
+from openai import api_requestor
+import requests
+from requests.adapters import HTTPAdapter
+
+from data_source.openai_data_source import MODELS
+from data_source.rate_limiter import get_rate_limiter, retry_with_backoff
+
+# 1つのエンドポイントに対して保持するHTTP接続の最大数
+DEFAULT_POOL_MAXSIZE: int = 32
+
+
+class ChatCompletionStream:
+    """
+    ストリーミングで受信するChat APIの応答。
+
+    close を呼び出すと受信中のHTTP接続を閉じ、上流での生成をその時点で打ち切る。
+    close は受信中のスレッドとは別のスレッドから呼び出してもよく、その場合の受信側は例外を送出せずに終了する。
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[Any],
+        responses: List[requests.Response],
+        transform: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.is_closed = False
+        self._chunks = chunks
+        self._responses = responses
+        self._transform = transform
+
+    def map(self, transform: Callable[[Any], Any]) -> "ChatCompletionStream":
+        """受信した各チャンクを transform で変換して返すストリームを返す。"""
+        return ChatCompletionStream(self._chunks, self._responses, transform)
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            for chunk in self._chunks:
+                if self.is_closed:
+                    return
+                yield self._transform(chunk) if self._transform is not None else chunk
+        except Exception:
+            # close で接続を閉じたことによる受信エラーは無視する
+            if not self.is_closed:
+                raise
+
+    def close(self) -> None:
+        self.is_closed = True
+        for response in self._responses:
+            response.close()
+
+
+class OpenAIClient:
+    """
+    MODELSの1エントリに対応するAzure OpenAIのクライアント。
+
+    接続情報を呼び出しごとに渡すため、openaiモジュールのグローバルな設定を変更しない。
+    また、keep-aliveの接続プールを持つHTTPセッションをクライアントごとに保持し、
+    リクエストのたびに接続を確立し直さないようにする。
+    """
+
+    def __init__(
+        self, model_key: str, config: Dict[str, Any], pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    ) -> None:
+        self.model_key = model_key
+        self.api_key: Optional[str] = config["api_key"]
+        self.api_base: Optional[str] = config["base_url"]
+        self.api_type: Optional[str] = config["api_type"]
+        self.api_version: Optional[str] = config["api_version"]
+        self.deployment_name: Optional[str] = config["deployment_name"]
+        self.model_version: Optional[str] = config["model_version"]
+        self.rate_limiter = get_rate_limiter(self.deployment_name, config)  # type: ignore
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # ストリーミングの応答を閉じることができるよう、送信したスレッドごとにレスポンスを記録する
+        self._captured_responses = threading.local()
+        self.session.hooks["response"].append(self._capture_response)
+
+    def credentials(self) -> Dict[str, Optional[str]]:
+        """openaiの各APIに渡す接続情報を返す。"""
+        return {
+            "api_key": self.api_key,
+            "api_base": self.api_base,
+            "api_type": self.api_type,
+            "api_version": self.api_version,
+        }
+
+    def bind_session(self) -> None:
+        """
+        呼び出し元のスレッドで、このクライアントのHTTPセッションを使用するように設定する。
+
+        openai 0.28はリクエストごとにセッションを指定できず、スレッドごとに保持するセッションを使用するため、
+        リクエストの直前にそのセッションをこのクライアントのものに差し替える。
+        作成時刻も更新し、openai側でセッションが期限切れとして閉じられないようにする。
+        """
+        api_requestor._thread_context.session = self.session
+        api_requestor._thread_context.session_create_time = time.time()
+
+    def create_chat_completion(self, estimated_tokens: int = 0, **params: Any) -> Any:
+        """
+        このクライアントのデプロイに対してChat APIを呼び出す。
+
+        送信前にデプロイのRPM・TPMの枠を確保し、枠が空くまで待機する。
+        それでも429エラーとなった場合は、待機してから再試行する。
+
+        Args:
+            estimated_tokens (int): リクエストで消費する見込みのトークン数（プロンプト + max_tokens）。
+            **params: Chat APIに渡すパラメータ。
+
+        Returns:
+            Any: Chat APIの応答。stream=True の場合は ChatCompletionStream。
+        """
+        self.rate_limiter.acquire(estimated_tokens)
+        responses: List[requests.Response] = []
+
+        def create() -> Any:
+            self.bind_session()
+            responses.clear()
+            self._captured_responses.responses = responses
+            try:
+                return openai.ChatCompletion.create(
+                    engine=self.deployment_name, **self.credentials(), **params
+                )
+            finally:
+                self._captured_responses.responses = None
+
+        result = retry_with_backoff(create)
+        if params.get("stream"):
+            return ChatCompletionStream(result, list(responses))
+        return result
+
+    def create_embedding(self, estimated_tokens: int = 0, **params: Any) -> Any:
+        """
+        このクライアントのデプロイに対してEmbedding APIを呼び出す。
+
+        Chat APIと同様に、送信前にデプロイのRPM・TPMの枠を確保し、429エラーの場合は再試行する。
+
+        Args:
+            estimated_tokens (int): リクエストで消費する見込みのトークン数。
+            **params: Embedding APIに渡すパラメータ。
+        """
+        self.rate_limiter.acquire(estimated_tokens)
+
+        def create() -> Any:
+            self.bind_session()
+            return openai.Embedding.create(
+                engine=self.deployment_name, **self.credentials(), **params
+            )
+
+        return retry_with_backoff(create)
+
+    def _capture_response(self, response: requests.Response, *args: Any, **kwargs: Any) -> None:
+        responses = getattr(self._captured_responses, "responses", None)
+        if responses is not None:
+            responses.append(response)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class OpenAIClientRegistry:
+    """MODELSのエントリごとにクライアントを1つだけ生成して保持するレジストリ。"""
+
+    def __init__(self, models: Dict[str, Dict[str, Any]] = MODELS) -> None:
+        self._models = models
+        self._clients: Dict[str, OpenAIClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_key: str) -> OpenAIClient:
+        """指定されたモデルのクライアントを返す。初回の呼び出し時に生成する。"""
+        client = self._clients.get(model_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(model_key)
+                if client is None:
+                    client = OpenAIClient(model_key, self._models[model_key]["config"])
+                    self._clients[model_key] = client
+        return client
+
+    def close(self) -> None:
+        """保持しているすべてのクライアントのHTTPセッションを閉じる。"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+# プロセス全体で共有するレジストリ
+_registry = OpenAIClientRegistry()
+
+
+def get_openai_client(model_key: str) -> OpenAIClient:
+    """プロセス全体で共有するレジストリから、指定されたモデルのクライアントを返す。"""
+    return _registry.get(model_key)
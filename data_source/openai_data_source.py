@@ -2,7 +2,6 @@ from enum import Enum, auto
 import os
 from typing import Any, Dict, Final
 from dotenv import load_dotenv
-from openai import ChatCompletion
 
 load_dotenv()
 
@@ -29,6 +28,8 @@ MODELS: Dict[str, Dict[str, Any]] = {
             "model_version": os.getenv("GPT_3_5_TURBO_API_MODEL_VERSION"),
             "prompt_cost": os.getenv("GPT_3_5_PROMPT_COST"),
             "completion_cost": os.getenv("GPT_3_5_COMPLETION_COST"),
+            "requests_per_minute": os.getenv("GPT_3_5_TURBO_REQUESTS_PER_MINUTE"),
+            "tokens_per_minute": os.getenv("GPT_3_5_TURBO_TOKENS_PER_MINUTE"),
         },
     },
     "gpt-4-turbo": {
@@ -52,11 +53,28 @@ MODELS: Dict[str, Dict[str, Any]] = {
             "model_version": os.getenv("GPT_4_TURBO_API_MODEL_VERSION"),
             "prompt_cost": os.getenv("GPT_4_TURBO_PROMPT_COST"),
             "completion_cost": os.getenv("GPT_4_TURBO_COMPLETION_COST"),
+            "requests_per_minute": os.getenv("GPT_4_TURBO_REQUESTS_PER_MINUTE"),
+            "tokens_per_minute": os.getenv("GPT_4_TURBO_TOKENS_PER_MINUTE"),
         },
     },
 }
 
 
+# PDFの検索に使用するEmbeddingモデル（未設定の場合はローカルのEmbeddingを使用する）
+EMBEDDING_MODEL: Dict[str, Any] = {
+    "config": {
+        "api_key": os.getenv("EMBEDDING_API_KEY"),
+        "base_url": os.getenv("EMBEDDING_BASE_URL"),
+        "api_version": os.getenv("EMBEDDING_API_VERSION"),
+        "api_type": os.getenv("EMBEDDING_API_TYPE"),
+        "deployment_name": os.getenv("EMBEDDING_API_DEPLOYMENT_NAME"),
+        "model_version": os.getenv("EMBEDDING_API_MODEL_VERSION"),
+        "requests_per_minute": os.getenv("EMBEDDING_REQUESTS_PER_MINUTE"),
+        "tokens_per_minute": os.getenv("EMBEDDING_TOKENS_PER_MINUTE"),
+    },
+}
+
+
 class Role(Enum):
     USER = "user"
     ASSISTANT = "assistant"
@@ -66,8 +84,15 @@ class Role(Enum):
 class BasePage(Enum):
     CHAT = "Chat"
     PDF_QA = "PDF_QA"
+    COMPARE = "Compare"
 
 
 class PDFOperateOptions(Enum):
     UPLOAD = "PDF Upload"
     QUESTION = "Ask My PDF(s)"
+    SUMMARIZE = "Summarize PDF(s)"
+
+
+class RetrievalMode(Enum):
+    DENSE = "Semantic (embeddings)"
+    LEXICAL = "Keyword (BM25)"
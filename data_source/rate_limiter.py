@@ -0,0 +1,190 @@
+from logging import Logger
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import openai
+
+from logs.app_logger import set_logging
+
+logger: Logger = set_logging("lower.sub")
+
+T = TypeVar("T")
+
+# リクエストを送信できるまで待機する最大秒数（これを超える場合は送信せずにエラーとする）
+DEFAULT_MAX_WAIT_SECONDS: float = 30.0
+# 429エラー時の再試行回数と待機時間（秒）
+DEFAULT_MAX_RETRIES: int = 3
+DEFAULT_BASE_DELAY: float = 1.0
+DEFAULT_MAX_DELAY: float = 30.0
+
+
+class TokenBucket:
+    """
+    1分あたりの上限値を、毎秒一定量ずつ補充されるバケットとして管理するクラス。
+
+    reserveは残量が足りない場合でも予約を受け付けて残量を負にし、
+    予約分が補充されるまでの待機秒数を返す。これにより、待機中のリクエストは到着順に送信される。
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.capacity = float(per_minute)
+        self.refill_rate = self.capacity / 60.0
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """amount を予約し、送信可能になるまでの待機秒数を返す。"""
+        # 上限値を超える予約は永久に満たされないため、上限値に切り詰める
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.refill_rate)
+
+    def refund(self, amount: float) -> None:
+        """予約を取り消す。"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+
+class DeploymentRateLimiter:
+    """
+    デプロイごとの1分あたりのリクエスト数（RPM）・トークン数（TPM）の上限を超えないよう、
+    送信前にリクエストを待機させるクラス。上限値がNoneの項目は制限しない。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.request_bucket = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self.max_wait_seconds = max_wait_seconds
+        self.sleep = sleep
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        1リクエスト分と tokens トークン分の枠を確保し、必要であれば確保できるまで待機する。
+
+        Args:
+            tokens (int): リクエストで消費する見込みのトークン数。
+
+        Returns:
+            float: 待機した秒数。
+
+        Raises:
+            openai.error.RateLimitError: 待機時間が max_wait_seconds を超える場合。
+        """
+        wait_seconds = 0.0
+        if self.request_bucket is not None:
+            wait_seconds = max(wait_seconds, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            wait_seconds = max(wait_seconds, self.token_bucket.reserve(tokens))
+
+        if wait_seconds > self.max_wait_seconds:
+            # 送信しても拒否されるリクエストは送信せず、予約を取り消してエラーとする
+            if self.request_bucket is not None:
+                self.request_bucket.refund(1)
+            if self.token_bucket is not None:
+                self.token_bucket.refund(tokens)
+            raise openai.error.RateLimitError(  # type: ignore
+                f"Client-side rate limit exceeded: retry after {wait_seconds:.1f} seconds"
+            )
+        if wait_seconds > 0:
+            logger.info(f"Waiting {wait_seconds:.2f} seconds for rate limit")
+            self.sleep(wait_seconds)
+        return wait_seconds
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """429エラーのレスポンスヘッダーから、再試行までの待機秒数を取得する。"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def retry_with_backoff(
+    call: Callable[[], T],
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    base_delay: float = DEFAULT_BASE_DELAY,
+    max_delay: float = DEFAULT_MAX_DELAY,
+    sleep: Callable[[float], None] = time.sleep,
+    jitter: Callable[[], float] = random.random,
+) -> T:
+    """
+    429エラー（RateLimitError）の場合に、待機してから call を再試行する。
+
+    Retry-Afterヘッダーがある場合はその秒数だけ待機し、ない場合は試行回数に応じて指数的に増加する
+    待機時間にジッターを加えて待機する。max_retries 回再試行しても失敗した場合はエラーを送出する。
+
+    Args:
+        call (Callable[[], T]): 実行する処理。
+        max_retries (int): 最大の再試行回数。
+        base_delay (float): 1回目の再試行前の待機時間の基準値（秒）。
+        max_delay (float): 待機時間の上限（秒）。
+
+    Returns:
+        T: call の戻り値。
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except openai.error.RateLimitError as e:  # type: ignore
+            if attempt >= max_retries:
+                raise
+            retry_after = get_retry_after(e)
+            backoff = min(max_delay, base_delay * 2**attempt)
+            if retry_after is not None:
+                # 複数のリクエストが同時に再試行しないよう、わずかなジッターを加える
+                delay = min(max_delay, retry_after) + backoff * 0.1 * jitter()
+            else:
+                delay = backoff * (0.5 + 0.5 * jitter())
+            logger.warning(f"Rate limited; retrying in {delay:.2f} seconds ({attempt + 1}/{max_retries})")
+            sleep(delay)
+    raise AssertionError("unreachable")
+
+
+_rate_limiters: Dict[str, DeploymentRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(deployment_name: str, config: Dict[str, Any]) -> DeploymentRateLimiter:
+    """
+    デプロイごとに1つのレート制限をプロセス全体で共有して返す。
+
+    上限値はMODELSの config の requests_per_minute・tokens_per_minute から読み込む。
+    """
+    limiter = _rate_limiters.get(deployment_name)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(deployment_name)
+            if limiter is None:
+                limiter = DeploymentRateLimiter(
+                    requests_per_minute=_to_float(config.get("requests_per_minute")),
+                    tokens_per_minute=_to_float(config.get("tokens_per_minute")),
+                )
+                _rate_limiters[deployment_name] = limiter
+    return limiter
+
+
+def _to_float(value: Any) -> Optional[float]:
+    return float(value) if value else None
@@ -1,25 +1,178 @@
-from logging import Handler
+from logging import Handler, LogRecord
+from collections import deque
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from azure.storage.blob import BlobServiceClient, BlobClient
 import datetime
 
 
+class OverflowPolicy:
+    # キューが満杯の場合、空きができるまで最大 block_timeout 秒待機し、それでも空かなければ破棄する
+    BLOCK = "block"
+    # キューが満杯の場合、新しいログを破棄する
+    DROP_NEWEST = "drop_newest"
+    # キューが満杯の場合、最も古いログを破棄して新しいログを追加する
+    DROP_OLDEST = "drop_oldest"
+
+
 class AzureBlobHandler(Handler):
-    def __init__(self, connection_string, container_name, blob_name):
+    """
+    ログをキューに溜め、バックグラウンドスレッドからまとめてAzure BlobのAppendBlobに追記するハンドラ。
+
+    emitはフォーマット済みのメッセージをキューに追加するだけで、ネットワーク通信は行わない。
+    バックグラウンドスレッドは max_batch_size 件溜まるか flush_interval 秒経過するたびに、
+    日付ごとのBlobへ1回のリクエストでまとめて追記する。
+    """
+
+    def __init__(
+        self,
+        connection_string: Optional[str] = None,
+        container_name: Optional[str] = None,
+        blob_name: Optional[str] = None,
+        max_batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_queue_size: int = 10000,
+        overflow_policy: str = OverflowPolicy.DROP_NEWEST,
+        block_timeout: float = 0.1,
+        blob_service_client: Optional[Any] = None,
+    ):
         super().__init__()
-        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        # テスト時などはBlobServiceClientと同じインターフェースを持つオブジェクトを直接渡せる
+        self.blob_service_client = blob_service_client or BlobServiceClient.from_connection_string(
+            connection_string  # type: ignore
+        )
         self.container_name = container_name
         self.blob_name = blob_name
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        # キューが満杯、またはアップロードに失敗して破棄したログの件数（_condition のロックで保護する）
+        self.dropped_records = 0
+        self.max_queue_size = max_queue_size
 
-    def emit(self, record):
-        # ログメッセージをフォーマットします。
-        message = self.format(record)
-        # 現在の日付を取得します。
-        date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-        # Blob名に日付を追加します。
-        blob_name_with_date = f"{self.blob_name}-{date}.log"
-        # Blobクライアントを取得します。
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name, blob=blob_name_with_date
-        )
-        # Blobにログメッセージを追記します。
-        blob_client.upload_blob(message + "\n", blob_type="AppendBlob", overwrite=False)
+        # 要素は (Blob名, メッセージ)。flush・closeの要求はキューに入れず、破棄されないよう別に保持する
+        self._records: Deque[Tuple[str, str]] = deque()
+        self._flush_events: List[threading.Event] = []
+        self._stopping = False
+        # キューへの追加・取り出しと、バックグラウンドスレッドの起床に使用する
+        self._condition = threading.Condition()
+        # 日付ごとのBlobクライアント（日付が変わった際に古いクライアントは破棄する）
+        self._blob_clients: Dict[str, BlobClient] = {}
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="azure-blob-log-handler", daemon=True)
+        self._worker.start()
+
+    def emit(self, record: LogRecord) -> None:
+        try:
+            # ログメッセージをフォーマットします。
+            message = self.format(record)
+            # 現在の日付を取得し、Blob名に日付を追加します。
+            date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+            blob_name_with_date = f"{self.blob_name}-{date}.log"
+            self._enqueue((blob_name_with_date, message))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout: Optional[float] = 10.0) -> None:
+        """キューに溜まっているログをすべてアップロードするまで待機する。"""
+        if self._closed or not self._worker.is_alive():
+            return
+        flushed = threading.Event()
+        with self._condition:
+            self._flush_events.append(flushed)
+            self._condition.notify_all()
+        flushed.wait(timeout)
+
+    def close(self) -> None:
+        """残っているログをアップロードしてからバックグラウンドスレッドを終了する。"""
+        if not self._closed:
+            with self._condition:
+                self._closed = True
+                self._stopping = True
+                self._condition.notify_all()
+            self._worker.join(timeout=10.0)
+        super().close()
+
+    def _enqueue(self, item: Tuple[str, str]) -> None:
+        with self._condition:
+            if len(self._records) >= self.max_queue_size and self.overflow_policy == OverflowPolicy.BLOCK:
+                self._condition.wait_for(
+                    lambda: len(self._records) < self.max_queue_size or self._closed,
+                    timeout=self.block_timeout,
+                )
+            if self._closed:
+                self.dropped_records += 1
+                return
+            if len(self._records) >= self.max_queue_size:
+                self.dropped_records += 1
+                if self.overflow_policy != OverflowPolicy.DROP_OLDEST:
+                    return
+                self._records.popleft()
+            self._records.append(item)
+            if len(self._records) >= self.max_batch_size:
+                self._condition.notify_all()
+
+    def _has_pending_work(self) -> bool:
+        return len(self._records) >= self.max_batch_size or bool(self._flush_events) or self._stopping
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            with self._condition:
+                # max_batch_size 件溜まるか、flush・closeが要求されるか、flush_interval 秒経過するまで待機する
+                self._condition.wait_for(
+                    self._has_pending_work, timeout=max(0.0, deadline - time.monotonic())
+                )
+                batch = [
+                    self._records.popleft()
+                    for _ in range(min(len(self._records), self.max_batch_size))
+                ]
+                # flush・closeの要求は、要求より前に追加されたログをすべて取り出してから完了とする
+                flush_events: List[threading.Event] = []
+                is_stopping = False
+                if not self._records:
+                    flush_events, self._flush_events = self._flush_events, []
+                    is_stopping = self._stopping
+                # BLOCKで空きを待っているemitを起こす
+                self._condition.notify_all()
+
+            self._upload(batch)
+            deadline = time.monotonic() + self.flush_interval
+            for flushed in flush_events:
+                flushed.set()
+            if is_stopping:
+                return
+
+    def _upload(self, batch: List[Tuple[str, str]]) -> None:
+        # Blobごとにメッセージをまとめ、1回のリクエストで追記する
+        messages_by_blob: Dict[str, List[str]] = {}
+        for blob_name, message in batch:
+            messages_by_blob.setdefault(blob_name, []).append(message)
+
+        for blob_name, messages in messages_by_blob.items():
+            try:
+                blob_client = self._get_blob_client(blob_name)
+                # Blobにログメッセージを追記します。
+                blob_client.upload_blob(
+                    "\n".join(messages) + "\n", blob_type="AppendBlob", overwrite=False
+                )
+            except Exception:
+                with self._condition:
+                    self.dropped_records += len(messages)
+                # ロガー経由で出力すると再帰するため、標準エラー出力に書き出す
+                traceback.print_exc(file=sys.stderr)
+
+    def _get_blob_client(self, blob_name: str) -> BlobClient:
+        blob_client = self._blob_clients.get(blob_name)
+        if blob_client is None:
+            # 日付が変わった場合は前日までのクライアントを破棄する
+            self._blob_clients.clear()
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name, blob=blob_name
+            )
+            self._blob_clients[blob_name] = blob_client
+        return blob_client
@@ -1,35 +1,93 @@
 import os
-from logging import Logger, getLogger
+import threading
+from logging import Handler, Logger, getLogger
 from logging.config import dictConfig
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from dotenv import load_dotenv
-from logs.AzureBlobHandler import AzureBlobHandler
-from opencensus.ext.azure.log_exporter import AzureLogHandler
 
 # 環境変数をロードする
 load_dotenv()
 
+# ログ設定はプロセスごとに一度だけ適用する
+_configure_lock = threading.Lock()
+_is_configured = False
+
+# 計測値を custom_dimensions としてApplication Insightsに送信するロガーの名前
+METRICS_LOGGER_NAME: str = "lower.sub.metrics"
+
+
+def _create_azure_blob_handler(**kwargs: Any) -> Handler:
+    """Azure Blobのハンドラを生成する（必要になるまでAzure SDKをインポートしない）"""
+    from logs.AzureBlobHandler import AzureBlobHandler
+
+    return AzureBlobHandler(**kwargs)
+
+
+def _create_azure_log_handler(**kwargs: Any) -> Handler:
+    """Application Insightsのハンドラを生成する（必要になるまでOpenCensusをインポートしない）"""
+    from opencensus.ext.azure.log_exporter import AzureLogHandler
+
+    return AzureLogHandler(**kwargs)
+
+
+def _has_env(*names: str) -> bool:
+    return all(os.getenv(name) for name in names)
+
 
 # ログ設定を関数で生成する
 def create_logging_config() -> Dict[str, Any]:
-    """ログ設定を生成する関数"""
+    """
+    ログ設定を生成する関数
+
+    Azure Blob・Application Insightsのハンドラは、接続に必要な環境変数が設定されている場合のみ設定に含める。
+    """
+    handlers: Dict[str, Dict[str, Any]] = {
+        "consoleHandler": {
+            "class": "logging.StreamHandler",
+            "level": "INFO",
+            "formatter": "simple",
+            "stream": "ext://sys.stdout",
+        },
+    }
+    logger_handlers: List[str] = ["consoleHandler"]
+    # 計測値（custom_dimensions）を出力するロガーのハンドラ
+    metrics_logger_handlers: List[str] = ["consoleHandler"]
+
     # Azure Blob
-    blob_connection_string = (
-        f"DefaultEndpointsProtocol=https;"
-        f"AccountName={os.getenv('STORAGE_ACCOUNT_NAME')};"
-        f"AccountKey={os.getenv('STORAGE_ACCESS_KEY')};"
-        f"EndpointSuffix=core.windows.net"
-    )
-    container_name = os.getenv("CONTAINER_NAME")
-    blob_name = f"logs/{os.getenv('BLOB_NAME')}"
+    if _has_env("STORAGE_ACCOUNT_NAME", "STORAGE_ACCESS_KEY", "CONTAINER_NAME"):
+        blob_connection_string = (
+            f"DefaultEndpointsProtocol=https;"
+            f"AccountName={os.getenv('STORAGE_ACCOUNT_NAME')};"
+            f"AccountKey={os.getenv('STORAGE_ACCESS_KEY')};"
+            f"EndpointSuffix=core.windows.net"
+        )
+        handlers["azureBlobHandler"] = {
+            "()": _create_azure_blob_handler,
+            "level": "INFO",
+            "formatter": "simple",
+            "connection_string": blob_connection_string,
+            "container_name": os.getenv("CONTAINER_NAME"),
+            "blob_name": f"logs/{os.getenv('BLOB_NAME')}",
+        }
+        logger_handlers.append("azureBlobHandler")
+        metrics_logger_handlers.append("azureBlobHandler")
 
     # Application Insights
-    app_insights_connection_string = (
-        f"InstrumentationKey={os.getenv('INSTRUMENTATION_KEY')};"
-        f"IngestionEndpoint={os.getenv('INGESTION_ENDPOINT')};"
-        f"LiveEndpoint={os.getenv('LIVE_ENDPOINT')}"
-    )
+    if _has_env("INSTRUMENTATION_KEY"):
+        app_insights_connection_string = (
+            f"InstrumentationKey={os.getenv('INSTRUMENTATION_KEY')};"
+            f"IngestionEndpoint={os.getenv('INGESTION_ENDPOINT')};"
+            f"LiveEndpoint={os.getenv('LIVE_ENDPOINT')}"
+        )
+        handlers["azureApplicationInsightsHandler"] = {
+            "()": _create_azure_log_handler,
+            "level": "INFO",
+            "formatter": "simple",
+            "connection_string": app_insights_connection_string,
+        }
+        # Application Insightsには計測値のみを送信する
+        metrics_logger_handlers.append("azureApplicationInsightsHandler")
 
     return {
         "version": 1,
@@ -39,53 +97,52 @@ def create_logging_config() -> Dict[str, Any]:
                 "format": "%(asctime)s %(name)s:%(lineno)s %(funcName)s [%(levelname)s]: %(message)s"
             }
         },
-        "handlers": {
-            "consoleHandler": {
-                "class": "logging.StreamHandler",
-                "level": "INFO",
-                "formatter": "simple",
-                "stream": "ext://sys.stdout",
-            },
-            "azureBlobHandler": {
-                "()": AzureBlobHandler,
-                "level": "INFO",
-                "formatter": "simple",
-                "connection_string": blob_connection_string,
-                "container_name": container_name,
-                "blob_name": blob_name,
-            },
-            "azureApplicationInsightsHandler": {
-                "()": AzureLogHandler,  # 使用していないが、今後Application Insightsにログ出力する場合のために保持
-                "level": "INFO",
-                "formatter": "simple",
-                "connection_string": app_insights_connection_string,
-            },
-        },
+        "handlers": handlers,
         "loggers": {
             "__main__": {
                 "level": "INFO",
-                "handlers": ["consoleHandler", "azureBlobHandler"],
+                "handlers": logger_handlers,
                 # "handlers": ["consoleHandler", "azureApplicationInsightsHandler"],
                 "propagate": False,
             },
             "same_hierarchy": {
                 "level": "INFO",
-                "handlers": ["consoleHandler", "azureBlobHandler"],
+                "handlers": logger_handlers,
                 # "handlers": ["consoleHandler", "azureApplicationInsightsHandler"],
                 "propagate": False,
             },
             "lower.sub": {
                 "level": "DEBUG",
-                "handlers": ["consoleHandler", "azureBlobHandler"],
+                "handlers": logger_handlers,
                 # "handlers": ["consoleHandler", "azureApplicationInsightsHandler"],
                 "propagate": False,
             },
+            METRICS_LOGGER_NAME: {
+                "level": "INFO",
+                "handlers": metrics_logger_handlers,
+                "propagate": False,
+            },
         },
         "root": {"level": "INFO"},
     }
 
 
+def configure_logging() -> None:
+    """
+    ログ設定をプロセスごとに一度だけ適用する。
+
+    2回目以降の呼び出しでは何もしないため、ハンドラは最初に生成したものが使い回される。
+    """
+    global _is_configured
+    if _is_configured:
+        return
+    with _configure_lock:
+        if not _is_configured:
+            dictConfig(create_logging_config())
+            _is_configured = True
+
+
 def set_logging(module_name: str) -> Logger:
-    """指定されたモジュール名のロガーを設定して返す"""
-    dictConfig(create_logging_config())
+    """指定されたモジュール名のロガーを返す（ログ設定は初回の呼び出し時のみ適用する）"""
+    configure_logging()
     return getLogger(module_name)
@@ -1,29 +1,95 @@
 import functools
+import logging
+import random
+import reprlib
+import time
 from logging import Logger
-from typing import Callable
+from typing import Any, Callable, Dict
+
+from logs.metrics import REGISTRY, Histogram
+from logs.rerun_profiler import get_active_profiler
+
+# 関数ごとの処理時間（秒）を記録するヒストグラムの名前
+CALL_DURATION_METRIC = "function_call_duration_seconds"
+
+# 引数・戻り値のログ出力に使用するrepr（大きなリストや長い文字列は省略して出力する）
+_arg_repr = reprlib.Repr()
+_arg_repr.maxlist = 5
+_arg_repr.maxdict = 5
+_arg_repr.maxstring = 80
+_arg_repr.maxother = 80
+
+
+def format_value(value: Any, max_length: int) -> str:
+    """値のreprを最大 max_length 文字に切り詰めて返す。"""
+    text = _arg_repr.repr(value)
+    if len(text) > max_length:
+        return f"{text[:max_length]}...({len(text) - max_length} chars truncated)"
+    return text
+
+
+def get_call_durations() -> Dict[str, Histogram]:
+    """log_decoratorで計測した関数ごとの処理時間のヒストグラムを返す。"""
+    return {
+        dict(label_key)["function"]: histogram
+        for label_key, histogram in REGISTRY.get_histograms(CALL_DURATION_METRIC).items()
+    }
 
 
 # log_decoratorは、ロギングを行うためのデコレータを生成するファクトリ関数です。
-def log_decorator(logger: Logger) -> Callable:
-    """関数の開始、引数、戻り値、終了時にログを出力するデコレータを生成する"""
+def log_decorator(
+    logger: Logger,
+    level: int = logging.INFO,
+    sample_rate: float = 1.0,
+    max_repr_length: int = 200,
+) -> Callable:
+    """
+    関数の開始、引数、戻り値、終了時にログを出力するデコレータを生成する
+
+    ログは logger が level で出力可能な場合のみ組み立てるため、出力しない場合は引数の文字列化を行わない。
+    sample_rate を指定すると、その割合の呼び出しのみ開始・終了のログを出力する（例外は常に出力する）。
+    処理時間はログの出力有無によらず、関数ごとにプロセス内のヒストグラムへ記録する。
+    スクリプトの実行をプロファイル中の場合は、関数名の区間としてプロファイラにも記録する。
+    """
 
     # 実際のデコレータ関数です。デコレートされる関数を引数として受け取ります。
     def decorator(func: Callable) -> Callable:
+        func_name = func.__name__
+        duration_histogram = REGISTRY.histogram(
+            CALL_DURATION_METRIC, {"function": func.__qualname__}
+        )
+
         # functools.wrapsは、デコレートされた関数のメタデータを保持するために使用されます。
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            func_name = func.__name__
-            func_args = ", ".join([repr(a) for a in args] + [f"{k}={v!r}" for k, v in kwargs.items()])
-            logger.info(f"START: {func_name} (args: {func_args})")
+            is_logged = logger.isEnabledFor(level) and (
+                sample_rate >= 1.0 or random.random() < sample_rate
+            )
+            if is_logged:
+                func_args = ", ".join(
+                    [format_value(a, max_repr_length) for a in args]
+                    + [f"{k}={format_value(v, max_repr_length)}" for k, v in kwargs.items()]
+                )
+                logger.log(level, f"START: {func_name} (args: {func_args})")
+            profiler = get_active_profiler()
+            if profiler is not None:
+                profiler.push(func_name)
+            started_at = time.perf_counter()
             try:
                 result = func(*args, **kwargs)
-                logger.info(f"Returns: {func_name} -> {result!r}")
+                if is_logged:
+                    logger.log(level, f"Returns: {func_name} -> {format_value(result, max_repr_length)}")
                 return result
             except Exception as e:
                 logger.error(f"An exception occurred: {func_name} -> {e!r}")
                 raise
             finally:
-                logger.info(f"END: {func_name}")
+                elapsed = time.perf_counter() - started_at
+                duration_histogram.observe(elapsed)
+                if profiler is not None:
+                    profiler.pop(elapsed)
+                if is_logged:
+                    logger.log(level, f"END: {func_name}")
 
         # デコレータはwrapper関数を返します。
         return wrapper
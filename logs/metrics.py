@@ -0,0 +1,204 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 処理時間（秒）の計測に使用するバケットの上限値
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# ラベルは (キー, 値) のタプルをキーの昇順に並べたもので表す
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    観測値をバケットごとに集計するヒストグラム。
+
+    観測値そのものは保持せず、バケットごとの件数・合計・最小値・最大値のみを保持するため、
+    観測回数によらずメモリ使用量は一定である。複数のスレッドから同時に記録しても安全。
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # 最後の要素は最大のバケットを超えた観測値の件数
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = float("inf")
+        self._max = float("-inf")
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value < self._min:
+                self._min = value
+            if value > self._max:
+                self._max = value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def percentile(self, q: float) -> float:
+        """
+        観測値の q パーセンタイル（0 <= q <= 100）をバケットの件数から推定する。
+
+        該当するバケット内では観測値が一様に分布しているとみなして線形補間する。
+        観測値がない場合は 0.0 を返す。
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total, lowest, highest = self._count, self._min, self._max
+        if total == 0:
+            return 0.0
+        rank = q / 100 * total
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = max(self.buckets[i - 1] if i > 0 else lowest, lowest)
+                upper = min(self.buckets[i] if i < len(self.buckets) else highest, highest)
+                return lower + (upper - lower) * max(rank - cumulative, 0) / bucket_count
+            cumulative += bucket_count
+        return highest
+
+    def snapshot(self) -> Dict[str, float]:
+        """件数・合計・平均・最小値・最大値と主要なパーセンタイルを返す。"""
+        count = self._count
+        return {
+            "count": count,
+            "sum": self._sum,
+            "mean": self._sum / count if count else 0.0,
+            "min": self._min if count else 0.0,
+            "max": self._max if count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+    def bucket_counts(self) -> List[Tuple[float, int]]:
+        """(バケットの上限値, その上限値以下の観測値の累積件数) のリストを返す。"""
+        with self._lock:
+            counts = list(self._counts)
+        result = []
+        cumulative = 0
+        for upper, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            result.append((upper, cumulative))
+        return result
+
+
+class Counter:
+    """単調に増加する値を保持するカウンタ。複数のスレッドから同時に加算しても安全。"""
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        if amount < 0:
+            raise ValueError("Counter can only be incremented")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class MetricsRegistry:
+    """名前とラベルの組み合わせごとにメトリクスを保持するプロセス内のレジストリ。"""
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, Counter]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self,
+        name: str,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """指定された名前とラベルのヒストグラムを返す。存在しない場合は生成して登録する。"""
+        label_key = _to_label_key(labels)
+        histograms = self._histograms.get(name)
+        histogram = histograms.get(label_key) if histograms is not None else None
+        if histogram is None:
+            with self._lock:
+                histograms = self._histograms.setdefault(name, {})
+                histogram = histograms.get(label_key)
+                if histogram is None:
+                    histogram = Histogram(buckets)
+                    histograms[label_key] = histogram
+        return histogram
+
+    def counter(self, name: str, labels: Optional[Dict[str, str]] = None) -> Counter:
+        """指定された名前とラベルのカウンタを返す。存在しない場合は生成して登録する。"""
+        label_key = _to_label_key(labels)
+        counters = self._counters.get(name)
+        counter = counters.get(label_key) if counters is not None else None
+        if counter is None:
+            with self._lock:
+                counters = self._counters.setdefault(name, {})
+                counter = counters.get(label_key)
+                if counter is None:
+                    counter = Counter()
+                    counters[label_key] = counter
+        return counter
+
+    def get_histograms(self, name: str) -> Dict[LabelKey, Histogram]:
+        """指定された名前のヒストグラムをラベルごとに返す。"""
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def get_counters(self, name: str) -> Dict[LabelKey, Counter]:
+        """指定された名前のカウンタをラベルごとに返す。"""
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def histogram_names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._histograms)
+
+    def counter_names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._counters)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _to_label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    if not labels:
+        return ()
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+# プロセス全体で共有するレジストリ
+REGISTRY = MetricsRegistry()
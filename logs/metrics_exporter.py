@@ -0,0 +1,102 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+import math
+import os
+import threading
+from typing import Any, List, Optional
+
+from logs.app_logger import set_logging
+from logs.metrics import REGISTRY, LabelKey, MetricsRegistry
+
+logger: Logger = set_logging("lower.sub")
+
+# Prometheusのテキスト形式のContent-Type
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_key: LabelKey, extra: str = "") -> str:
+    labels = [f'{key}="{_escape_label_value(value)}"' for key, value in label_key]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus_text(registry: MetricsRegistry = REGISTRY) -> str:
+    """レジストリのすべてのメトリクスをPrometheusのテキスト形式で返す。"""
+    lines: List[str] = []
+    for name in registry.counter_names():
+        lines.append(f"# TYPE {name} counter")
+        for label_key, counter in sorted(registry.get_counters(name).items()):
+            lines.append(f"{name}{_format_labels(label_key)} {_format_value(counter.value)}")
+    for name in registry.histogram_names():
+        lines.append(f"# TYPE {name} histogram")
+        for label_key, histogram in sorted(registry.get_histograms(name).items()):
+            for upper, cumulative in histogram.bucket_counts():
+                le = f'le="{_format_value(upper)}"'
+                lines.append(f"{name}_bucket{_format_labels(label_key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_key)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(label_key)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(
+    port: int, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY
+) -> ThreadingHTTPServer:
+    """
+    /metrics でレジストリのメトリクスをPrometheusのテキスト形式で返すHTTPサーバーを、デーモンスレッドで起動する。
+
+    port に0を指定した場合は空いているポートを使用する（server_address で確認できる）。
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            # スクレイプのたびにアクセスログを出力しない
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus_text(registry).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_metrics_server_lock = threading.Lock()
+
+
+def ensure_metrics_server() -> Optional[ThreadingHTTPServer]:
+    """
+    環境変数 METRICS_PORT が設定されている場合に、プロセスごとに一度だけメトリクスのHTTPサーバーを起動する。
+
+    Streamlitはページを操作するたびにスクリプトを再実行するため、2回目以降の呼び出しでは起動済みのサーバーを返す。
+    """
+    global _metrics_server
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    if _metrics_server is None:
+        with _metrics_server_lock:
+            if _metrics_server is None:
+                _metrics_server = start_metrics_server(int(port))
+                logger.info(f"Serving metrics on port {port}")
+    return _metrics_server
@@ -0,0 +1,115 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# cProfileの結果として表示する関数の数
+DEFAULT_STATS_LIMIT: int = 25
+# プロファイルを有効にしたスクリプトの実行のうち、cProfileも取得する割合の既定値
+DEFAULT_CPROFILE_RATE: float = 0.1
+
+# 実行中のスクリプトのプロファイラ（Streamlitはセッションごとに別のスレッドでスクリプトを実行する）
+_active = threading.local()
+
+
+class RerunProfiler:
+    """
+    Streamlitのスクリプトの1回の実行を、名前付きの区間ごとに計測するクラス。
+
+    with で囲んだ間は呼び出し元のスレッドで有効になり、log_decorator を付けた関数の呼び出しが
+    関数名の区間として自動的に記録される。区間は呼び出しの入れ子のまま集計する。
+    capture_cprofile を指定した場合は、同じ間のcProfileも取得する。
+    """
+
+    def __init__(
+        self, capture_cprofile: bool = False, clock: Callable[[], float] = time.perf_counter
+    ) -> None:
+        self.clock = clock
+        self.total_seconds = 0.0
+        # 区間の入れ子のパスごとの (呼び出し回数, 合計時間)。開始した順に並ぶ
+        self.sections: Dict[Tuple[str, ...], List[float]] = {}
+        self._stack: List[str] = []
+        self._started_at = 0.0
+        self._cprofile: Optional[cProfile.Profile] = cProfile.Profile() if capture_cprofile else None
+
+    @property
+    def captures_cprofile(self) -> bool:
+        return self._cprofile is not None
+
+    def __enter__(self) -> "RerunProfiler":
+        _active.profiler = self
+        self._started_at = self.clock()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self.total_seconds = self.clock() - self._started_at
+        _active.profiler = None
+
+    def push(self, name: str) -> None:
+        """区間の開始を記録する。"""
+        self._stack.append(name)
+        # 入れ子の外側の区間が先に並ぶよう、開始時に登録しておく
+        self.sections.setdefault(tuple(self._stack), [0, 0.0])
+
+    def pop(self, elapsed: float) -> None:
+        """直近に開始した区間の終了と、その区間にかかった時間（秒）を記録する。"""
+        section = self.sections[tuple(self._stack)]
+        self._stack.pop()
+        section[0] += 1
+        section[1] += elapsed
+
+    def format_breakdown(self) -> str:
+        """区間ごとの時間を、入れ子を字下げで表したテキストで返す。"""
+        lines = [f"total: {self.total_seconds * 1000:.1f} ms"]
+        for path, (count, seconds) in self.sections.items():
+            share = seconds / self.total_seconds * 100 if self.total_seconds > 0 else 0.0
+            calls = f" x{int(count)}" if count > 1 else ""
+            lines.append(
+                f"{'  ' * len(path)}{path[-1]}: {seconds * 1000:.1f} ms ({share:.0f}%){calls}"
+            )
+        return "\n".join(lines)
+
+    def format_cprofile(self, limit: int = DEFAULT_STATS_LIMIT) -> str:
+        """cProfileの結果を累積時間の長い順に limit 件返す。取得していない場合は空文字列を返す。"""
+        if self._cprofile is None:
+            return ""
+        stream = io.StringIO()
+        pstats.Stats(self._cprofile, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+def get_active_profiler() -> Optional[RerunProfiler]:
+    """呼び出し元のスレッドで有効なプロファイラを返す。プロファイル中でない場合はNoneを返す。"""
+    return getattr(_active, "profiler", None)
+
+
+def create_rerun_profiler(
+    query_mode: str = "", random_value: Callable[[], float] = random.random
+) -> Optional[RerunProfiler]:
+    """
+    プロファイルが有効な場合に、スクリプトの1回の実行を計測するプロファイラを返す。
+
+    環境変数 PROFILE_RERUNS が設定されている場合、またはクエリパラメータ profile が指定されている場合に有効とする。
+    cProfileは環境変数 PROFILE_CPROFILE_RATE の割合の実行でのみ取得する（既定値は0.1）。
+    クエリパラメータが profile=cprofile の場合は、その実行で必ず取得する。
+
+    Args:
+        query_mode (str): クエリパラメータ profile の値。
+
+    Returns:
+        Optional[RerunProfiler]: プロファイラ。プロファイルが無効な場合はNone。
+    """
+    is_enabled = os.getenv("PROFILE_RERUNS", "").lower() in ("1", "true") or bool(query_mode)
+    if not is_enabled:
+        return None
+    cprofile_rate = float(os.getenv("PROFILE_CPROFILE_RATE", str(DEFAULT_CPROFILE_RATE)))
+    capture_cprofile = query_mode == "cprofile" or random_value() < cprofile_rate
+    return RerunProfiler(capture_cprofile=capture_cprofile)
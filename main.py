@@ -1,13 +1,13 @@
 import streamlit as st
 
 from logging import Logger
-from chat_session.ChatSession import ChatSession
 from costs.calculate_cost import calculate_cost
 from data_source.openai_data_source import BasePage, PDFOperateOptions
 
 from logs.app_logger import set_logging
 from logs.log_decorator import log_decorator
-from pdf_qa_service.PDFQASession import PDFQASession
+from logs.metrics_exporter import ensure_metrics_server
+from logs.rerun_profiler import RerunProfiler, create_rerun_profiler
 
 logger: Logger = set_logging("__main__")
 
@@ -20,27 +20,42 @@ def main() -> None:
 
     st.set_page_config(page_title="Stream-AI-Chat", page_icon="🤖")
     st.sidebar.title("Sections")
-    page_selection = st.sidebar.radio("Go To", [BasePage.CHAT.value, BasePage.PDF_QA.value])
+    page_selection = st.sidebar.radio(
+        "Go To", [BasePage.CHAT.value, BasePage.PDF_QA.value, BasePage.COMPARE.value]
+    )
+    # ページのモジュールは、そのページを最初に表示するときにインポートする
+    # （PDFのページでのみ使用するPyMuPDFなどを、チャットのみを使用するユーザーのために読み込まない）
     if page_selection == BasePage.CHAT.value:
+        from chat_session.ChatSession import ChatSession
+
         chat_session = ChatSession()
         # ページ構成要素の初期化
         llm, model_version = chat_session.initialize_chat_page_element()
         # 会話を表示（チャット履歴含む）
         chat_session.display_conversations(st.session_state.messages, is_error)
+        # 再実行で表示が中断された応答の生成が続いている場合は、その続きを表示
+        pending_job = st.session_state.get("generation_job")
+        if pending_job is not None:
+            is_error, prompt_tokens, completion_tokens = chat_session.attach_generation_job(
+                pending_job
+            )
+            calculate_cost(prompt_tokens, completion_tokens, pending_job.model_version, is_error)
         # ユーザー入力を受け付け
         user_input = st.chat_input("Input your message...")
         if user_input:
             # ユーザーの入力を表示
-            chat_session.add_user_chat_message(user_input)
+            chat_session.add_user_chat_message(user_input, model_version)
             # アシスタントのチャット応答を生成
-            is_error, converted_history, assistant_chat = chat_session.generate_assistant_chat_response(
+            is_error, prompt_tokens, completion_tokens = chat_session.generate_assistant_chat_response(
                 model_version, llm
             )
 
             # コストの計算
-            calculate_cost(converted_history, assistant_chat, model_version, is_error)
+            calculate_cost(prompt_tokens, completion_tokens, model_version, is_error)
 
     elif page_selection == BasePage.PDF_QA.value:
+        from pdf_qa_service.PDFQASession import PDFQASession
+
         pdf_qa_service = PDFQASession()
         # ページ構成要素の初期化
         pdf_qa_service.initialize_chat_page_element()
@@ -49,10 +64,77 @@ def main() -> None:
 
         if selected_operator == PDFOperateOptions.UPLOAD.value:
             pdf_qa_service.get_pdf_text()
-        # elif selected_operator == PDFOperateOptions.QUESTION.value:
-        #     page_ask_my_pdf()
+        elif selected_operator == PDFOperateOptions.QUESTION.value:
+            model_version, top_k, retrieval_mode = pdf_qa_service.select_qa_options()
+            # これまでの質問と回答を表示し、再実行で表示が中断された回答の生成が続いている場合は、その続きを表示
+            pdf_qa_service.display_qa_turns()
+            pending_turn = pdf_qa_service.get_pending_qa_turn()
+            if pending_turn is not None:
+                is_error, prompt_tokens, completion_tokens = pdf_qa_service.attach_qa_turn(
+                    pending_turn
+                )
+                calculate_cost(prompt_tokens, completion_tokens, pending_turn.model_version, is_error)
+            question = st.chat_input("Ask a question about your PDF(s)...")
+            if question:
+                # アップロード済みのPDFから検索したチャンクをもとに回答を生成
+                is_error, prompt_tokens, completion_tokens = pdf_qa_service.ask_my_pdf(
+                    question, model_version, top_k, retrieval_mode
+                )
+                calculate_cost(prompt_tokens, completion_tokens, model_version, is_error)
+        elif selected_operator == PDFOperateOptions.SUMMARIZE.value:
+            model_version = pdf_qa_service.select_summary_model()
+            if st.button("Summarize"):
+                # アップロード済みのPDFをチャンクごとに並列に要約し、要約をまとめる
+                is_error, prompt_tokens, completion_tokens = pdf_qa_service.summarize_pdfs(
+                    model_version
+                )
+                calculate_cost(prompt_tokens, completion_tokens, model_version, is_error)
+
+    elif page_selection == BasePage.COMPARE.value:
+        from chat_session.ModelComparisonSession import ModelComparisonSession
+
+        comparison_session = ModelComparisonSession()
+        # ページ構成要素の初期化
+        model_versions, max_tokens, temperature = comparison_session.initialize_page_element()
+        user_input = st.chat_input("Input your message to compare models...")
+        if user_input and model_versions:
+            # 選択されたモデルに同時に送信し、応答を並べて表示
+            comparison_session.compare(user_input, model_versions, max_tokens, temperature)
+
+
+def display_rerun_profile(profiler: RerunProfiler) -> None:
+    """プロファイルしたスクリプトの実行の区間ごとの時間を、サイドバーとログに出力する。"""
+    breakdown = profiler.format_breakdown()
+    stats = profiler.format_cprofile()
+    logger.info(f"Rerun profile:\n{breakdown}")
+    if stats:
+        logger.info(f"Rerun cProfile:\n{stats}")
+    with st.sidebar.expander(f"Rerun profile ({profiler.total_seconds * 1000:.0f} ms)"):
+        st.text(breakdown)
+        if stats:
+            st.text(stats)
+
+
+def run() -> None:
+    """
+    main を実行する。
+
+    環境変数 PROFILE_RERUNS またはクエリパラメータ profile でプロファイルが有効な場合は、
+    この実行を区間ごとに計測してサイドバーに表示する。
+    """
+    # 環境変数 METRICS_PORT が設定されている場合は、メトリクスのスクレイプ用のエンドポイントを起動する
+    # （モジュールの読み込み時には起動しない。起動済みの場合は何もしない）
+    ensure_metrics_server()
+    query_mode = st.experimental_get_query_params().get("profile", [""])[0]
+    profiler = create_rerun_profiler(query_mode)
+    if profiler is None:
+        main()
+        return
+    with profiler:
+        main()
+    display_rerun_profile(profiler)
 
 
 if __name__ == "__main__":
-    main()
+    run()
 
@@ -0,0 +1,327 @@
+from array import array
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+from logging import Logger
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+from pdf_qa_service.text_chunker import TextChunk
+from pdf_qa_service.tokenizer import tokenize
+from pdf_qa_service.VectorIndex import SearchResult
+from pdf_qa_service.versioned_directory import get_current_version_path, publish_version
+
+logger: Logger = set_logging("lower.sub")
+
+# BM25のパラメータ
+DEFAULT_K1: float = 1.2
+DEFAULT_B: float = 0.75
+
+
+class BM25Index:
+    """
+    チャンク単位の転置インデックスを持ち、BM25で語の一致によるチャンクの検索を行うクラス。
+
+    語ごとのポスティング（チャンク番号と出現回数）は array に保持し、検索時はNumPyの配列として
+    まとめてスコアを計算する。文書単位で追加・削除でき、削除時はその文書に含まれる語の
+    ポスティングのみを作り直すため、インデックス全体を作り直す必要はない。
+    複数のスレッドから同時に使用しても安全。
+    """
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> None:
+        self.k1 = k1
+        self.b = b
+        # 語 -> (チャンク番号の配列, 出現回数の配列)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # チャンク番号 -> チャンク（削除したチャンクはNone）
+        self._chunks: List[Optional[TextChunk]] = []
+        # チャンク番号 -> チャンクの語数（削除したチャンクは0）
+        self._lengths = array("I")
+        # 文書の内容のハッシュ値 -> その文書のチャンク番号と、含まれる語
+        self._documents: Dict[str, Tuple[List[int], Set[str]]] = {}
+        self._total_length = 0
+        self._chunk_count = 0
+        self._lock = threading.RLock()
+        # 保存を直列に行うためのロック（保存中も検索・追加は _lock のみで行える）
+        self._save_lock = threading.Lock()
+
+    def __contains__(self, document_hash: str) -> bool:
+        with self._lock:
+            return document_hash in self._documents
+
+    @property
+    def document_count(self) -> int:
+        with self._lock:
+            return len(self._documents)
+
+    @property
+    def chunk_count(self) -> int:
+        with self._lock:
+            return self._chunk_count
+
+    @log_decorator(logger)
+    def add_document(self, document_hash: str, chunks: List[TextChunk]) -> None:
+        """
+        文書のチャンクをインデックスに追加する。すでに追加済みの文書の場合は置き換える。
+
+        Args:
+            document_hash (str): 文書の内容のハッシュ値。
+            chunks (List[TextChunk]): 文書のチャンク。
+        """
+        # ロックの外で語に分割し、ロックを保持する時間を短くする
+        tokenized = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        with self._lock:
+            if document_hash in self._documents:
+                self.remove_document(document_hash)
+            chunk_ids: List[int] = []
+            terms: Set[str] = set()
+            for chunk, term_counts in zip(chunks, tokenized):
+                chunk_id = len(self._chunks)
+                length = sum(term_counts.values())
+                self._chunks.append(chunk)
+                self._lengths.append(length)
+                self._total_length += length
+                self._chunk_count += 1
+                chunk_ids.append(chunk_id)
+                for term, count in term_counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = (array("I"), array("I"))
+                        self._postings[term] = postings
+                    postings[0].append(chunk_id)
+                    postings[1].append(count)
+                terms.update(term_counts)
+            self._documents[document_hash] = (chunk_ids, terms)
+
+    @log_decorator(logger)
+    def remove_document(self, document_hash: str) -> bool:
+        """
+        文書のチャンクをインデックスから削除する。
+
+        Returns:
+            bool: 削除した場合はTrue、文書が追加されていなかった場合はFalse。
+        """
+        with self._lock:
+            entry = self._documents.pop(document_hash, None)
+            if entry is None:
+                return False
+            chunk_ids, terms = entry
+            for chunk_id in chunk_ids:
+                self._total_length -= self._lengths[chunk_id]
+                self._lengths[chunk_id] = 0
+                self._chunks[chunk_id] = None
+            self._chunk_count -= len(chunk_ids)
+
+            # チャンク番号は文書ごとに連続しているため、範囲で除外する
+            first, last = min(chunk_ids, default=0), max(chunk_ids, default=-1)
+            for term in terms:
+                ids, counts = self._postings[term]
+                ids_array = np.frombuffer(ids, dtype=np.uint32)
+                keep = (ids_array < first) | (ids_array > last)
+                if not keep.any():
+                    del self._postings[term]
+                    continue
+                self._postings[term] = (
+                    array("I", ids_array[keep].tobytes()),
+                    array("I", np.frombuffer(counts, dtype=np.uint32)[keep].tobytes()),
+                )
+            return True
+
+    def search(
+        self, query: str, top_k: int = 5, document_hashes: Optional[Iterable[str]] = None
+    ) -> List[SearchResult]:
+        """
+        クエリの語に一致するチャンクを、BM25のスコアの高い順に最大 top_k 件返す。
+
+        Args:
+            query (str): 検索するテキスト。
+            top_k (int): 返す件数。
+            document_hashes (Optional[Iterable[str]]): 検索対象とする文書。省略時はすべての文書。
+
+        Returns:
+            List[SearchResult]: 検索結果。
+        """
+        query_terms = set(tokenize(query))
+        with self._lock:
+            if not self._chunk_count or top_k <= 0 or not query_terms:
+                return []
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            average_length = self._total_length / self._chunk_count
+            scores = np.zeros(len(self._chunks), dtype=np.float32)
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                ids = np.frombuffer(postings[0], dtype=np.uint32)
+                counts = np.frombuffer(postings[1], dtype=np.uint32).astype(np.float32)
+                idf = np.log(1.0 + (self._chunk_count - len(ids) + 0.5) / (len(ids) + 0.5))
+                normalization = self.k1 * (1.0 - self.b + self.b * lengths[ids] / average_length)
+                # 1つのチャンク内で同じ語のポスティングは1つのみのため、そのまま加算できる
+                scores[ids] += idf * counts * (self.k1 + 1.0) / (counts + normalization)
+
+            if document_hashes is not None:
+                allowed = np.zeros(len(self._chunks), dtype=bool)
+                for document_hash in document_hashes:
+                    entry = self._documents.get(document_hash)
+                    if entry is not None:
+                        allowed[entry[0]] = True
+                scores[~allowed] = 0.0
+
+            matched = np.flatnonzero(scores > 0)
+            if not len(matched):
+                return []
+            k = min(top_k, len(matched))
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [SearchResult(float(scores[i]), self._chunks[i]) for i in top]  # type: ignore
+
+    def save(self, directory: str) -> None:
+        """
+        インデックスをディレクトリに保存する。
+
+        ポスティングは語の順に連結した1つの配列と、語ごとの開始位置の配列として保存する。
+        postings.npz と metadata.json は一時ディレクトリに書き込んでからバージョンごとのディレクトリとして公開し、
+        CURRENT ファイルを置き換えて切り替える。そのため、読み込み側が異なる保存のファイルを組み合わせることはない。
+        同じインスタンスからの保存は直列に行い、古いバージョンは直前の1つのみ残して削除する。
+        """
+        with self._save_lock:
+            with self._lock:
+                offsets, ids, counts, lengths, metadata = self._snapshot()
+
+            def write_files(version_directory: str) -> None:
+                np.savez(
+                    os.path.join(version_directory, "postings.npz"),
+                    offsets=offsets,
+                    ids=ids,
+                    counts=counts,
+                    lengths=lengths,
+                )
+                with open(
+                    os.path.join(version_directory, "metadata.json"), "w", encoding="utf-8"
+                ) as file:
+                    json.dump(metadata, file, ensure_ascii=False)
+
+            publish_version(directory, write_files)
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self._postings[term][0]) for term in terms])
+        ids = np.empty(offsets[-1], dtype=np.uint32)
+        counts = np.empty(offsets[-1], dtype=np.uint32)
+        for i, term in enumerate(terms):
+            term_ids, term_counts = self._postings[term]
+            ids[offsets[i] : offsets[i + 1]] = np.frombuffer(term_ids, dtype=np.uint32)
+            counts[offsets[i] : offsets[i + 1]] = np.frombuffer(term_counts, dtype=np.uint32)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32).copy()
+        metadata = {
+            "k1": self.k1,
+            "b": self.b,
+            "terms": terms,
+            "chunks": [chunk.to_dict() if chunk is not None else None for chunk in self._chunks],
+            "documents": {
+                document_hash: [list(chunk_ids), sorted(document_terms)]
+                for document_hash, (chunk_ids, document_terms) in self._documents.items()
+            },
+        }
+        return offsets, ids, counts, lengths, metadata
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """ディレクトリに save で保存したインデックスがあるかどうかを返す。"""
+        return get_current_version_path(directory) is not None
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """save で保存したインデックスのうち、最新のバージョンを読み込む。"""
+        version_directory = get_current_version_path(directory)
+        if version_directory is None:
+            raise FileNotFoundError(f"No BM25 index in {directory}")
+        with open(os.path.join(version_directory, "metadata.json"), "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+        arrays = np.load(os.path.join(version_directory, "postings.npz"))
+        offsets, ids, counts = arrays["offsets"], arrays["ids"], arrays["counts"]
+
+        index = cls(k1=metadata["k1"], b=metadata["b"])
+        for i, term in enumerate(metadata["terms"]):
+            start, end = offsets[i], offsets[i + 1]
+            index._postings[term] = (
+                array("I", ids[start:end].tobytes()),
+                array("I", counts[start:end].tobytes()),
+            )
+        index._chunks = [
+            TextChunk.from_dict(chunk) if chunk is not None else None for chunk in metadata["chunks"]
+        ]
+        index._lengths = array("I", arrays["lengths"].astype(np.uint32).tobytes())
+        index._documents = {
+            document_hash: (chunk_ids, set(document_terms))
+            for document_hash, (chunk_ids, document_terms) in metadata["documents"].items()
+        }
+        index._total_length = int(np.sum(arrays["lengths"], dtype=np.int64))
+        index._chunk_count = sum(chunk is not None for chunk in index._chunks)
+        return index
+
+
+_bm25_index: Optional[BM25Index] = None
+_bm25_index_lock = threading.Lock()
+
+
+def get_bm25_index() -> BM25Index:
+    """
+    プロセス全体で共有するBM25のインデックスを返す。
+
+    環境変数 BM25_INDEX_DIR を指定した場合は、保存済みのインデックスがあれば読み込む。
+    """
+    global _bm25_index
+    if _bm25_index is None:
+        with _bm25_index_lock:
+            if _bm25_index is None:
+                directory = os.getenv("BM25_INDEX_DIR")
+                if directory and BM25Index.exists(directory):
+                    _bm25_index = BM25Index.load(directory)
+                else:
+                    _bm25_index = BM25Index()
+    return _bm25_index
+
+
+_save_executor: Optional[ThreadPoolExecutor] = None
+_is_save_requested = False
+
+
+def save_bm25_index() -> Optional[Future]:
+    """
+    環境変数 BM25_INDEX_DIR を指定した場合、プロセス全体で共有するインデックスをバックグラウンドで保存する。
+
+    インデックス全体を書き出すため、リクエストを処理するスレッドでは保存しない。
+    保存は1つのスレッドで順に行い、まだ開始していない保存がある場合は新たに要求せずその保存にまとめる。
+
+    Returns:
+        Optional[Future]: 保存の完了を待つためのFuture。保存しない場合はNone。
+    """
+    global _save_executor, _is_save_requested
+    directory = os.getenv("BM25_INDEX_DIR")
+    if not directory:
+        return None
+    with _bm25_index_lock:
+        if _save_executor is None:
+            _save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25-save")
+        if _is_save_requested:
+            return None
+        _is_save_requested = True
+        return _save_executor.submit(_save_bm25_index, directory)
+
+
+def _save_bm25_index(directory: str) -> None:
+    global _is_save_requested
+    with _bm25_index_lock:
+        # 保存を開始した後の変更は、次の保存で書き出す
+        _is_save_requested = False
+    try:
+        get_bm25_index().save(directory)
+    except Exception as e:
+        logger.warning(f"Failed to save BM25 index: {e!r}")
@@ -1,14 +1,47 @@
 from logging import Logger
+import traceback
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import openai
 import streamlit as st
-from data_source.openai_data_source import PDFOperateOptions
+from chat_session.ChatSession import ChatSession
+from chat_session.GenerationJob import GenerationJob, get_generation_job_pool
+from chat_session.StreamingRenderer import StreamingRenderer
+from costs.get_token_count import get_encoding, get_prompt_token_count, get_tiktoken_count
+from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+from data_source.openai_data_source import MODELS, PDFOperateOptions, RetrievalMode, Role
 from logs.app_logger import set_logging
 from logs.log_decorator import log_decorator
-import fitz
+from pdf_qa_service.embedder import get_embedder
+from pdf_qa_service.pdf_extractor import PDFDocument, extract_pdf
+from pdf_qa_service.PDFSummarizer import PDFSummarizer, SummaryProgress, create_pdf_summarizer
+from pdf_qa_service.retrieval import (
+    QA_PROMPT_OVERHEAD_TOKENS,
+    build_qa_messages,
+    get_document_index_store,
+    retrieve,
+    retrieve_lexical,
+)
 
 logger: Logger = set_logging("lower.sub")
 
 
+class QATurn:
+    """
+    Ask My PDF(s) の1回の質問と回答。
+
+    回答の生成中は job に生成中のジョブを保持し、回答を履歴に追加した時点でNoneにする。
+    """
+
+    def __init__(self, question: str, model_version: str) -> None:
+        self.question = question
+        self.model_version = model_version
+        self.answer = ""
+        # 回答の文脈に含めたチャンクの (ファイル名, ページ番号, スコア, テキスト)
+        self.sources: List[Tuple[str, int, float, str]] = []
+        self.job: Optional[GenerationJob] = None
+
+
 class PDFQASession:
     @log_decorator(logger)
     def initialize_chat_page_element(self) -> None:
@@ -19,18 +52,344 @@ class PDFQASession:
     def select_pdf_service_operator(self) -> str:
         return st.sidebar.radio(
             "Go to",
-            [PDFOperateOptions.UPLOAD.value, PDFOperateOptions.QUESTION.value],
+            [
+                PDFOperateOptions.UPLOAD.value,
+                PDFOperateOptions.QUESTION.value,
+                PDFOperateOptions.SUMMARIZE.value,
+            ],
         )  # type: ignore
 
     # TODO: 文字の分析処理をここに記載していく
     @log_decorator(logger)
-    def get_pdf_text(self):
+    def get_pdf_text(self) -> Optional[PDFDocument]:
+        """
+        アップロードされたPDFのテキストを抽出し、選択したページのテキストを表示します。
+
+        抽出したテキストはファイルの内容のハッシュ値をキーとしてキャッシュするため、
+        再実行や同じファイルの再アップロードでは抽出し直しません。
+        抽出した文書はセッションステートの pdf_documents にも保持します。
+
+        Returns:
+            Optional[PDFDocument]: 抽出した文書。ファイルがアップロードされていない場合はNone。
+        """
         uploaded_file = st.file_uploader(label="Upload your PDF.", type="pdf")
-        # 与えられたPDFファイルの内容すべてをテキストに変換して表示
-        if uploaded_file:
-            pdf = fitz.open(stream=uploaded_file.read(), filetype="pdf")  # type: ignore
-            page_count = pdf.page_count
-            st.write(f"ページ数: {page_count}")
-            for page in pdf:
-                page_text = page.get_text()
-                st.write(page_text)
+        if not uploaded_file:
+            return None
+
+        progress_bar = st.empty()
+
+        def show_progress(extracted_count: int, page_count: int) -> None:
+            progress_bar.progress(
+                extracted_count / page_count, text=f"Extracting text: {extracted_count}/{page_count}"
+            )
+
+        document = extract_pdf(uploaded_file.getvalue(), uploaded_file.name, show_progress)
+        progress_bar.empty()
+        st.session_state.setdefault("pdf_documents", {})[document.content_hash] = document
+
+        st.write(f"ページ数: {document.page_count}")
+        if document.page_count:
+            # 再実行のたびにすべてのページを描画しないよう、選択したページのみを表示する
+            page_number = st.number_input(
+                "Page", min_value=1, max_value=document.page_count, value=1, step=1
+            )
+            st.write(document.pages[int(page_number) - 1])
+        return document
+
+    @log_decorator(logger)
+    def select_qa_options(self) -> Tuple[str, int, str]:
+        """
+        サイドバーに質問応答に使用するモデルと、検索方法・検索するチャンク数の設定を表示します。
+
+        Returns:
+            Tuple[str, int, str]: 選択された言語モデルのキー、検索するチャンク数（top_k）、検索方法。
+        """
+        model_version: str = st.sidebar.radio("Select a model:", list(MODELS.keys()))  # type: ignore
+        retrieval_mode: str = st.sidebar.radio(
+            "Search mode:", [mode.value for mode in RetrievalMode]
+        )  # type: ignore
+        top_k = st.sidebar.slider(
+            "top_k: ",
+            min_value=1,
+            max_value=MODELS[model_version]["parameter"]["max_top_k"],
+            value=5,
+            step=1,
+        )
+        return model_version, top_k, retrieval_mode
+
+    @log_decorator(logger)
+    def display_qa_turns(self) -> None:
+        """これまでの質問と回答を、回答の出典とともに表示します（生成中の回答は attach_qa_turn で表示します）。"""
+        for turn in st.session_state.get("qa_turns", []):
+            if turn.job is not None:
+                continue
+            st.chat_message(Role.USER.value).markdown(turn.question)
+            with st.chat_message(Role.ASSISTANT.value):
+                st.markdown(turn.answer)
+                self.display_sources(turn.sources)
+
+    @staticmethod
+    def display_sources(sources: List[Tuple[str, int, float, str]]) -> None:
+        if not sources:
+            return
+        with st.expander("Sources"):
+            for file_name, page_number, score, text in sources:
+                st.markdown(f"**{file_name}** p.{page_number} (score: {score:.3f})")
+                st.text(text)
+
+    @staticmethod
+    def get_pending_qa_turn() -> Optional[QATurn]:
+        """回答の表示を終えていない質問を返します。ない場合はNoneを返します。"""
+        turns: List[QATurn] = st.session_state.get("qa_turns", [])
+        if turns and turns[-1].job is not None:
+            return turns[-1]
+        return None
+
+    @log_decorator(logger)
+    def ask_my_pdf(
+        self,
+        question: str,
+        model_version: str,
+        top_k: int,
+        retrieval_mode: str = RetrievalMode.DENSE.value,
+    ) -> Tuple[bool, int, int]:
+        """
+        アップロード済みのPDFから質問に類似するチャンクを検索し、そのチャンクのみを文脈として回答を生成します。
+
+        文書全体ではなく検索したチャンクのみを送信するため、大きな文書でもプロンプトのトークン数は
+        モデルのmax_prompt_tokensに収まります。
+        検索（インデックスの作成を含む）と回答の生成は、チャットと同じワーカープールのジョブとして実行するため、
+        ウィジェットの操作でスクリプトが再実行されても中断されません。
+
+        Args:
+            question (str): ユーザーの質問。
+            model_version (str): 選択された言語モデルのキー。
+            top_k (int): 検索するチャンク数。
+            retrieval_mode (str): 検索方法。BM25の場合はEmbeddingを計算せずに語の一致で検索します。
+
+        Returns:
+            bool: エラーが発生した場合はTrue、それ以外はFalse。
+            int: 送信したプロンプトのトークン数。
+            int: 受信したコンプリーションのトークン数。
+        """
+        documents: Dict[str, PDFDocument] = st.session_state.get("pdf_documents", {})
+        if not documents:
+            st.chat_message(Role.USER.value).markdown(question)
+            st.warning("Upload a PDF first.")
+            return True, 0, 0
+
+        turn = QATurn(question, model_version)
+        try:
+            job = self.submit_qa_job(turn, list(documents.values()), top_k, retrieval_mode)
+        except openai.error.RateLimitError as e:  # type: ignore
+            # ワーカープールが満杯の場合
+            logger.warning(traceback.format_exc())
+            st.chat_message(Role.USER.value).markdown(question)
+            err_content_message = "The execution interval is too short. Wait a minute and try again."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            return True, 0, 0
+
+        turn.job = job
+        st.session_state.setdefault("qa_turns", []).append(turn)
+        return self.attach_qa_turn(turn)
+
+    @staticmethod
+    def submit_qa_job(
+        turn: QATurn, documents: List[PDFDocument], top_k: int, retrieval_mode: str
+    ) -> GenerationJob:
+        """
+        質問に関連するチャンクの検索と回答の生成を行うジョブを、ワーカープールに投入します。
+
+        検索結果の出典は turn に、送信したプロンプトのトークン数はジョブに、ワーカースレッドで設定します。
+        """
+        model_version = turn.model_version
+        parameter = MODELS[model_version]["parameter"]
+        file_names = {document.content_hash: document.file_name for document in documents}
+        llm = ModelParameters(
+            max_tokens=parameter["max_response_tokens"],
+            temperature=0.0,
+            top_p=0.0,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            deployment_name=MODELS[model_version]["config"]["deployment_name"],
+        )
+
+        def start() -> Iterable[Optional[str]]:
+            encoding = get_encoding(model_version)
+            if retrieval_mode == RetrievalMode.LEXICAL.value:
+                results = retrieve_lexical(documents, turn.question, encoding, top_k)
+            else:
+                embedder = get_embedder()
+                indexes = [
+                    get_document_index_store().get(document, embedder, encoding)
+                    for document in documents
+                ]
+                results = retrieve(indexes, turn.question, embedder, top_k)
+            # 質問と指示文の分を残して、文脈に含めるチャンクのトークン数を制限する
+            question_tokens = get_tiktoken_count(turn.question, model_version)
+            max_context_tokens = (
+                parameter["max_prompt_tokens"] - question_tokens - QA_PROMPT_OVERHEAD_TOKENS
+            )
+            messages, used_results = build_qa_messages(
+                turn.question, results, file_names, max_context_tokens
+            )
+            turn.sources = [
+                (file_names[r.chunk.document_hash], r.chunk.page_number, r.score, r.chunk.text)
+                for r in used_results
+            ]
+            job.prompt_tokens = get_prompt_token_count(messages, model_version)
+            # トークン数のキャッシュは messages に書き込まれるため、Chat APIには role と content のみを送信する
+            request_messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+            return ChatSession.stream_chat_completion(
+                model_version, request_messages, llm, job.prompt_tokens
+            )
+
+        job = GenerationJob(model_version, start)
+        return get_generation_job_pool().submit(job)
+
+    @log_decorator(logger)
+    def attach_qa_turn(self, turn: QATurn) -> Tuple[bool, int, int]:
+        """
+        質問と、生成中の回答を受信済みの差分から表示し、完了したら回答を質問応答の履歴に追加します。
+
+        スクリプトの再実行で表示が中断された場合も、ジョブはそのまま生成を続けるため、
+        次の実行で再びこのメソッドを呼び出すと続きから表示されます。
+        生成中は停止ボタンを表示し、押された場合は受信済みの部分までで回答を打ち切ります。
+        回答の追加とトークン数の集計は、質問ごとに1回だけ行います。
+
+        Args:
+            turn (QATurn): 表示する質問。
+
+        Returns:
+            bool: エラーが発生した場合はTrue、それ以外はFalse。
+            int: 送信したプロンプトのトークン数。
+            int: 受信したコンプリーションのトークン数。
+        """
+        job = turn.job
+        if job is None:
+            return True, 0, 0
+        try:
+            st.chat_message(Role.USER.value).markdown(turn.question)
+            with st.chat_message(Role.ASSISTANT.value):
+                status = st.empty()
+                status.caption("Searching your PDF(s)...")
+                renderer = StreamingRenderer(st.empty())
+                # 停止ボタンを押すとスクリプトが再実行されるため、再実行後のこの位置でジョブを打ち切る
+                stop_placeholder = st.empty()
+                if stop_placeholder.button("Stop", key=f"stop_qa_{job.job_id}"):
+                    job.cancel()
+                for delta in job.subscribe():
+                    renderer.append(delta)
+                status.empty()
+                stop_placeholder.empty()
+                answer = renderer.finish()
+                if job.is_cancelled:
+                    st.caption("Generation was stopped.")
+                self.display_sources(turn.sources)
+
+            # 打ち切った回答は受信済みの部分のみを履歴に追加し、その分のトークン数のみを集計する
+            # 履歴への追加と同時にジョブを外すため、追加より前に中断された場合は次の実行で表示し直す
+            turn.answer = answer
+            turn.job = None
+            if not answer and job.is_cancelled:
+                self.remove_qa_turn(turn)
+
+        except openai.error.RateLimitError as e:  # type: ignore
+            logger.warning(traceback.format_exc())
+            if job.is_done:
+                self.remove_qa_turn(turn)
+            err_content_message = "The execution interval is too short. Wait a minute and try again."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            return True, 0, 0
+
+        except Exception as e:
+            logger.warning(traceback.format_exc())
+            if job.is_done:
+                self.remove_qa_turn(turn)
+            err_content_message = "Unexpected error. Contact the administrator."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            return True, 0, 0
+
+        return False, job.prompt_tokens, get_tiktoken_count(answer, turn.model_version)
+
+    @staticmethod
+    def remove_qa_turn(turn: QATurn) -> None:
+        """回答のない質問を、質問応答の履歴から削除します。"""
+        turns: List[QATurn] = st.session_state.get("qa_turns", [])
+        if turn in turns:
+            turns.remove(turn)
+
+    @log_decorator(logger)
+    def select_summary_model(self) -> str:
+        """サイドバーに要約に使用するモデルの選択肢を表示し、選択されたモデルのキーを返します。"""
+        return st.sidebar.radio("Select a model:", list(MODELS.keys()))  # type: ignore
+
+    @log_decorator(logger)
+    def summarize_pdfs(self, model_version: str) -> Tuple[bool, int, int]:
+        """
+        アップロード済みのPDFをそれぞれ要約し、表示します。
+
+        文書をトークン数の上限に収まるチャンクに分割して並列に要約し、その要約をまとめて要約します。
+        チャンクの要約はキャッシュするため、途中で失敗した場合も再実行では未完了のチャンクのみを要約します。
+
+        Args:
+            model_version (str): 選択された言語モデルのキー。
+
+        Returns:
+            bool: エラーが発生した場合はTrue、それ以外はFalse。
+            int: 送信したプロンプトのトークン数。
+            int: 受信したコンプリーションのトークン数。
+        """
+        documents: Dict[str, PDFDocument] = st.session_state.get("pdf_documents", {})
+        if not documents:
+            st.warning("Upload a PDF first.")
+            return True, 0, 0
+
+        summarizer: Optional[PDFSummarizer] = None
+        try:
+            summarizer = create_pdf_summarizer(model_version, get_encoding(model_version))
+            for document in documents.values():
+                st.subheader(document.file_name)
+                progress_bar = st.empty()
+
+                def show_progress(progress: SummaryProgress) -> None:
+                    progress_bar.progress(
+                        progress.completed / progress.total,
+                        text=f"Summarizing ({progress.stage}): {progress.completed}/{progress.total}",
+                    )
+
+                summary = summarizer.summarize(document.content_hash, document.pages, show_progress)
+                progress_bar.empty()
+                st.markdown(summary)
+
+        except openai.error.RateLimitError as e:  # type: ignore
+            logger.warning(traceback.format_exc())
+            err_content_message = "The execution interval is too short. Wait a minute and try again."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            prompt_tokens, completion_tokens = self.get_summary_usage(summarizer)
+            return True, prompt_tokens, completion_tokens
+
+        except Exception as e:
+            logger.warning(traceback.format_exc())
+            err_content_message = "Unexpected error. Contact the administrator."
+            with st.chat_message(Role.SYSTEM.value):
+                st.markdown(err_content_message)
+            prompt_tokens, completion_tokens = self.get_summary_usage(summarizer)
+            return True, prompt_tokens, completion_tokens
+
+        return False, summarizer.prompt_tokens, summarizer.completion_tokens
+
+    @staticmethod
+    def get_summary_usage(summarizer: Optional[PDFSummarizer]) -> Tuple[int, int]:
+        """
+        要約に失敗するまでに消費したプロンプト・コンプリーションのトークン数を返します。
+
+        完了したチャンクの要約はキャッシュされ、再実行では呼び出さないため、失敗した実行で集計します。
+        """
+        if summarizer is None:
+            return 0, 0
+        return summarizer.prompt_tokens, summarizer.completion_tokens
@@ -0,0 +1,219 @@
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import hashlib
+from logging import Logger
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import tiktoken as tk
+
+from data_source.langchain.lang_chain_chat_model_factory import LangchainChatModelFactory
+from data_source.lru_disk_cache import LRUDiskCache
+from data_source.openai_client_registry import get_openai_client
+from data_source.rate_limiter import DeploymentRateLimiter, retry_with_backoff
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+from pdf_qa_service.text_chunker import chunk_pages
+
+logger: Logger = set_logging("lower.sub")
+
+# 1回の要約で送信するテキストの最大トークン数
+DEFAULT_CHUNK_TOKENS: int = 2000
+# 同時に要約するチャンク数
+DEFAULT_MAX_WORKERS: int = 4
+
+MAP_PROMPT = (
+    "Summarize the following part of a document. Keep key facts, figures, names and conclusions.\n\n"
+    "{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive parts of one document. "
+    "Combine them into a single coherent summary without losing key facts.\n\n"
+    "{text}"
+)
+
+
+class SummaryProgress:
+    def __init__(self, stage: str, completed: int, total: int) -> None:
+        # "map"（チャンクの要約）または "reduce"（要約の統合）と、その段階の何回目か（例: "reduce 1"）
+        self.stage = stage
+        self.completed = completed
+        self.total = total
+
+
+class PDFSummarizer:
+    """
+    大きな文書をトークン数の上限に収まるチャンクに分割して並列に要約し、
+    その要約を上限に収まる単位でまとめて要約することを1つになるまで繰り返すクラス（map-reduce）。
+
+    要約の結果は、送信するプロンプトのハッシュ値をキーとしてキャッシュする。
+    途中で失敗した場合も要約済みのチャンクはキャッシュに残るため、再実行では未完了のチャンクのみを要約する。
+    chat_model は predict(text) -> str を持つ任意のオブジェクトでよく、テストではローカルの偽のモデルを使用できる。
+    """
+
+    def __init__(
+        self,
+        chat_model: Any,
+        model_version: str,
+        encoding: tk.Encoding,
+        cache: Optional[LRUDiskCache[str]] = None,
+        rate_limiter: Optional[DeploymentRateLimiter] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    ) -> None:
+        self.chat_model = chat_model
+        self.model_version = model_version
+        self.encoding = encoding
+        self.cache = cache if cache is not None else get_summary_cache()
+        self.rate_limiter = rate_limiter
+        self.max_workers = max_workers
+        self.chunk_tokens = chunk_tokens
+        # 実際に送信したプロンプトと受信した要約のトークン数（キャッシュから返した分は含まない）
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._usage_lock = threading.Lock()
+
+    @log_decorator(logger)
+    def summarize(
+        self,
+        document_hash: str,
+        pages: List[str],
+        on_progress: Optional[Callable[[SummaryProgress], None]] = None,
+    ) -> str:
+        """
+        文書を要約する。
+
+        Args:
+            document_hash (str): 文書の内容のハッシュ値。
+            pages (List[str]): ページごとのテキスト。
+            on_progress (Optional[Callable[[SummaryProgress], None]]): 要約の進捗を受け取る関数。
+                呼び出し元のスレッドから呼び出される。
+
+        Returns:
+            str: 文書の要約。
+        """
+        # ページ単位ではなく文書全体を上限のトークン数ごとに分割し、要約の回数を減らす
+        chunks = chunk_pages(
+            document_hash, ["\n\n".join(pages)], self.encoding, self.chunk_tokens, overlap_tokens=0
+        )
+        if not chunks:
+            return ""
+        summaries = self._run_stage("map", MAP_PROMPT, [chunk.text for chunk in chunks], on_progress)
+
+        round_number = 0
+        while len(summaries) > 1:
+            round_number += 1
+            groups = self._group_by_tokens(summaries)
+            if len(groups) == len(summaries):
+                # 1つずつしかまとめられない場合は、上限を超えてでも2つずつまとめて必ず件数を減らす
+                groups = ["\n\n".join(summaries[i : i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = self._run_stage(f"reduce {round_number}", REDUCE_PROMPT, groups, on_progress)
+        return summaries[0]
+
+    def _group_by_tokens(self, summaries: List[str]) -> List[str]:
+        groups: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for summary, tokens in zip(summaries, self.encoding.encode_ordinary_batch(summaries)):
+            if current and current_tokens + len(tokens) > self.chunk_tokens:
+                groups.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += len(tokens)
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    def _run_stage(
+        self,
+        stage: str,
+        prompt_template: str,
+        texts: List[str],
+        on_progress: Optional[Callable[[SummaryProgress], None]],
+    ) -> List[str]:
+        results: List[Optional[str]] = [None] * len(texts)
+        first_error: Optional[BaseException] = None
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pdf-summary") as executor:
+            futures: Dict[Future, int] = {
+                executor.submit(self._summarize_text, prompt_template.format(text=text)): i
+                for i, text in enumerate(texts)
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    # 他のチャンクの要約は続け、結果をキャッシュに残してから失敗とする
+                    logger.warning(f"Failed to summarize a chunk in {stage}: {e!r}")
+                    first_error = first_error or e
+                if on_progress is not None:
+                    on_progress(SummaryProgress(stage, completed, len(texts)))
+        if first_error is not None:
+            raise first_error
+        return results  # type: ignore
+
+    def _summarize_text(self, prompt: str) -> str:
+        key = self._cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        prompt_tokens = len(self.encoding.encode_ordinary(prompt))
+
+        def predict() -> str:
+            # 同時に要約するチャンクが多い場合も、デプロイごとの上限を超えないよう送信前に待機する
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(prompt_tokens)
+            return self.chat_model.predict(prompt)
+
+        summary = retry_with_backoff(predict)
+        completion_tokens = len(self.encoding.encode_ordinary(summary))
+        with self._usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        self.cache.set(key, summary)
+        return summary
+
+    def _cache_key(self, prompt: str) -> str:
+        return hashlib.sha256(f"{self.model_version}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+_summary_cache: Optional[LRUDiskCache[str]] = None
+_summary_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> LRUDiskCache[str]:
+    """
+    プロセス全体で共有するチャンクの要約のキャッシュを返す。
+
+    要約は期限切れにしない。環境変数 SUMMARY_CACHE_DIR を指定した場合はディスクにも保存する。
+    """
+    global _summary_cache
+    if _summary_cache is None:
+        with _summary_cache_lock:
+            if _summary_cache is None:
+                _summary_cache = LRUDiskCache(
+                    max_entries=int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "4096")),
+                    cache_dir=os.getenv("SUMMARY_CACHE_DIR") or None,
+                    value_field="summary",
+                )
+    return _summary_cache
+
+
+def create_pdf_summarizer(model_version: str, encoding: tk.Encoding) -> PDFSummarizer:
+    """
+    LangchainのAzureChatOpenAIを使用して文書を要約する PDFSummarizer を生成する。
+
+    Args:
+        model_version (str): 要約に使用する言語モデルのキー。
+        encoding (tk.Encoding): チャンクのトークン数の計算に使用するエンコーダ。
+
+    Returns:
+        PDFSummarizer: デプロイごとのレート制限を適用した PDFSummarizer。
+    """
+    return PDFSummarizer(
+        LangchainChatModelFactory.create_instance(temperature=0, model=model_version),
+        model_version,
+        encoding,
+        rate_limiter=get_openai_client(model_version).rate_limiter,
+        max_workers=int(os.getenv("PDF_SUMMARY_MAX_WORKERS", str(DEFAULT_MAX_WORKERS))),
+    )
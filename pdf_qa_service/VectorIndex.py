@@ -0,0 +1,239 @@
+import json
+from logging import Logger
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+from pdf_qa_service.embedder import normalize_rows
+from pdf_qa_service.text_chunker import TextChunk
+from pdf_qa_service.versioned_directory import get_current_version_path, publish_version
+
+logger: Logger = set_logging("lower.sub")
+
+# k-meansの割り当てを計算する際に、一度に内積を計算するベクトル数
+_ASSIGN_BLOCK_SIZE: int = 4096
+
+
+class SearchResult:
+    def __init__(self, score: float, chunk: TextChunk) -> None:
+        # クエリとのコサイン類似度
+        self.score = score
+        self.chunk = chunk
+
+
+class VectorIndex:
+    """
+    チャンクのベクトルを1つの連続した float32 の行列に保持し、内積で類似チャンクを検索するインデックス。
+
+    検索は行列とクエリの積で全チャンクのスコアを一度に計算する（完全探索）。
+    build_ivf でベクトルをクラスタに分けておくと、search で n_probe を指定した場合は
+    クエリに近いクラスタのチャンクのみを探索する（近似探索）。
+    save で保存したインデックスは、load でメモリマップとして読み込める。
+    """
+
+    # 古いバージョンの削除が、同時に保存した別のインスタンスのバージョンを削除しないよう保存を直列に行う
+    # （保存はインデックスの作成時のみのため、プロセス全体で1つのロックとする）
+    _save_lock = threading.Lock()
+
+    def __init__(self, dimension: Optional[int] = None, initial_capacity: int = 1024) -> None:
+        self.dimension = dimension
+        self.chunks: List[TextChunk] = []
+        self._vectors = (
+            np.zeros((initial_capacity, dimension), dtype=np.float32) if dimension else None
+        )
+        self._size = 0
+        # IVFのクラスタの中心と、クラスタごとに並べたベクトルの番号（list_offsets[i]:list_offsets[i+1] が i 番目）
+        self.centroids: Optional[np.ndarray] = None
+        self.list_offsets: Optional[np.ndarray] = None
+        self.list_indices: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """登録済みのベクトル（チャンク数 x 次元数）を返す。"""
+        if self._vectors is None:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return self._vectors[: self._size]
+
+    @property
+    def has_ivf(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, chunks: List[TextChunk], vectors: np.ndarray) -> None:
+        """
+        チャンクとそのベクトルを追加する。追加するとIVFのクラスタは破棄される。
+
+        Args:
+            chunks (List[TextChunk]): 追加するチャンク。
+            vectors (np.ndarray): 各チャンクのベクトル（チャンク数 x 次元数）。
+        """
+        if len(chunks) != len(vectors):
+            raise ValueError("chunks and vectors must have the same length")
+        if not len(chunks):
+            return
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"expected {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+
+        required = self._size + len(vectors)
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if self._vectors is None or required > capacity or not self._vectors.flags.writeable:
+            # 容量を倍々に増やし、追加のたびに行列全体をコピーし直さないようにする
+            grown = np.zeros((max(required, capacity * 2, 1024), self.dimension), dtype=np.float32)
+            grown[: self._size] = self.vectors
+            self._vectors = grown
+        self._vectors[self._size : required] = vectors
+        self._size = required
+        self.chunks.extend(chunks)
+        self.centroids = self.list_offsets = self.list_indices = None
+
+    @log_decorator(logger)
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10, seed: int = 0) -> None:
+        """
+        近似探索のため、ベクトルを球面k-meansで n_lists 個のクラスタに分ける。
+
+        Args:
+            n_lists (Optional[int]): クラスタ数。省略時はチャンク数の平方根。
+            iterations (int): k-meansの反復回数。
+            seed (int): 初期中心を選ぶ乱数のシード。
+        """
+        vectors = self.vectors
+        if not len(vectors):
+            return
+        n_lists = min(n_lists or int(np.sqrt(len(vectors))) or 1, len(vectors))
+        random = np.random.default_rng(seed)
+        centroids = vectors[random.choice(len(vectors), n_lists, replace=False)].copy()
+        assignments = np.zeros(len(vectors), dtype=np.int64)
+        for _ in range(iterations):
+            assignments = self._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=n_lists)
+            # 空のクラスタは前回の中心のままとする
+            non_empty = counts > 0
+            centroids[non_empty] = normalize_rows(sums[non_empty])
+        assignments = self._assign(vectors, centroids)
+
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        self.centroids = centroids
+        self.list_indices = order.astype(np.int64)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # 大きな行列の積を一度に確保しないよう、ブロックごとに最も近い中心を求める
+        return np.concatenate(
+            [
+                np.argmax(vectors[start : start + _ASSIGN_BLOCK_SIZE] @ centroids.T, axis=1)
+                for start in range(0, len(vectors), _ASSIGN_BLOCK_SIZE)
+            ]
+        )
+
+    def search(
+        self, query: np.ndarray, top_k: int = 5, n_probe: Optional[int] = None
+    ) -> List[SearchResult]:
+        """
+        クエリのベクトルに類似するチャンクを、スコアの高い順に最大 top_k 件返す。
+
+        Args:
+            query (np.ndarray): クエリのベクトル。
+            top_k (int): 返す件数。
+            n_probe (Optional[int]): 近似探索で探索するクラスタ数。省略時、またはIVFがない場合は完全探索する。
+
+        Returns:
+            List[SearchResult]: 検索結果。
+        """
+        if not self._size or top_k <= 0:
+            return []
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+
+        if n_probe and self.has_ivf:
+            nearest_lists = np.argsort(-(self.centroids @ query))[:n_probe]  # type: ignore
+            candidates = np.concatenate(
+                [
+                    self.list_indices[self.list_offsets[i] : self.list_offsets[i + 1]]  # type: ignore
+                    for i in nearest_lists
+                ]
+            )
+            scores = self.vectors[candidates] @ query
+        else:
+            candidates = None
+            scores = self.vectors @ query
+
+        k = min(top_k, len(scores))
+        if not k:
+            return []
+        # 全件を並べ替えずに上位 k 件を取り出してから、その k 件のみを並べ替える
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        indices = candidates[top] if candidates is not None else top
+        return [
+            SearchResult(float(score), self.chunks[int(index)])
+            for score, index in zip(scores[top], indices)
+        ]
+
+    def save(self, directory: str) -> None:
+        """
+        インデックスをディレクトリに保存する。
+
+        各ファイルは一時ディレクトリに書き込んでからバージョンごとのディレクトリとして公開し、
+        CURRENT ファイルを置き換えて切り替える。そのため、保存の途中で失敗した場合や同時に保存した場合も、
+        読み込み側が書き込み途中のファイルや異なる保存のファイルを組み合わせて読み込むことはない。
+        """
+
+        def write_files(version_directory: str) -> None:
+            np.save(os.path.join(version_directory, "vectors.npy"), self.vectors)
+            with open(os.path.join(version_directory, "chunks.json"), "w", encoding="utf-8") as file:
+                json.dump([chunk.to_dict() for chunk in self.chunks], file, ensure_ascii=False)
+            if self.has_ivf:
+                np.save(os.path.join(version_directory, "centroids.npy"), self.centroids)
+                np.save(os.path.join(version_directory, "list_offsets.npy"), self.list_offsets)
+                np.save(os.path.join(version_directory, "list_indices.npy"), self.list_indices)
+
+        with self._save_lock:
+            publish_version(directory, write_files)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """ディレクトリに save で保存したインデックスがあるかどうかを返す。"""
+        return get_current_version_path(directory) is not None
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "VectorIndex":
+        """
+        save で保存したインデックスのうち、最新のバージョンを読み込む。
+
+        Args:
+            directory (str): 保存したディレクトリ。
+            mmap (bool): ベクトルを読み込まずにメモリマップとして開くかどうか。
+
+        Returns:
+            VectorIndex: 読み込んだインデックス。
+        """
+        version_directory = get_current_version_path(directory)
+        if version_directory is None:
+            raise FileNotFoundError(f"No vector index in {directory}")
+        directory = version_directory
+        mmap_mode = "r" if mmap else None
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, "chunks.json"), "r", encoding="utf-8") as file:
+            chunks = [TextChunk.from_dict(data) for data in json.load(file)]
+
+        index = cls(dimension=vectors.shape[1] if vectors.ndim == 2 else None)
+        index._vectors = vectors
+        index._size = len(vectors)
+        index.chunks = chunks
+        if os.path.exists(os.path.join(directory, "centroids.npy")):
+            index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+            index.list_offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+            index.list_indices = np.load(os.path.join(directory, "list_indices.npy"), mmap_mode=mmap_mode)
+        return index
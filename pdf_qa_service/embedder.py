@@ -0,0 +1,110 @@
+from logging import Logger
+import os
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from data_source.openai_client_registry import OpenAIClient
+from data_source.openai_data_source import EMBEDDING_MODEL
+from logs.app_logger import set_logging
+from pdf_qa_service.tokenizer import tokenize
+
+logger: Logger = set_logging("lower.sub")
+
+# ローカルのEmbeddingの次元数の既定値
+DEFAULT_HASHING_DIMENSION: int = 512
+# Embedding APIに1回のリクエストで送信するテキスト数
+DEFAULT_EMBEDDING_BATCH_SIZE: int = 16
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """各行をL2ノルムが1になるよう正規化する（ノルムが0の行はそのまま）。"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class Embedder:
+    """
+    テキストをベクトルに変換するクラスの基底クラス。
+
+    embed は各テキストをL2ノルムが1の float32 のベクトルに変換し、テキスト数 x 次元数の行列として返す。
+    name は保存したインデックスがどのEmbeddingで作成されたかを区別するために使用する。
+    """
+
+    name: str = "embedder"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    語のハッシュ値を次元とする、ネットワークを使用しない決定的なEmbedding。
+
+    意味的な類似度は表現できないが、語の重なりに基づく検索が可能であり、
+    Azure OpenAIのEmbeddingが設定されていない環境やテストで代わりに使用する。
+    """
+
+    def __init__(self, dimension: int = DEFAULT_HASHING_DIMENSION) -> None:
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(term.encode("utf-8")) for term in tokenize(text)), dtype=np.uint32
+            )
+            if not len(hashes):
+                continue
+            # ハッシュ値の衝突の影響を打ち消し合うよう、別のビットで符号を決める
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dimension, signs)
+        return normalize_rows(vectors)
+
+
+class AzureOpenAIEmbedder(Embedder):
+    """Azure OpenAIのEmbedding APIを使用するEmbedding。"""
+
+    def __init__(
+        self, client: OpenAIClient, batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.name = f"azure-{client.deployment_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            # トークン数の見積もりには、日本語を含むテキストでも上限を超えにくい文字数を使用する
+            response = self.client.create_embedding(
+                estimated_tokens=sum(len(text) for text in batch), input=batch
+            )
+            rows.extend(item["embedding"] for item in sorted(response["data"], key=lambda d: d["index"]))
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize_rows(np.asarray(rows, dtype=np.float32))
+
+
+_embedder: Optional[Embedder] = None
+
+
+def get_embedder() -> Embedder:
+    """
+    PDFの検索に使用するEmbeddingを返す。
+
+    環境変数 EMBEDDING_PROVIDER が "hashing" の場合、またはEmbeddingモデルのデプロイ名が
+    設定されていない場合はローカルのEmbeddingを使用する。
+    """
+    global _embedder
+    if _embedder is None:
+        config = EMBEDDING_MODEL["config"]
+        if os.getenv("EMBEDDING_PROVIDER", "").lower() == "hashing" or not config["deployment_name"]:
+            _embedder = HashingEmbedder()
+        else:
+            _embedder = AzureOpenAIEmbedder(OpenAIClient("embedding", config))
+        logger.info(f"Using {_embedder.name} for PDF retrieval")
+    return _embedder
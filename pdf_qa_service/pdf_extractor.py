@@ -0,0 +1,241 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+import hashlib
+from logging import Logger
+import multiprocessing.context
+import os
+import sys
+import tempfile
+import threading
+import types
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import fitz
+
+from data_source.lru_disk_cache import LRUDiskCache
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+
+logger: Logger = set_logging("lower.sub")
+
+# 1つのタスクで抽出するページ数（これ以下のページ数のPDFはプロセスプールを使用せずに抽出する）
+DEFAULT_PAGES_PER_TASK: int = 16
+
+
+class PDFDocument:
+    def __init__(self, content_hash: str, file_name: str, pages: List[str]) -> None:
+        # PDFファイルの内容のハッシュ値（SHA-256）。同じ内容のファイルは同じ文書として扱う
+        self.content_hash = content_hash
+        self.file_name = file_name
+        # ページごとのテキスト（先頭ページから順）
+        self.pages = pages
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+
+def get_content_hash(data: bytes) -> str:
+    """PDFファイルの内容からハッシュ値（SHA-256の16進数表記）を計算する。"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """
+    PDFファイルの start ページから end ページの手前までのテキストを抽出する。
+
+    プロセスプールのワーカーから呼び出すため、PDFの内容ではなくファイルのパスを受け取る。
+    """
+    with fitz.open(path) as pdf:  # type: ignore
+        return [pdf[page_number].get_text() for page_number in range(start, end)]
+
+
+def stream_pdf_pages(
+    path: str,
+    page_count: int,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = DEFAULT_PAGES_PER_TASK,
+) -> Iterator[Tuple[int, str]]:
+    """
+    PDFファイルのテキストをページ範囲ごとに並列で抽出し、抽出できたページから順に返す。
+
+    ページ範囲の抽出が完了した順に返すため、ページ番号の順にはならない場合がある。
+    executor を指定しない場合、またはページ数が pages_per_task 以下の場合は呼び出し元のスレッドで抽出する。
+
+    Args:
+        path (str): PDFファイルのパス。
+        page_count (int): PDFのページ数。
+        executor (Optional[Executor]): ページ範囲の抽出を実行するプール。
+        pages_per_task (int): 1つのタスクで抽出するページ数。
+
+    Yields:
+        Tuple[int, str]: ページ番号（0始まり）とそのページのテキスト。
+    """
+    ranges = [
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+    if executor is None or len(ranges) <= 1:
+        for start, end in ranges:
+            for offset, text in enumerate(extract_page_range(path, start, end)):
+                yield start + offset, text
+        return
+
+    futures: Dict[Future, int] = {
+        executor.submit(extract_page_range, path, start, end): start for start, end in ranges
+    }
+    try:
+        for future in as_completed(futures):
+            start = futures[future]
+            for offset, text in enumerate(future.result()):
+                yield start + offset, text
+    finally:
+        # 途中で中断された場合は、未着手のタスクを取り消す
+        for future in futures:
+            future.cancel()
+
+
+class PDFTextCache(LRUDiskCache[List[str]]):
+    """
+    PDFファイルの内容のハッシュ値をキーとして、抽出したページのテキストをキャッシュするクラス。
+
+    メモリ上のLRUキャッシュと、cache_dir を指定した場合はディスク上のキャッシュの2段構成とする。
+    複数のスレッドから同時に使用しても安全。
+    """
+
+    def __init__(self, max_documents: int = 32, cache_dir: Optional[str] = None) -> None:
+        super().__init__(max_entries=max_documents, cache_dir=cache_dir, value_field="pages")
+
+
+# ワーカープロセスの起動中に __main__ として見せるモジュール（ファイルを持たないため、ワーカーでは実行されない）
+_worker_main_module = types.ModuleType("__main__")
+_worker_start_lock = threading.Lock()
+
+
+class PDFWorkerProcess(multiprocessing.context.SpawnProcess):
+    """
+    アプリのスクリプトを実行せずに起動するspawnのワーカープロセス。
+
+    spawnのワーカーは起動時に親プロセスの __main__ のファイルを再度読み込むが、
+    streamlit run ではアプリのスクリプト（main.py）が __main__ となっているため、
+    そのまま起動するとワーカーごとにStreamlitとアプリ全体を読み込み、モジュールレベルの処理も実行してしまう。
+    そのため、起動する間だけ __main__ をファイルを持たないモジュールに差し替える。
+    """
+
+    def start(self) -> None:
+        with _worker_start_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = _worker_main_module
+            try:
+                super().start()
+            finally:
+                # 起動中に他のスレッドで __main__ が差し替えられた場合は、その差し替えを優先する
+                if sys.modules.get("__main__") is _worker_main_module:
+                    sys.modules["__main__"] = main_module
+
+
+class PDFWorkerContext(multiprocessing.context.SpawnContext):
+    Process = PDFWorkerProcess
+
+
+def create_pdf_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    PDFのテキスト抽出用のプロセスプールを作成する。
+
+    Streamlitのサーバーは複数のスレッドで動作しているため、forkではなくspawnでワーカーを起動する。
+    ワーカーの起動時には、アプリのスクリプトを実行しない。
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=PDFWorkerContext())
+
+
+_pdf_text_cache: Optional[PDFTextCache] = None
+_pdf_process_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_pdf_text_cache() -> PDFTextCache:
+    """
+    プロセス全体で共有するPDFのテキストのキャッシュを返す。
+
+    設定は環境変数 PDF_TEXT_CACHE_MAX_DOCUMENTS・PDF_TEXT_CACHE_DIR から読み込む。
+    """
+    global _pdf_text_cache
+    if _pdf_text_cache is None:
+        with _lock:
+            if _pdf_text_cache is None:
+                _pdf_text_cache = PDFTextCache(
+                    max_documents=int(os.getenv("PDF_TEXT_CACHE_MAX_DOCUMENTS", "32")),
+                    cache_dir=os.getenv("PDF_TEXT_CACHE_DIR") or None,
+                )
+    return _pdf_text_cache
+
+
+def get_pdf_process_pool() -> ProcessPoolExecutor:
+    """
+    プロセス全体で共有するPDFのテキスト抽出用のプロセスプールを返す。
+
+    ワーカー数は環境変数 PDF_EXTRACT_WORKERS から読み込む（既定値はCPU数）。
+    """
+    global _pdf_process_pool
+    if _pdf_process_pool is None:
+        with _lock:
+            if _pdf_process_pool is None:
+                max_workers = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+                _pdf_process_pool = create_pdf_process_pool(max_workers)
+    return _pdf_process_pool
+
+
+@log_decorator(logger)
+def extract_pdf(
+    data: bytes,
+    file_name: str,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    cache: Optional[PDFTextCache] = None,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = DEFAULT_PAGES_PER_TASK,
+) -> PDFDocument:
+    """
+    PDFファイルのテキストをページごとに抽出する。
+
+    同じ内容のPDFを抽出済みの場合は、キャッシュしたテキストを返す。
+    未抽出の場合は、ページ範囲ごとにプロセスプールで並列に抽出し、抽出できたページ数を on_progress に通知する。
+
+    Args:
+        data (bytes): PDFファイルの内容。
+        file_name (str): PDFファイルの名前。
+        on_progress (Optional[Callable[[int, int], None]]): 抽出済みのページ数と総ページ数を受け取る関数。
+        cache (Optional[PDFTextCache]): 抽出したテキストのキャッシュ。省略時はプロセス全体で共有するキャッシュ。
+        executor (Optional[Executor]): ページ範囲の抽出を実行するプール。省略時はプロセス全体で共有するプール。
+        pages_per_task (int): 1つのタスクで抽出するページ数。
+
+    Returns:
+        PDFDocument: 抽出した文書。
+    """
+    cache = cache if cache is not None else get_pdf_text_cache()
+    content_hash = get_content_hash(data)
+    pages = cache.get(content_hash)
+    if pages is not None:
+        return PDFDocument(content_hash, file_name, pages)
+
+    # ワーカープロセスにPDFの内容を送らずに済むよう、一時ファイルに書き出してパスを渡す
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        with fitz.open(path) as pdf:  # type: ignore
+            page_count = pdf.page_count
+        if executor is None and page_count > pages_per_task:
+            executor = get_pdf_process_pool()
+
+        extracted_pages: List[Optional[str]] = [None] * page_count
+        for extracted_count, (page_number, text) in enumerate(
+            stream_pdf_pages(path, page_count, executor, pages_per_task), start=1
+        ):
+            extracted_pages[page_number] = text
+            if on_progress is not None:
+                on_progress(extracted_count, page_count)
+    finally:
+        os.remove(path)
+
+    pages = [text or "" for text in extracted_pages]
+    cache.set(content_hash, pages)
+    return PDFDocument(content_hash, file_name, pages)
@@ -0,0 +1,199 @@
+from logging import Logger
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import tiktoken as tk
+
+from data_source.openai_data_source import Role
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+from pdf_qa_service.BM25Index import get_bm25_index, save_bm25_index
+from pdf_qa_service.embedder import Embedder
+from pdf_qa_service.pdf_extractor import PDFDocument
+from pdf_qa_service.text_chunker import chunk_pages
+from pdf_qa_service.VectorIndex import SearchResult, VectorIndex
+
+logger: Logger = set_logging("lower.sub")
+
+# このチャンク数以上の文書は、IVFのクラスタを作成して近似探索する
+IVF_MIN_CHUNKS: int = 10000
+# 近似探索で探索するクラスタ数
+DEFAULT_N_PROBE: int = 8
+
+# 質問応答のプロンプトのうち、チャンクと質問以外（指示文や区切り）に見込むトークン数
+QA_PROMPT_OVERHEAD_TOKENS: int = 200
+
+QA_SYSTEM_PROMPT: str = (
+    "You answer questions using only the provided excerpts from the user's PDF documents. "
+    "Cite the file name and page of the excerpts you use. "
+    "If the excerpts do not contain the answer, say that you could not find it."
+)
+
+
+class DocumentIndexStore:
+    """
+    文書ごとのベクトルインデックスを、文書の内容のハッシュ値とEmbeddingの名前をキーとして保持するクラス。
+
+    index_dir を指定した場合はインデックスをディスクに保存し、プロセスの再起動後はメモリマップとして読み込む。
+    """
+
+    def __init__(self, index_dir: Optional[str] = None) -> None:
+        self.index_dir = index_dir
+        self._indexes: Dict[Tuple[str, str], VectorIndex] = {}
+        self._lock = threading.Lock()
+
+    @log_decorator(logger)
+    def get(self, document: PDFDocument, embedder: Embedder, encoding: tk.Encoding) -> VectorIndex:
+        """
+        文書のインデックスを返す。未作成の場合はチャンクに分割してEmbeddingを計算し、作成する。
+
+        Args:
+            document (PDFDocument): 検索対象の文書。
+            embedder (Embedder): チャンクのベクトルを計算するEmbedding。
+            encoding (tk.Encoding): チャンクのトークン数の計算に使用するエンコーダ。
+
+        Returns:
+            VectorIndex: 文書のインデックス。
+        """
+        key = (document.content_hash, embedder.name)
+        with self._lock:
+            index = self._indexes.get(key)
+        if index is not None:
+            return index
+
+        directory = self._index_path(key)
+        if directory and VectorIndex.exists(directory):
+            index = VectorIndex.load(directory)
+        else:
+            chunks = chunk_pages(document.content_hash, document.pages, encoding)
+            index = VectorIndex()
+            index.add(chunks, embedder.embed([chunk.text for chunk in chunks]))
+            if len(index) >= IVF_MIN_CHUNKS:
+                index.build_ivf()
+            if directory:
+                index.save(directory)
+
+        with self._lock:
+            # 同時に作成された場合は、先に登録されたインデックスを使用する
+            return self._indexes.setdefault(key, index)
+
+    def _index_path(self, key: Tuple[str, str]) -> Optional[str]:
+        if not self.index_dir:
+            return None
+        return os.path.join(self.index_dir, f"{key[0]}-{key[1]}")
+
+
+_document_index_store: Optional[DocumentIndexStore] = None
+_document_index_store_lock = threading.Lock()
+
+
+def get_document_index_store() -> DocumentIndexStore:
+    """
+    プロセス全体で共有するインデックスの保管先を返す。
+
+    インデックスを保存するディレクトリは環境変数 PDF_INDEX_DIR から読み込む。
+    """
+    global _document_index_store
+    if _document_index_store is None:
+        with _document_index_store_lock:
+            if _document_index_store is None:
+                _document_index_store = DocumentIndexStore(os.getenv("PDF_INDEX_DIR") or None)
+    return _document_index_store
+
+
+@log_decorator(logger)
+def retrieve(
+    indexes: List[VectorIndex], question: str, embedder: Embedder, top_k: int
+) -> List[SearchResult]:
+    """
+    複数の文書のインデックスから、質問に類似するチャンクをスコアの高い順に最大 top_k 件返す。
+
+    Args:
+        indexes (List[VectorIndex]): 検索対象の文書のインデックス。
+        question (str): ユーザーの質問。
+        embedder (Embedder): 質問のベクトルを計算するEmbedding。
+        top_k (int): 返す件数。
+
+    Returns:
+        List[SearchResult]: 検索結果。
+    """
+    query = embedder.embed([question])[0]
+    results: List[SearchResult] = []
+    for index in indexes:
+        n_probe = DEFAULT_N_PROBE if index.has_ivf else None
+        results.extend(index.search(query, top_k, n_probe=n_probe))
+    results.sort(key=lambda result: result.score, reverse=True)
+    return results[:top_k]
+
+
+@log_decorator(logger)
+def retrieve_lexical(
+    documents: List[PDFDocument], question: str, encoding: tk.Encoding, top_k: int
+) -> List[SearchResult]:
+    """
+    BM25のインデックスから、質問の語に一致するチャンクをスコアの高い順に最大 top_k 件返す。
+
+    Embeddingを計算しないため、Embedding APIを呼び出さずに検索できる。
+    インデックスに未追加の文書は、チャンクに分割して追加してから検索する。
+
+    Args:
+        documents (List[PDFDocument]): 検索対象の文書。
+        question (str): ユーザーの質問。
+        encoding (tk.Encoding): チャンクのトークン数の計算に使用するエンコーダ。
+        top_k (int): 返す件数。
+
+    Returns:
+        List[SearchResult]: 検索結果。
+    """
+    index = get_bm25_index()
+    missing_documents = [document for document in documents if document.content_hash not in index]
+    for document in missing_documents:
+        index.add_document(
+            document.content_hash, chunk_pages(document.content_hash, document.pages, encoding)
+        )
+    if missing_documents:
+        save_bm25_index()
+    return index.search(
+        question, top_k, document_hashes=[document.content_hash for document in documents]
+    )
+
+
+def build_qa_messages(
+    question: str,
+    results: List[SearchResult],
+    file_names: Dict[str, str],
+    max_context_tokens: int,
+) -> Tuple[List[Dict[str, Any]], List[SearchResult]]:
+    """
+    検索したチャンクのみを文脈として含む、Chat APIに送信するメッセージを作成する。
+
+    チャンクはスコアの高い順に、合計のトークン数が max_context_tokens を超えない範囲で含める。
+
+    Args:
+        question (str): ユーザーの質問。
+        results (List[SearchResult]): 検索結果（スコアの高い順）。
+        file_names (Dict[str, str]): 文書の内容のハッシュ値とファイル名の対応。
+        max_context_tokens (int): 文脈に含めるチャンクの合計トークン数の上限。
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[SearchResult]]: 送信するメッセージと、文脈に含めた検索結果。
+    """
+    used_results: List[SearchResult] = []
+    excerpts: List[str] = []
+    context_tokens = 0
+    for result in results:
+        chunk = result.chunk
+        if context_tokens + chunk.token_count > max_context_tokens:
+            break
+        context_tokens += chunk.token_count
+        used_results.append(result)
+        file_name = file_names.get(chunk.document_hash, chunk.document_hash[:12])
+        excerpts.append(f"[{file_name}, page {chunk.page_number}]\n{chunk.text}")
+
+    user_content = "Excerpts:\n\n" + "\n\n---\n\n".join(excerpts) + f"\n\nQuestion: {question}"
+    messages = [
+        {"role": Role.SYSTEM.value, "content": QA_SYSTEM_PROMPT},
+        {"role": Role.USER.value, "content": user_content},
+    ]
+    return messages, used_results
@@ -0,0 +1,74 @@
+from logging import Logger
+from typing import Any, Dict, List
+
+import tiktoken as tk
+
+from logs.app_logger import set_logging
+from logs.log_decorator import log_decorator
+
+logger: Logger = set_logging("lower.sub")
+
+# 1つのチャンクのトークン数と、前のチャンクと重複させるトークン数の既定値
+DEFAULT_CHUNK_TOKENS: int = 400
+DEFAULT_OVERLAP_TOKENS: int = 50
+
+
+class TextChunk:
+    def __init__(
+        self, document_hash: str, page_number: int, chunk_index: int, text: str, token_count: int
+    ) -> None:
+        # チャンクを含む文書の内容のハッシュ値
+        self.document_hash = document_hash
+        # チャンクを含むページの番号（1始まり）
+        self.page_number = page_number
+        # 文書内でのチャンクの通し番号
+        self.chunk_index = chunk_index
+        self.text = text
+        self.token_count = token_count
+
+    def to_dict(self) -> Dict[str, Any]:
+        return vars(self).copy()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TextChunk":
+        return cls(**data)
+
+
+@log_decorator(logger)
+def chunk_pages(
+    document_hash: str,
+    pages: List[str],
+    encoding: tk.Encoding,
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[TextChunk]:
+    """
+    ページごとのテキストを、トークン数の上限に収まるチャンクに分割する。
+
+    参照元のページを示せるよう、チャンクはページをまたがない。
+    ページ内では、文脈が途切れないよう前のチャンクの末尾 overlap_tokens トークンを重複させる。
+
+    Args:
+        document_hash (str): 文書の内容のハッシュ値。
+        pages (List[str]): ページごとのテキスト。
+        encoding (tk.Encoding): トークン数の計算に使用するエンコーダ。
+        chunk_tokens (int): 1つのチャンクの最大トークン数。
+        overlap_tokens (int): 前のチャンクと重複させるトークン数。
+
+    Returns:
+        List[TextChunk]: 分割したチャンクのリスト（文書内の順）。
+    """
+    if overlap_tokens >= chunk_tokens:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+    stride = chunk_tokens - overlap_tokens
+
+    chunks: List[TextChunk] = []
+    for page_number, tokens in enumerate(encoding.encode_ordinary_batch(pages), start=1):
+        for start in range(0, len(tokens), stride):
+            window = tokens[start : start + chunk_tokens]
+            text = encoding.decode(window).strip()
+            if text:
+                chunks.append(TextChunk(document_hash, page_number, len(chunks), text, len(window)))
+            if start + chunk_tokens >= len(tokens):
+                break
+    return chunks
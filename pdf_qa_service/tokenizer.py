@@ -0,0 +1,31 @@
+import re
+from typing import List
+
+# 英数字の単語、または日本語・中国語・韓国語の文字の連続
+_TERM_PATTERN = re.compile(
+    r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+"
+)
+_ASCII_TERM_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    検索用にテキストを語に分割する。
+
+    英数字は小文字の単語単位とし、分かち書きされない日本語などの文字の連続は
+    文字の2-gramに分割する（1文字のみの場合はその文字を1語とする）。
+
+    Args:
+        text (str): 分割するテキスト。
+
+    Returns:
+        List[str]: 分割した語のリスト（出現順）。
+    """
+    terms: List[str] = []
+    for match in _TERM_PATTERN.finditer(text.lower()):
+        term = match.group()
+        if _ASCII_TERM_PATTERN.fullmatch(term) or len(term) == 1:
+            terms.append(term)
+        else:
+            terms.extend(term[i : i + 2] for i in range(len(term) - 1))
+    return terms
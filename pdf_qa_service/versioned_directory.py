@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Optional
+import uuid
+
+# 公開中のバージョンのディレクトリ名を記録するファイルと、バージョンごとのディレクトリ名の接頭辞
+CURRENT_FILE_NAME: str = "CURRENT"
+VERSION_PREFIX: str = "version-"
+
+
+def publish_version(directory: str, write_files: Callable[[str], None]) -> str:
+    """
+    ディレクトリに新しいバージョンのファイルを書き込み、公開中のバージョンとして切り替える。
+
+    write_files には一時ディレクトリのパスを渡し、書き込みが完了した一時ディレクトリを
+    バージョンごとのディレクトリとして公開してから、CURRENT ファイルを置き換えて切り替える。
+    そのため、途中で失敗した場合や同時に保存した場合も、読み込み側が異なる保存のファイルを組み合わせることはない。
+    読み込み中の可能性がある直前のバージョンは残し、それより古いバージョンを削除する。
+
+    Args:
+        directory (str): 保存先のディレクトリ。
+        write_files (Callable[[str], None]): 渡されたディレクトリにファイルを書き込む関数。
+
+    Returns:
+        str: 公開したバージョンのディレクトリ名。
+    """
+    os.makedirs(directory, exist_ok=True)
+    temp_directory = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    try:
+        write_files(temp_directory)
+        version = f"{VERSION_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        os.rename(temp_directory, os.path.join(directory, version))
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+    previous_version = read_current_version(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".current")
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        file.write(version)
+    os.replace(temp_path, os.path.join(directory, CURRENT_FILE_NAME))
+
+    # 他のプロセスが直後に公開したバージョンも削除しないよう、CURRENT を読み直す
+    keep = {version, previous_version, read_current_version(directory)}
+    for name in os.listdir(directory):
+        if name.startswith(VERSION_PREFIX) and name not in keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return version
+
+
+def read_current_version(directory: str) -> Optional[str]:
+    """公開中のバージョンのディレクトリ名を返す。公開したバージョンがない場合はNoneを返す。"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE_NAME), "r", encoding="utf-8") as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def get_current_version_path(directory: str) -> Optional[str]:
+    """公開中のバージョンのディレクトリのパスを返す。公開したバージョンがない場合はNoneを返す。"""
+    version = read_current_version(directory)
+    return os.path.join(directory, version) if version is not None else None
@@ -0,0 +1,56 @@
+from logs.app_logger import METRICS_LOGGER_NAME, create_logging_config, set_logging
+
+AZURE_ENV_NAMES = [
+    "STORAGE_ACCOUNT_NAME",
+    "STORAGE_ACCESS_KEY",
+    "CONTAINER_NAME",
+    "BLOB_NAME",
+    "INSTRUMENTATION_KEY",
+]
+
+
+def test_create_logging_config_without_azure_env_uses_console_only(monkeypatch):
+    for name in AZURE_ENV_NAMES:
+        monkeypatch.delenv(name, raising=False)
+    config = create_logging_config()
+    assert list(config["handlers"]) == ["consoleHandler"]
+    for logger_config in config["loggers"].values():
+        assert logger_config["handlers"] == ["consoleHandler"]
+
+
+def test_create_logging_config_with_azure_env_adds_azure_handlers(monkeypatch):
+    for name in AZURE_ENV_NAMES:
+        monkeypatch.setenv(name, "dummy")
+    config = create_logging_config()
+    assert set(config["handlers"]) == {
+        "consoleHandler",
+        "azureBlobHandler",
+        "azureApplicationInsightsHandler",
+    }
+    loggers = dict(config["loggers"])
+    assert loggers.pop(METRICS_LOGGER_NAME)["handlers"] == [
+        "consoleHandler",
+        "azureBlobHandler",
+        "azureApplicationInsightsHandler",
+    ]
+    for logger_config in loggers.values():
+        assert logger_config["handlers"] == ["consoleHandler", "azureBlobHandler"]
+
+
+def test_every_configured_handler_is_attached_to_a_logger(monkeypatch):
+    for name in AZURE_ENV_NAMES:
+        monkeypatch.setenv(name, "dummy")
+    config = create_logging_config()
+    attached = {
+        handler for logger_config in config["loggers"].values() for handler in logger_config["handlers"]
+    }
+    assert attached == set(config["handlers"])
+
+
+def test_set_logging_configures_handlers_only_once():
+    logger = set_logging("lower.sub")
+    handlers = list(logger.handlers)
+    assert set_logging("lower.sub") is logger
+    set_logging("__main__")
+    assert logger.handlers == handlers
+    assert all(a is b for a, b in zip(logger.handlers, handlers))
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+import pytest
+from logs.AzureBlobHandler import AzureBlobHandler, OverflowPolicy
+
+
+class FakeBlobClient:
+    def __init__(self, service, blob):
+        self.service = service
+        self.blob = blob
+
+    def upload_blob(self, data, blob_type, overwrite):
+        assert blob_type == "AppendBlob"
+        assert overwrite is False
+        self.service.wait_until_released()
+        with self.service.lock:
+            self.service.uploads.append((self.blob, data))
+            self.service.blobs[self.blob] = self.service.blobs.get(self.blob, "") + data
+
+
+class FakeBlobServiceClient:
+    """アップロード内容をメモリに保持するBlobServiceClientの代替"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.uploads = []
+        self.created_clients = []
+        self.released = threading.Event()
+        self.released.set()
+
+    def get_blob_client(self, container, blob):
+        self.created_clients.append((container, blob))
+        return FakeBlobClient(self, blob)
+
+    def wait_until_released(self):
+        self.released.wait(timeout=5)
+
+
+def create_record(message):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def create_handler(service, **kwargs):
+    handler = AzureBlobHandler(
+        container_name="logs", blob_name="app", blob_service_client=service, **kwargs
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def read_lines(service):
+    return [line for data in service.blobs.values() for line in data.splitlines()]
+
+
+def test_emit_uploads_records_in_batches_with_one_client_per_blob():
+    service = FakeBlobServiceClient()
+    handler = create_handler(service, max_batch_size=10, flush_interval=60)
+    for i in range(25):
+        handler.emit(create_record(f"message {i}"))
+    handler.close()
+
+    assert read_lines(service) == [f"message {i}" for i in range(25)]
+    assert len(service.uploads) == 3
+    assert len(service.created_clients) == 1
+    assert service.created_clients[0][1].startswith("app-")
+
+
+def test_records_are_uploaded_after_flush_interval():
+    service = FakeBlobServiceClient()
+    handler = create_handler(service, max_batch_size=100, flush_interval=0.05)
+    handler.emit(create_record("message"))
+    for _ in range(100):
+        if service.uploads:
+            break
+        time.sleep(0.01)
+    assert read_lines(service) == ["message"]
+    handler.close()
+
+
+def test_flush_waits_for_pending_records():
+    service = FakeBlobServiceClient()
+    handler = create_handler(service, max_batch_size=100, flush_interval=60)
+    handler.emit(create_record("message"))
+    handler.flush()
+    assert read_lines(service) == ["message"]
+    handler.close()
+
+
+@pytest.mark.parametrize(
+    "overflow_policy, expected_lines",
+    [
+        (OverflowPolicy.DROP_NEWEST, ["message 0", "message 1"]),
+        (OverflowPolicy.DROP_OLDEST, ["message 3", "message 4"]),
+        (OverflowPolicy.BLOCK, ["message 0", "message 1"]),
+    ],
+)
+def test_full_queue_applies_overflow_policy(overflow_policy, expected_lines):
+    service = FakeBlobServiceClient()
+    handler = create_handler(
+        service,
+        max_batch_size=1,
+        flush_interval=60,
+        max_queue_size=2,
+        overflow_policy=overflow_policy,
+        block_timeout=0.01,
+    )
+    # 1件目のアップロードを止めている間にキューを溢れさせる
+    service.released.clear()
+    handler.emit(create_record("blocked"))
+    while handler._records:
+        time.sleep(0.01)
+    for i in range(5):
+        handler.emit(create_record(f"message {i}"))
+    service.released.set()
+    handler.close()
+
+    assert read_lines(service) == ["blocked"] + expected_lines
+    assert handler.dropped_records == 3
+
+
+def test_emit_after_close_is_dropped():
+    service = FakeBlobServiceClient()
+    handler = create_handler(service)
+    handler.close()
+    handler.emit(create_record("message"))
+    assert service.uploads == []
+    assert handler.dropped_records == 1
+
+
+def test_flush_and_close_on_full_queue_are_not_dropped():
+    service = FakeBlobServiceClient()
+    handler = create_handler(
+        service,
+        max_batch_size=1,
+        flush_interval=60,
+        max_queue_size=2,
+        overflow_policy=OverflowPolicy.DROP_OLDEST,
+    )
+    service.released.clear()
+    handler.emit(create_record("blocked"))
+    while handler._records:
+        time.sleep(0.01)
+    flush_thread = threading.Thread(target=handler.flush, kwargs={"timeout": 5})
+    flush_thread.start()
+    # flushの要求の後にキューを溢れさせても、要求は破棄されない
+    for i in range(5):
+        handler.emit(create_record(f"message {i}"))
+    service.released.set()
+
+    started_at = time.monotonic()
+    flush_thread.join()
+    handler.close()
+    assert time.monotonic() - started_at < 2
+    assert read_lines(service) == ["blocked", "message 3", "message 4"]
+    assert handler.dropped_records == 3
+    assert not handler._worker.is_alive()
@@ -0,0 +1,33 @@
+import pytest
+from benchmarks.report import find_regressions, load_baseline, percentile, save_baseline, summarize
+
+
+def test_percentile_interpolates_between_samples():
+    samples = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(samples, 0) == 1.0
+    assert percentile(samples, 50) == 2.5
+    assert percentile(samples, 100) == 4.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summarize_reports_throughput_and_percentiles():
+    summary = summarize([0.3, 0.1, 0.2], elapsed=0.5)
+    assert summary["count"] == 3
+    assert summary["throughput"] == pytest.approx(6.0)
+    assert summary["mean"] == pytest.approx(0.2)
+    assert (summary["min"], summary["p50"], summary["max"]) == (0.1, 0.2, 0.3)
+
+
+def test_find_regressions_compares_with_saved_baseline(tmp_path):
+    path = str(tmp_path / "baselines" / "baseline.json")
+    save_baseline(path, {"fast": summarize([0.1] * 10, 1.0), "slow": summarize([0.1] * 10, 1.0)})
+
+    results = {
+        "fast": summarize([0.11] * 10, 1.0),
+        "slow": summarize([0.2] * 10, 2.0),
+        # ベースラインにないベンチマークは比較しない
+        "new": summarize([1.0], 1.0),
+    }
+    regressions = find_regressions(results, load_baseline(path), tolerance=0.2)
+    assert len(regressions) == 2
+    assert all(regression.startswith("slow ") for regression in regressions)
@@ -0,0 +1,102 @@
+import os
+import threading
+
+import pdf_qa_service.BM25Index as bm25_module
+from pdf_qa_service.BM25Index import BM25Index, save_bm25_index
+from pdf_qa_service.text_chunker import TextChunk
+
+
+def make_chunks(document_hash, texts):
+    return [TextChunk(document_hash, i + 1, i, text, len(text)) for i, text in enumerate(texts)]
+
+
+def build_index():
+    index = BM25Index()
+    manual_pages = ["Install the printer driver.", "Replace the toner cartridge.", "Toner toner toner"]
+    index.add_document("manual", make_chunks("manual", manual_pages))
+    index.add_document("guide", make_chunks("guide", ["東京タワーの高さは333メートル", "富士山の標高"]))
+    return index
+
+
+def test_search_ranks_chunks_by_bm25():
+    results = build_index().search("replace toner cartridge", top_k=3)
+
+    assert [(r.chunk.document_hash, r.chunk.page_number) for r in results] == [
+        ("manual", 2),
+        ("manual", 3),
+    ]
+    assert results[0].score > results[1].score > 0
+
+
+def test_search_cjk_text_with_bigrams():
+    results = build_index().search("東京タワー", top_k=5)
+    assert [(r.chunk.document_hash, r.chunk.page_number) for r in results] == [("guide", 1)]
+
+
+def test_search_can_be_limited_to_documents():
+    index = build_index()
+    assert index.search("toner", document_hashes=["guide"]) == []
+    assert index.search("toner", document_hashes=["manual", "missing"])
+
+
+def test_remove_and_replace_document_without_rebuild():
+    index = build_index()
+    assert index.remove_document("manual")
+    assert not index.remove_document("manual")
+    assert "manual" not in index
+    assert index.search("toner") == []
+    assert index.chunk_count == 2
+
+    index.add_document("guide", make_chunks("guide", ["toner only"]))
+    assert index.document_count == 1
+    assert [r.chunk.text for r in index.search("toner")] == ["toner only"]
+    assert index.search("東京") == []
+
+
+def test_save_and_load(tmp_path):
+    index = build_index()
+    index.remove_document("guide")
+    index.save(str(tmp_path))
+
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.chunk_count == index.chunk_count
+    assert [(r.chunk.text, r.score) for r in loaded.search("toner")] == [
+        (r.chunk.text, r.score) for r in index.search("toner")
+    ]
+    # 読み込んだインデックスにも追加できる
+    loaded.add_document("guide", make_chunks("guide", ["new toner page"]))
+    assert len(loaded.search("toner", top_k=10)) == 3
+
+
+def test_concurrent_saves_publish_a_complete_version(tmp_path):
+    index = build_index()
+    errors = []
+
+    def save():
+        try:
+            for _ in range(5):
+                index.save(str(tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert BM25Index.load(str(tmp_path)).chunk_count == index.chunk_count
+    # 公開中と直前のバージョンのみが残り、一時ディレクトリは残らない
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("version-")]) == 2
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")]
+
+
+def test_save_bm25_index_saves_in_background(tmp_path, monkeypatch):
+    monkeypatch.setenv("BM25_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(bm25_module, "_bm25_index", build_index())
+
+    future = save_bm25_index()
+    future.result(timeout=5)
+    assert BM25Index.exists(str(tmp_path))
+    assert BM25Index.load(str(tmp_path)).document_count == 2
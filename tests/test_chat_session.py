@@ -0,0 +1,241 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+from streamlit.runtime.scriptrunner.script_runner import StopException
+from streamlit.testing.v1 import AppTest
+
+import chat_session.ChatSession as chat_session_module
+from chat_session.GenerationJob import GenerationJob
+from chat_session.StreamingRenderer import StreamingRenderer
+from chat_session.SummaryMemory import SummaryMemory
+from data_source.openai_client_registry import ChatCompletionStream
+
+MODEL_VERSION = "gpt-3.5-turbo"
+
+
+@pytest.fixture(autouse=True)
+def restore_main_module(monkeypatch):
+    # AppTestはスクリプトを __main__ として実行したままにするため、
+    # spawnで起動する他のテストのワーカープロセスがこのスクリプトを実行しないよう元に戻す
+    monkeypatch.setitem(sys.modules, "__main__", sys.modules["__main__"])
+
+
+def _attach_pending_job_script():
+    # AppTestで実行するスクリプト（関数の本体のみが実行されるため、必要なモジュールはここでインポートする）
+    import streamlit as st
+    from chat_session.ChatSession import ChatSession
+
+    chat_session = ChatSession()
+    job = st.session_state.get("generation_job")
+    if job is not None:
+        st.session_state.results.append(chat_session.attach_generation_job(job))
+
+
+def create_finished_job(text):
+    job = GenerationJob(MODEL_VERSION, lambda: [text], prompt_tokens=5)
+    job.run()
+    return job
+
+
+def test_interrupted_replay_of_finished_job_is_added_on_next_run(monkeypatch):
+    app = AppTest.from_function(_attach_pending_job_script)
+    app.session_state["results"] = []
+    app.session_state["generation_job"] = create_finished_job("Hello")
+
+    original_append = StreamingRenderer.append
+
+    def interrupted_append(self, delta):
+        monkeypatch.setattr(StreamingRenderer, "append", original_append)
+        # ウィジェットの操作による再実行で、表示の途中でスクリプトが中断された場合を模倣する
+        raise StopException()
+
+    monkeypatch.setattr(StreamingRenderer, "append", interrupted_append)
+    app.run()
+    assert app.session_state["results"] == []
+    assert "generation_job" in app.session_state
+
+    app.run()
+    assert [m["content"] for m in app.session_state["messages"] if m["role"] == "assistant"] == [
+        "Hello"
+    ]
+    assert len(app.session_state["results"]) == 1
+    is_error, prompt_tokens, completion_tokens = app.session_state["results"][0]
+    assert (is_error, prompt_tokens) == (False, 5)
+    assert completion_tokens > 0
+    assert "generation_job" not in app.session_state
+
+    # 追加済みのジョブは再表示・再集計されない
+    app.run()
+    assert len(app.session_state["results"]) == 1
+
+
+def test_failed_job_is_released_after_the_error_is_handled():
+    def start():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    job = GenerationJob(MODEL_VERSION, start)
+    job.run()
+    app = AppTest.from_function(_attach_pending_job_script)
+    app.session_state["results"] = []
+    app.session_state["generation_job"] = job
+    app.run()
+
+    assert app.session_state["results"] == [(True, 0, 0)]
+    assert "generation_job" not in app.session_state
+
+
+def _attach_two_jobs_script():
+    import streamlit as st
+    from chat_session.ChatSession import ChatSession
+
+    chat_session = ChatSession()
+    for job in st.session_state.get("jobs", []):
+        st.session_state.results.append(chat_session.attach_generation_job(job))
+
+
+def test_two_jobs_can_be_attached_in_the_same_run():
+    app = AppTest.from_function(_attach_two_jobs_script)
+    app.session_state["results"] = []
+    app.session_state["jobs"] = [create_finished_job("First"), create_finished_job("Second")]
+    app.run()
+
+    assert not app.exception
+    assert [is_error for is_error, _, _ in app.session_state["results"]] == [False, False]
+    assert [m["content"] for m in app.session_state["messages"] if m["role"] == "assistant"] == [
+        "First",
+        "Second",
+    ]
+
+
+class BlockingStream:
+    """close されるまで受信を待ち続ける上流のストリーム。"""
+
+    def __init__(self):
+        self.is_closed = threading.Event()
+
+    def __iter__(self):
+        yield "partial"
+        self.is_closed.wait(5)
+
+    def close(self):
+        self.is_closed.set()
+
+
+def _clear_conversations_script():
+    from chat_session.initialize_chat_page import clear_conversations
+
+    clear_conversations()
+
+
+def test_clearing_conversations_cancels_the_running_job():
+    stream = BlockingStream()
+    job = GenerationJob(MODEL_VERSION, lambda: stream)
+    worker = threading.Thread(target=job.run)
+    worker.start()
+    # 上流からの受信が始まるまで待つ
+    assert next(job.subscribe()) == "partial"
+    app = AppTest.from_function(_clear_conversations_script)
+    app.session_state["messages"] = []
+    app.session_state["generation_job"] = job
+    app.run()
+
+    app.sidebar.button(key="clear").click().run()
+
+    assert "generation_job" not in app.session_state
+    assert job.is_cancelled
+    assert stream.is_closed.is_set()
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta={"content": content})])
+
+
+class BlockingClient:
+    """release が設定されるまで応答の途中で受信を止める、Chat APIの偽のクライアント。"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def create_chat_completion(self, estimated_tokens=0, **params):
+        self.calls += 1
+
+        def chunks():
+            yield make_chunk("Hello")
+            self.release.wait(5)
+            yield make_chunk(", world")
+
+        return ChatCompletionStream(chunks(), [])
+
+
+def _single_flight_script():
+    import time
+
+    import streamlit as st
+    from chat_session.ChatSession import ChatSession
+    from chat_session.SingleFlight import get_single_flight
+    from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+
+    chat_session = ChatSession()
+    chat_session.append_message("user", "Hello", "gpt-3.5-turbo")
+    llm = ModelParameters(
+        max_tokens=16,
+        temperature=0.0,
+        top_p=0.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        deployment_name="",
+    )
+    followers = get_single_flight().followers
+    leader = chat_session.submit_assistant_chat_response("gpt-3.5-turbo", llm)
+    # 別のセッションから同じリクエストが届いた場合を模倣する
+    del st.session_state["generation_job"]
+    follower = chat_session.submit_assistant_chat_response("gpt-3.5-turbo", llm)
+    deadline = time.monotonic() + 5
+    while get_single_flight().followers == followers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    st.session_state.client.release.set()
+    st.session_state.results = [
+        chat_session.attach_generation_job(leader),
+        chat_session.attach_generation_job(follower),
+    ]
+
+
+def test_only_the_leader_of_a_shared_request_is_billed(monkeypatch):
+    client = BlockingClient()
+    monkeypatch.setattr(chat_session_module, "get_openai_client", lambda model_version: client)
+    app = AppTest.from_function(_single_flight_script)
+    app.session_state["client"] = client
+    app.run()
+
+    assert not app.exception
+    assert client.calls == 1
+    (leader_error, leader_prompt, leader_completion), follower_result = app.session_state["results"]
+    assert not leader_error and leader_prompt > 0 and leader_completion > 0
+    assert follower_result == (False, 0, 0)
+
+
+def test_completed_summary_usage_is_billed_with_the_turn():
+    memory = SummaryMemory()
+    messages = [{"role": "system", "content": ""}] + [
+        {"role": "user", "content": f"message {i}", "tokens": {MODEL_VERSION: 100}} for i in range(10)
+    ]
+    memory.maybe_summarize(messages, MODEL_VERSION, 500, lambda summary, messages: ("summary", 300, 40))
+    memory.wait(timeout=5)
+    app = AppTest.from_function(_attach_pending_job_script)
+    app.session_state["results"] = []
+    app.session_state["summary_memory"] = memory
+    app.session_state["generation_job"] = create_finished_job("Hello")
+    app.run()
+
+    [(is_error, prompt_tokens, completion_tokens)] = app.session_state["results"]
+    assert not is_error
+    assert prompt_tokens == 5 + 300
+    assert completion_tokens > 40
+    # 集計済みの要約は次のターンで再び集計しない
+    assert memory.take_usage(MODEL_VERSION) == (0, 0)
@@ -1,7 +1,15 @@
 from decimal import Decimal
 import pytest
 from costs.get_conversation_cost import get_conversation_cost
-from costs.get_token_count import get_tiktoken_count
+from costs.get_token_count import (
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+    get_encoding,
+    get_message_token_counts,
+    get_prompt_token_count,
+    get_tiktoken_count,
+    get_tiktoken_counts,
+)
 
 
 def test_get_tiktoken_count_with_gpt_3_5_returns_expected_token_count():
@@ -26,6 +34,39 @@ def test_get_tiktoken_count_with_long_string():
     assert token_count == expected_token_count
 
 
+def test_get_encoding_returns_cached_instance_per_model():
+    assert get_encoding("gpt-3.5-turbo") is get_encoding("gpt-3.5-turbo")
+
+
+def test_get_tiktoken_counts_matches_single_counts():
+    messages = ["こんにちは", "", "これは非常に長いメッセージです。" * 100, "Hello, world!"]
+    token_counts = get_tiktoken_counts(messages, "gpt-3.5-turbo")
+    assert token_counts == [get_tiktoken_count(message, "gpt-3.5-turbo") for message in messages]
+
+
+def test_get_tiktoken_counts_with_empty_list():
+    assert get_tiktoken_counts([], "gpt-3.5-turbo") == []
+
+
+def test_get_message_token_counts_caches_count_on_message():
+    messages = [{"role": "user", "content": "こんにちは"}]
+    assert get_message_token_counts(messages, "gpt-3.5-turbo") == [1]
+    assert messages[0]["tokens"] == {"gpt-3.5-turbo": 1}
+
+    # キャッシュ済みの値が使われ、再計算されないこと
+    messages[0]["tokens"]["gpt-3.5-turbo"] = 10
+    assert get_message_token_counts(messages, "gpt-3.5-turbo") == [10]
+
+
+def test_get_prompt_token_count_includes_chatml_overhead():
+    messages = [
+        {"role": "system", "content": ""},
+        {"role": "user", "content": "こんにちは"},
+    ]
+    expected_token_count = 1 + TOKENS_PER_MESSAGE * 2 + TOKENS_PER_REPLY
+    assert get_prompt_token_count(messages, "gpt-3.5-turbo") == expected_token_count
+
+
 @pytest.mark.parametrize(
     "prompt_count, completion_count, prompt_cost, completion_cost, expected_total",
     [
@@ -57,3 +98,4 @@ def test_get_conversation_cost_invalid_input(
 ):
     with pytest.raises(ValueError):
         get_conversation_cost(prompt_count, completion_count, prompt_cost, completion_cost)
+
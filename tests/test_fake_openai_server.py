@@ -0,0 +1,52 @@
+import json
+
+import requests
+from benchmarks.fake_openai_server import FakeOpenAIServer, FakeServerConfig
+
+CHAT_PATH = "/openai/deployments/fake/chat/completions?api-version=2023-05-15"
+
+
+def read_stream_contents(response):
+    contents = []
+    for line in response.iter_lines():
+        if not line or line == b"data: [DONE]":
+            continue
+        chunk = json.loads(line[len(b"data: ") :])
+        contents.append(chunk["choices"][0]["delta"].get("content", ""))
+    return contents
+
+
+def test_fake_server_streams_configured_number_of_tokens():
+    config = FakeServerConfig(time_to_first_token=0.0, inter_token_delay=0.0, reply_tokens=5)
+    with FakeOpenAIServer(config) as server:
+        response = requests.post(server.base_url + CHAT_PATH, json={"stream": True}, stream=True)
+        assert response.headers["Content-Type"] == "text/event-stream"
+        contents = read_stream_contents(response)
+
+    # 先頭のロールのみのチャンクと末尾の終了のチャンクは本文を持たない
+    assert contents[0] == "" and contents[-1] == ""
+    assert "".join(contents) == "lorem ipsum dolor sit amet "
+
+
+def test_fake_server_returns_whole_reply_without_stream():
+    config = FakeServerConfig(time_to_first_token=0.0, reply_tokens=3)
+    with FakeOpenAIServer(config) as server:
+        response = requests.post(server.base_url + CHAT_PATH, json={})
+
+    assert response.json()["choices"][0]["message"]["content"] == "lorem ipsum dolor "
+    assert response.json()["usage"]["completion_tokens"] == 3
+
+
+def test_fake_server_injects_rate_limit_errors():
+    config = FakeServerConfig(time_to_first_token=0.0, reply_tokens=1, rate_limit_every=2)
+    with FakeOpenAIServer(config) as server:
+        responses = [requests.post(server.base_url + CHAT_PATH, json={}) for _ in range(4)]
+
+        assert [response.status_code for response in responses] == [200, 429, 200, 429]
+        assert responses[1].headers["retry-after-ms"] == "50"
+        assert (server.request_count, server.rate_limited_count) == (4, 2)
+
+
+def test_fake_server_rejects_unknown_path():
+    with FakeOpenAIServer() as server:
+        assert requests.post(server.base_url + "/v1/embeddings", json={}).status_code == 404
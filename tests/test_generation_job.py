@@ -0,0 +1,99 @@
+import threading
+import time
+
+import openai
+import pytest
+from chat_session.GenerationJob import GenerationJob, GenerationJobPool
+
+
+def test_job_keeps_generating_and_can_be_reattached_from_the_start():
+    release = threading.Event()
+    completed = []
+
+    def start():
+        yield "Hello"
+        release.wait(timeout=5)
+        yield None
+        yield ", world"
+
+    pool = GenerationJobPool(max_workers=1, max_queued_jobs=0)
+    job = pool.submit(GenerationJob("model", start, prompt_tokens=12, on_complete=completed.append))
+
+    # 最初の表示は途中で中断される（スクリプトの再実行を想定）
+    first_view = job.subscribe()
+    assert next(first_view) == "Hello"
+    release.set()
+    assert job.wait(timeout=5)
+
+    # 再実行後の表示は受信済みの差分から再開する
+    assert list(job.subscribe()) == ["Hello", ", world"]
+    assert job.text == "Hello, world"
+    assert completed == ["Hello, world"]
+    assert job.error is None
+
+
+def test_job_error_is_raised_to_subscribers():
+    def start():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    job = GenerationJob("model", start)
+    job.run()
+
+    assert job.is_done
+    with pytest.raises(RuntimeError):
+        list(job.subscribe())
+
+
+def test_pool_rejects_jobs_over_capacity():
+    release = threading.Event()
+
+    def start():
+        release.wait(timeout=5)
+        yield "done"
+
+    pool = GenerationJobPool(max_workers=1, max_queued_jobs=1)
+    jobs = [pool.submit(GenerationJob("model", start)) for _ in range(2)]
+
+    with pytest.raises(openai.error.RateLimitError):
+        pool.submit(GenerationJob("model", start))
+    assert pool.rejected_jobs == 1
+    assert pool.active_jobs == 2
+
+    release.set()
+    assert all(job.wait(timeout=5) for job in jobs)
+    # 完了したジョブの枠は解放される
+    deadline = time.monotonic() + 5
+    while pool.active_jobs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.active_jobs == 0
+
+
+def test_cancel_keeps_partial_reply_and_closes_upstream():
+    received = threading.Event()
+    closed = threading.Event()
+
+    class Upstream:
+        def __iter__(self):
+            yield "partial"
+            received.set()
+            closed.wait(timeout=5)
+            yield " never shown"
+
+        def close(self):
+            closed.set()
+
+    completed = []
+    job = GenerationJob("model", Upstream, on_complete=completed.append)
+    GenerationJobPool(max_workers=1, max_queued_jobs=0).submit(job)
+    assert received.wait(timeout=5)
+
+    assert job.cancel()
+    assert closed.is_set()
+    assert job.is_done and job.is_cancelled
+    assert job.text == "partial"
+    assert list(job.subscribe()) == ["partial"]
+    # 打ち切った応答はキャッシュなどの完了時の処理に渡さない
+    time.sleep(0.05)
+    assert completed == []
+    assert not job.cancel()
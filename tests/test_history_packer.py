@@ -0,0 +1,58 @@
+from chat_session.history_packer import pack_history
+from costs.get_token_count import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY
+
+MODEL_VERSION = "gpt-3.5-turbo"
+
+
+def create_message(role, content, token_count):
+    # トークン数をキャッシュ済みのメッセージを生成する
+    return {"role": role, "content": content, "tokens": {MODEL_VERSION: token_count}}
+
+
+def test_pack_history_keeps_all_messages_within_budget():
+    messages = [
+        create_message("system", "", 0),
+        create_message("user", "a", 10),
+        create_message("assistant", "b", 10),
+    ]
+    packed = pack_history(messages, MODEL_VERSION, 1000)
+    assert packed.messages == [{"role": m["role"], "content": m["content"]} for m in messages]
+    assert packed.dropped_messages == []
+    assert packed.prompt_tokens == 20 + TOKENS_PER_MESSAGE * 3 + TOKENS_PER_REPLY
+
+
+def test_pack_history_drops_oldest_messages_and_keeps_system_message():
+    messages = [
+        create_message("system", "s", 5),
+        create_message("user", "old", 100),
+        create_message("assistant", "middle", 10),
+        create_message("user", "new", 10),
+    ]
+    budget = 5 + 10 + 10 + TOKENS_PER_MESSAGE * 3 + TOKENS_PER_REPLY
+    packed = pack_history(messages, MODEL_VERSION, budget)
+    assert [m["content"] for m in packed.messages] == ["s", "middle", "new"]
+    assert packed.dropped_messages == [messages[1]]
+    assert packed.prompt_tokens == budget
+
+
+def test_pack_history_keeps_latest_message_even_if_over_budget():
+    messages = [
+        create_message("system", "", 0),
+        create_message("user", "old", 10),
+        create_message("user", "huge", 5000),
+    ]
+    packed = pack_history(messages, MODEL_VERSION, 100)
+    assert [m["content"] for m in packed.messages] == ["", "huge"]
+    assert packed.dropped_messages == [messages[1]]
+
+
+def test_pack_history_stops_at_first_message_over_budget():
+    # 予算を超えた時点で打ち切り、それより古い小さなメッセージも送信しない
+    messages = [
+        create_message("user", "small", 1),
+        create_message("assistant", "large", 500),
+        create_message("user", "latest", 1),
+    ]
+    packed = pack_history(messages, MODEL_VERSION, 100)
+    assert [m["content"] for m in packed.messages] == ["latest"]
+    assert packed.dropped_messages == messages[:2]
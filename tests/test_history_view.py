@@ -0,0 +1,35 @@
+import pytest
+from chat_session.history_view import render_history_page, split_history_window
+
+
+@pytest.mark.parametrize(
+    "message_count, loaded_pages, expected_recent_start, expected_page_ranges",
+    [
+        (10, 0, 0, []),
+        (10, 3, 0, []),
+        (50, 0, 30, []),
+        (50, 1, 30, [(20, 30)]),
+        (50, 2, 30, [(0, 20), (20, 30)]),
+        (50, 5, 30, [(0, 20), (20, 30)]),
+        (60, 2, 40, [(0, 20), (20, 40)]),
+    ],
+)
+def test_split_history_window(
+    message_count, loaded_pages, expected_recent_start, expected_page_ranges
+):
+    recent_start, page_ranges = split_history_window(message_count, loaded_pages, window_size=20)
+    assert recent_start == expected_recent_start
+    assert page_ranges == expected_page_ranges
+
+
+def test_split_history_window_keeps_full_page_boundaries_as_history_grows():
+    _, before = split_history_window(65, 3, window_size=20)
+    _, after = split_history_window(66, 3, window_size=20)
+    assert before[:2] == after[:2] == [(0, 20), (20, 40)]
+
+
+def test_render_history_page_skips_system_messages_and_is_memoized():
+    page = (("system", ""), ("user", "Hi"), ("assistant", "Hello"))
+    rendered = render_history_page(page)
+    assert rendered == "**User:** Hi\n\n---\n\n**Assistant:** Hello"
+    assert render_history_page(page) is rendered
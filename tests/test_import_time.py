@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 起動時にインポートしてはいけない重いモジュール（そのページや機能を最初に使用するときにインポートする）
+LAZY_MODULES = ["fitz", "langchain", "tiktoken", "azure.storage.blob", "opencensus"]
+# Streamlitのインポート後に main をインポートする時間の上限（秒）。遅い環境では環境変数で緩められる
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "0.25"))
+
+
+def import_in_fresh_process(module_name):
+    """
+    新しいプロセスでStreamlitをインポートした後に module_name をインポートし、
+    その時間と、インポート済みになった LAZY_MODULES を返す。
+
+    Streamlitのサーバーではスクリプトの実行前にStreamlitがインポート済みのため、その時間は含めない。
+    """
+    code = f"""
+import json, sys, time
+import streamlit
+started_at = time.perf_counter()
+import {module_name}
+elapsed = time.perf_counter() - started_at
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPOSITORY_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_main_import_stays_within_budget():
+    result = import_in_fresh_process("main")
+    assert result["loaded"] == []
+    assert result["elapsed"] < IMPORT_TIME_BUDGET_SECONDS
+
+
+@pytest.mark.parametrize("module_name", ["chat_session.ChatSession", "chat_session.ModelComparisonSession"])
+def test_chat_pages_do_not_load_pdf_or_langchain_dependencies(module_name):
+    result = import_in_fresh_process(module_name)
+    assert result["loaded"] == []
@@ -0,0 +1,32 @@
+import pytest
+from benchmarks.load_test import SessionResult, find_widget, summarize_load
+
+
+class Widget:
+    def __init__(self, label):
+        self.label = label
+
+
+def make_session(rerun_seconds, reply_seconds, memory_bytes):
+    session = SessionResult()
+    session.rerun_seconds = rerun_seconds
+    session.reply_seconds = reply_seconds
+    session.memory_bytes = memory_bytes
+    return session
+
+
+def test_summarize_load_aggregates_all_sessions():
+    sessions = [make_session([0.1, 0.2], [1.0], 10), make_session([0.3], [2.0, 3.0], 30)]
+    results = summarize_load(2, sessions, elapsed=4.0)
+
+    assert results["load[c=2].rerun"]["count"] == 3
+    assert results["load[c=2].rerun"]["p50"] == pytest.approx(0.2)
+    assert results["load[c=2].reply"]["throughput"] == pytest.approx(0.75)
+    assert results["load[c=2].session_memory_bytes"]["mean"] == pytest.approx(20)
+
+
+def test_find_widget_by_label():
+    widgets = [Widget("max_tokens: "), Widget("temperature: ")]
+    assert find_widget(widgets, "temperature: ") is widgets[1]
+    with pytest.raises(LookupError):
+        find_widget(widgets, "top_p: ")
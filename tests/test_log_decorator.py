@@ -0,0 +1,88 @@
+import logging
+
+import pytest
+from logs.log_decorator import format_value, get_call_durations, log_decorator
+
+
+class ReprCounter:
+    """reprが呼ばれた回数を数えるオブジェクト"""
+
+    def __init__(self):
+        self.repr_count = 0
+
+    def __repr__(self):
+        self.repr_count += 1
+        return "ReprCounter()"
+
+
+def create_logger(name, level):
+    logger = logging.getLogger(f"tests.log_decorator.{name}")
+    logger.setLevel(level)
+    logger.propagate = True
+    return logger
+
+
+def test_log_decorator_logs_start_returns_and_end(caplog):
+    logger = create_logger("enabled", logging.INFO)
+
+    @log_decorator(logger)
+    def add(a, b):
+        return a + b
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        assert add(1, b=2) == 3
+    assert [r.getMessage() for r in caplog.records] == [
+        "START: add (args: 1, b=2)",
+        "Returns: add -> 3",
+        "END: add",
+    ]
+
+
+def test_log_decorator_does_not_render_args_when_level_is_disabled():
+    logger = create_logger("disabled", logging.WARNING)
+    argument = ReprCounter()
+
+    @log_decorator(logger)
+    def identity(value):
+        return value
+
+    assert identity(argument) is argument
+    assert argument.repr_count == 0
+
+
+def test_log_decorator_with_zero_sample_rate_skips_logging_but_records_duration(caplog):
+    logger = create_logger("sampled", logging.INFO)
+
+    @log_decorator(logger, sample_rate=0.0)
+    def sampled_function():
+        return None
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        for _ in range(3):
+            sampled_function()
+    assert caplog.records == []
+    histogram = get_call_durations()[sampled_function.__qualname__]
+    assert histogram.count == 3
+
+
+def test_log_decorator_logs_exception_even_when_sampled_out(caplog):
+    logger = create_logger("exception", logging.INFO)
+
+    @log_decorator(logger, sample_rate=0.0)
+    def fail():
+        raise ValueError("boom")
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        with pytest.raises(ValueError):
+            fail()
+    assert [r.getMessage() for r in caplog.records] == [
+        "An exception occurred: fail -> ValueError('boom')"
+    ]
+
+
+def test_format_value_truncates_large_values():
+    messages = [{"role": "user", "content": "x" * 1000} for _ in range(1000)]
+    text = format_value(messages, 100)
+    assert text.startswith("[{'content': ")
+    assert len(text) < 150
+    assert text.endswith("chars truncated)")
@@ -0,0 +1,19 @@
+import json
+
+from data_source.lru_disk_cache import LRUDiskCache
+
+
+def test_cache_round_trips_json_values_through_disk(tmp_path):
+    LRUDiskCache(cache_dir=str(tmp_path), value_field="pages").set("key", ["page 1", "page 2"])
+
+    with open(tmp_path / "key.json", encoding="utf-8") as file:
+        assert json.load(file)["pages"] == ["page 1", "page 2"]
+    cache = LRUDiskCache(cache_dir=str(tmp_path), value_field="pages")
+    assert cache.get("key") == ["page 1", "page 2"]
+    assert cache.stats() == {"hits": 1, "misses": 0, "entries": 1}
+
+
+def test_cache_without_ttl_reads_files_without_created_at(tmp_path):
+    (tmp_path / "key.json").write_text('{"pages": ["A"]}', encoding="utf-8")
+    assert LRUDiskCache(cache_dir=str(tmp_path), value_field="pages").get("key") == ["A"]
+    assert LRUDiskCache(cache_dir=str(tmp_path), ttl_seconds=10, value_field="pages").get("key") is None
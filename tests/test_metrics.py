@@ -0,0 +1,49 @@
+import pytest
+from logs.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_snapshot():
+    histogram = Histogram(buckets=[1, 2, 5])
+    for value in [0.5, 1.5, 1.5, 4.0]:
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 4
+    assert snapshot["sum"] == pytest.approx(7.5)
+    assert snapshot["min"] == 0.5
+    assert snapshot["max"] == 4.0
+    assert histogram.bucket_counts() == [(1, 1), (2, 3), (5, 4), (float("inf"), 4)]
+
+
+def test_histogram_percentile_is_within_bucket_bounds():
+    histogram = Histogram(buckets=[0.1, 1.0, 10.0])
+    for _ in range(90):
+        histogram.observe(0.05)
+    for _ in range(10):
+        histogram.observe(5.0)
+    assert histogram.percentile(50) <= 0.1
+    assert 1.0 <= histogram.percentile(99) <= 5.0
+    assert histogram.percentile(100) == 5.0
+
+
+def test_histogram_percentile_without_observations():
+    assert Histogram().percentile(50) == 0.0
+
+
+def test_registry_returns_same_histogram_for_same_labels():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency", {"model": "gpt-4-turbo"})
+    assert registry.histogram("latency", {"model": "gpt-4-turbo"}) is histogram
+    assert registry.histogram("latency", {"model": "gpt-3.5-turbo"}) is not histogram
+    assert len(registry.get_histograms("latency")) == 2
+
+
+def test_registry_counters_are_labelled_and_cleared():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", {"model": "gpt-4-turbo"}).inc()
+    registry.counter("requests_total", {"model": "gpt-4-turbo"}).inc(2)
+    assert registry.get_counters("requests_total")[(("model", "gpt-4-turbo"),)].value == 3
+    with pytest.raises(ValueError):
+        registry.counter("requests_total").inc(-1)
+
+    registry.clear()
+    assert registry.counter_names() == []
@@ -0,0 +1,41 @@
+import requests
+from logs.metrics import MetricsRegistry
+from logs.metrics_exporter import render_prometheus_text, start_metrics_server
+
+
+def make_registry():
+    registry = MetricsRegistry()
+    registry.counter("chat_streams_total", {"model": "gpt-4-turbo", "status": "completed"}).inc(2)
+    histogram = registry.histogram("chat_stream_duration_seconds", {"model": 'a"b'}, buckets=[1, 5])
+    histogram.observe(0.5)
+    histogram.observe(3.0)
+    return registry
+
+
+def test_render_prometheus_text():
+    lines = render_prometheus_text(make_registry()).splitlines()
+
+    assert lines == [
+        "# TYPE chat_streams_total counter",
+        'chat_streams_total{model="gpt-4-turbo",status="completed"} 2.0',
+        "# TYPE chat_stream_duration_seconds histogram",
+        'chat_stream_duration_seconds_bucket{model="a\\"b",le="1.0"} 1',
+        'chat_stream_duration_seconds_bucket{model="a\\"b",le="5.0"} 2',
+        'chat_stream_duration_seconds_bucket{model="a\\"b",le="+Inf"} 2',
+        'chat_stream_duration_seconds_sum{model="a\\"b"} 3.5',
+        'chat_stream_duration_seconds_count{model="a\\"b"} 2',
+    ]
+
+
+def test_metrics_server_serves_registry():
+    server = start_metrics_server(0, host="127.0.0.1", registry=make_registry())
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        response = requests.get(base_url + "/metrics")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+        assert "chat_streams_total" in response.text
+        assert requests.get(base_url + "/").status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
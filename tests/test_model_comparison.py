@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chat_session.ChatSession as chat_session_module
+from chat_session.ModelComparisonSession import ComparisonResult, ModelComparisonSession, StreamEvent, fan_out_streams
+from data_source.openai_client_registry import ChatCompletionStream
+from data_source.openai_data_source import MODELS
+
+
+def slow_stream(chunks, delay):
+    def start():
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    return start
+
+
+def test_fan_out_streams_runs_streams_concurrently():
+    executor = ThreadPoolExecutor(max_workers=2)
+    started_at = time.perf_counter()
+    events = list(
+        fan_out_streams(
+            {"a": slow_stream(["1", "2", "3"], 0.1), "b": slow_stream(["x", "y", "z"], 0.1)},
+            executor=executor,
+        )
+    )
+    elapsed = time.perf_counter() - started_at
+
+    # 逐次実行であれば0.6秒かかる
+    assert elapsed < 0.5
+    texts = {
+        key: "".join(e.delta for e in events if e.model_version == key and e.kind == StreamEvent.DELTA)
+        for key in ("a", "b")
+    }
+    assert texts == {"a": "123", "b": "xyz"}
+    assert sorted(e.model_version for e in events if e.kind == StreamEvent.DONE) == ["a", "b"]
+
+
+def test_fan_out_streams_skips_empty_deltas_and_orders_done_last():
+    events = list(fan_out_streams({"a": lambda: iter([None, "hello", "", " world"])}))
+
+    assert [e.kind for e in events] == [StreamEvent.DELTA, StreamEvent.DELTA, StreamEvent.DONE]
+    assert [e.delta for e in events[:2]] == ["hello", " world"]
+    assert events[0].elapsed <= events[-1].elapsed
+
+
+def test_fan_out_streams_reports_errors_without_stopping_other_streams():
+    error = RuntimeError("boom")
+    release = threading.Event()
+
+    def failing():
+        yield "partial"
+        raise error
+
+    def waiting():
+        release.wait(1)
+        yield "ok"
+
+    events = []
+    for event in fan_out_streams({"bad": failing, "good": waiting}):
+        events.append(event)
+        if event.kind == StreamEvent.ERROR:
+            release.set()
+
+    errors = [e for e in events if e.kind == StreamEvent.ERROR]
+    assert len(errors) == 1 and errors[0].model_version == "bad" and errors[0].error is error
+    assert [e.delta for e in events if e.model_version == "good" and e.kind == StreamEvent.DELTA] == ["ok"]
+    assert events[-1].kind == StreamEvent.DONE
+
+
+def test_format_metrics():
+    result = ComparisonResult("GPT-3.5 Turbo")
+    result.time_to_first_token = 0.25
+    result.duration = 1.5
+    result.completion_tokens = 42
+
+    assert ModelComparisonSession().format_metrics(result) == (
+        "TTFT: 0.25s · Total: 1.50s · Tokens: 42 · Cost: -"
+    )
+
+
+class RecordingClient:
+    def __init__(self):
+        self.requests = []
+
+    def create_chat_completion(self, estimated_tokens=0, **params):
+        self.requests.append(params)
+        return ChatCompletionStream([], [])
+
+
+def test_compare_sends_only_role_and_content(monkeypatch):
+    client = RecordingClient()
+    monkeypatch.setattr(chat_session_module, "get_openai_client", lambda model_version: client)
+    model_versions = list(MODELS.keys())[:2]
+
+    results = ModelComparisonSession().compare("Hello", model_versions, 16, 0.0)
+
+    assert [result.error for result in results] == [None] * len(model_versions)
+    assert len(client.requests) == len(model_versions)
+    for params in client.requests:
+        assert [set(message) for message in params["messages"]] == [{"role", "content"}] * 2
+
+
+class EndlessStream:
+    """close されるまで差分を返し続ける上流のストリーム。"""
+
+    def __init__(self):
+        self.is_closed = threading.Event()
+        self.deltas = 0
+
+    def __iter__(self):
+        while not self.is_closed.is_set():
+            self.deltas += 1
+            yield "token"
+            time.sleep(0.01)
+
+    def close(self):
+        self.is_closed.set()
+
+
+def test_abandoned_fan_out_closes_the_streams():
+    streams = {"a": EndlessStream(), "b": EndlessStream()}
+    events = fan_out_streams({key: (lambda stream=stream: stream) for key, stream in streams.items()})
+    next(events)
+    # 再実行でスクリプトが中断され、呼び出し元が受信をやめた場合
+    events.close()
+
+    for stream in streams.values():
+        assert stream.is_closed.wait(1)
+    deltas = [stream.deltas for stream in streams.values()]
+    time.sleep(0.1)
+    assert [stream.deltas for stream in streams.values()] == deltas
+
+
+def test_abandoned_fan_out_stops_generator_streams():
+    received = []
+
+    def endless():
+        while True:
+            received.append(1)
+            yield "token"
+            time.sleep(0.01)
+
+    events = fan_out_streams({"a": endless})
+    next(events)
+    events.close()
+
+    time.sleep(0.1)
+    count = len(received)
+    time.sleep(0.1)
+    assert len(received) == count
@@ -0,0 +1,94 @@
+import openai
+from openai import api_requestor
+import pytest
+from data_source.openai_client_registry import ChatCompletionStream, OpenAIClientRegistry
+
+MODELS = {
+    "model-a": {
+        "config": {
+            "api_key": "key-a",
+            "base_url": "https://a.example.com",
+            "api_type": "azure",
+            "api_version": "2023-05-15",
+            "deployment_name": "deployment-a",
+            "model_version": "gpt-35-turbo",
+        }
+    },
+    "model-b": {
+        "config": {
+            "api_key": "key-b",
+            "base_url": "https://b.example.com",
+            "api_type": "azure",
+            "api_version": "2023-05-15",
+            "deployment_name": "deployment-b",
+            "model_version": "gpt-4",
+        }
+    },
+}
+
+
+def test_registry_returns_one_client_per_model():
+    registry = OpenAIClientRegistry(MODELS)
+    client_a = registry.get("model-a")
+    assert registry.get("model-a") is client_a
+    assert registry.get("model-b") is not client_a
+    assert client_a.session is not registry.get("model-b").session
+    registry.close()
+
+
+def test_create_chat_completion_passes_credentials_without_global_state(monkeypatch):
+    calls = []
+
+    def fake_create(**kwargs):
+        calls.append((kwargs, api_requestor._thread_context.session))
+        return iter(["chunk"])
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", fake_create)
+    monkeypatch.setattr(openai, "api_key", None)
+    registry = OpenAIClientRegistry(MODELS)
+    client = registry.get("model-b")
+
+    assert list(client.create_chat_completion(messages=[], stream=True)) == ["chunk"]
+    kwargs, session = calls[0]
+    assert kwargs == {
+        "engine": "deployment-b",
+        "api_key": "key-b",
+        "api_base": "https://b.example.com",
+        "api_type": "azure",
+        "api_version": "2023-05-15",
+        "messages": [],
+        "stream": True,
+    }
+    assert session is client.session
+    assert openai.api_key is None
+    registry.close()
+
+
+def test_chat_completion_stream_can_be_closed_from_another_thread():
+    class Response:
+        closed = False
+
+        def close(self):
+            Response.closed = True
+
+    def chunks():
+        yield {"delta": "a"}
+        # 接続を閉じた後の受信エラー
+        raise ConnectionError("connection closed")
+
+    stream = ChatCompletionStream(chunks(), [Response()]).map(lambda chunk: chunk["delta"])
+    iterator = iter(stream)
+    assert next(iterator) == "a"
+    stream.close()
+
+    assert Response.closed
+    assert list(iterator) == []
+
+
+def test_chat_completion_stream_raises_errors_while_open():
+    def chunks():
+        raise ConnectionError("connection reset")
+        yield
+
+    with pytest.raises(ConnectionError):
+        list(ChatCompletionStream(chunks(), []))
@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sys
+import types
+
+import fitz
+from pdf_qa_service.pdf_extractor import PDFTextCache, create_pdf_process_pool, extract_pdf, stream_pdf_pages
+
+
+def make_pdf(page_count):
+    pdf = fitz.open()
+    for page_number in range(page_count):
+        pdf.new_page().insert_text((72, 72), f"page {page_number + 1}")
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def test_extract_pdf_returns_pages_in_order_using_process_pool(tmp_path):
+    progress = []
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+        document = extract_pdf(
+            make_pdf(10),
+            "manual.pdf",
+            on_progress=lambda done, total: progress.append((done, total)),
+            cache=PDFTextCache(),
+            executor=executor,
+            pages_per_task=3,
+        )
+
+    assert document.page_count == 10
+    assert [page.strip() for page in document.pages] == [f"page {i}" for i in range(1, 11)]
+    assert progress[-1] == (10, 10)
+    assert len(progress) == 10
+
+
+def test_workers_do_not_run_the_app_script(tmp_path, monkeypatch):
+    # streamlit run と同様に、アプリのスクリプトを __main__ として読み込んだ状態にする
+    marker = tmp_path / "imported"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\nraise SystemExit(1)\n")
+    app_module = types.ModuleType("__main__")
+    app_module.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", app_module)
+
+    with create_pdf_process_pool(max_workers=2) as executor:
+        document = extract_pdf(
+            make_pdf(10), "manual.pdf", cache=PDFTextCache(), executor=executor, pages_per_task=3
+        )
+
+    assert [page.strip() for page in document.pages] == [f"page {i}" for i in range(1, 11)]
+    assert not marker.exists()
+    assert sys.modules["__main__"] is app_module
+
+
+def test_extract_pdf_reuses_cached_pages_for_same_content(tmp_path):
+    cache = PDFTextCache(cache_dir=str(tmp_path))
+    data = make_pdf(2)
+    first = extract_pdf(data, "a.pdf", cache=cache)
+
+    # 同じ内容であればファイル名が異なっても抽出し直さない
+    progress = []
+    second = extract_pdf(data, "b.pdf", on_progress=lambda *args: progress.append(args), cache=cache)
+    assert second.pages == first.pages
+    assert second.content_hash == first.content_hash
+    assert progress == []
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # ディスク上のキャッシュは別のインスタンスからも読み込める
+    assert PDFTextCache(cache_dir=str(tmp_path)).get(first.content_hash) == first.pages
+
+
+def test_stream_pdf_pages_without_executor(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(make_pdf(5))
+
+    pages = list(stream_pdf_pages(str(path), 5, executor=None, pages_per_task=2))
+    assert [page_number for page_number, _ in pages] == [0, 1, 2, 3, 4]
+    assert pages[4][1].strip() == "page 5"
+
+
+def test_cache_evicts_least_recently_used_documents():
+    cache = PDFTextCache(max_documents=2)
+    cache.set("a", ["A"])
+    cache.set("b", ["B"])
+    assert cache.get("a") == ["A"]
+    cache.set("c", ["C"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ["A"]
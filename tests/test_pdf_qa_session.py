@@ -0,0 +1,136 @@
+import sys
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from chat_session.ChatSession import ChatSession
+from data_source.openai_data_source import MODELS
+from pdf_qa_service.pdf_extractor import PDFDocument
+from pdf_qa_service.text_chunker import TextChunk
+from pdf_qa_service.VectorIndex import SearchResult
+import pdf_qa_service.PDFQASession as pdf_qa_session_module
+
+MODEL_VERSION = "gpt-3.5-turbo"
+
+
+@pytest.fixture(autouse=True)
+def restore_main_module(monkeypatch):
+    # AppTestはスクリプトを __main__ として実行したままにするため、
+    # spawnで起動する他のテストのワーカープロセスがこのスクリプトを実行しないよう元に戻す
+    monkeypatch.setitem(sys.modules, "__main__", sys.modules["__main__"])
+
+
+def _qa_page_script():
+    # AppTestで実行するスクリプト（関数の本体のみが実行されるため、必要なモジュールはここでインポートする）
+    import streamlit as st
+    from data_source.openai_data_source import RetrievalMode
+    from pdf_qa_service.PDFQASession import PDFQASession
+
+    session = PDFQASession()
+    session.display_qa_turns()
+    pending_turn = session.get_pending_qa_turn()
+    if pending_turn is not None:
+        st.session_state.results.append(session.attach_qa_turn(pending_turn))
+    question = st.session_state.pop("question", None)
+    if question:
+        st.session_state.results.append(
+            session.ask_my_pdf(question, "gpt-3.5-turbo", 3, RetrievalMode.LEXICAL.value)
+        )
+
+
+def test_answer_is_generated_as_a_job_and_kept_in_session_state(monkeypatch):
+    document = PDFDocument("hash", "manual.pdf", ["Replace the toner cartridge."])
+    chunk = TextChunk("hash", 1, 0, "Replace the toner cartridge.", 6)
+    retrieved = []
+
+    def fake_retrieve_lexical(documents, question, encoding, top_k):
+        retrieved.append(question)
+        return [SearchResult(2.5, chunk)]
+
+    sent_messages = []
+
+    def fake_stream_chat_completion(model_version, messages, llm, prompt_tokens=0):
+        sent_messages.append(messages)
+        return iter(["Open ", "the cover."])
+
+    monkeypatch.setattr(pdf_qa_session_module, "retrieve_lexical", fake_retrieve_lexical)
+    monkeypatch.setattr(ChatSession, "stream_chat_completion", staticmethod(fake_stream_chat_completion))
+
+    app = AppTest.from_function(_qa_page_script)
+    app.session_state["results"] = []
+    app.session_state["pdf_documents"] = {"hash": document}
+    app.session_state["question"] = "How do I replace the toner?"
+    app.run()
+
+    assert not app.exception
+    assert retrieved == ["How do I replace the toner?"]
+    # Chat APIには role と content 以外のキーを送信しない
+    [messages] = sent_messages
+    assert messages and all(set(message) == {"role", "content"} for message in messages)
+    [(is_error, prompt_tokens, completion_tokens)] = app.session_state["results"]
+    assert not is_error and prompt_tokens > 0 and completion_tokens > 0
+    [turn] = app.session_state["qa_turns"]
+    assert turn.job is None
+    assert turn.answer == "Open the cover."
+    assert turn.sources == [("manual.pdf", 1, 2.5, "Replace the toner cartridge.")]
+
+    # 次の実行では履歴として表示され、再度集計されない
+    app.run()
+    assert len(app.session_state["results"]) == 1
+    assert [m.value for m in app.markdown] == [
+        "How do I replace the toner?",
+        "Open the cover.",
+        "**manual.pdf** p.1 (score: 2.500)",
+    ]
+
+
+def test_failed_answer_is_removed_from_history(monkeypatch):
+    def failing_retrieve_lexical(documents, question, encoding, top_k):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(pdf_qa_session_module, "retrieve_lexical", failing_retrieve_lexical)
+    app = AppTest.from_function(_qa_page_script)
+    app.session_state["results"] = []
+    app.session_state["pdf_documents"] = {"hash": PDFDocument("hash", "manual.pdf", ["text"])}
+    app.session_state["question"] = "question"
+    app.run()
+
+    assert app.session_state["results"] == [(True, 0, 0)]
+    assert app.session_state["qa_turns"] == []
+
+
+class FailingSummarizer:
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def summarize(self, content_hash, pages, on_progress=None):
+        # 一部のチャンクを要約した後に失敗した場合
+        self.prompt_tokens, self.completion_tokens = 1200, 300
+        raise RuntimeError("boom")
+
+
+def _summarize_script():
+    import streamlit as st
+    from costs.calculate_cost import calculate_cost
+    from pdf_qa_service.PDFQASession import PDFQASession
+
+    result = PDFQASession().summarize_pdfs("gpt-3.5-turbo")
+    st.session_state.results.append(result)
+    calculate_cost(result[1], result[2], "gpt-3.5-turbo", result[0])
+
+
+def test_failed_summary_bills_tokens_spent_before_the_failure(monkeypatch):
+    monkeypatch.setattr(
+        pdf_qa_session_module, "create_pdf_summarizer", lambda model_version, encoding: FailingSummarizer()
+    )
+    config = MODELS[MODEL_VERSION]["config"]
+    monkeypatch.setitem(config, "prompt_cost", "0.001")
+    monkeypatch.setitem(config, "completion_cost", "0.002")
+    app = AppTest.from_function(_summarize_script)
+    app.session_state["results"] = []
+    app.session_state["pdf_documents"] = {"hash": PDFDocument("hash", "manual.pdf", ["text"])}
+    app.run()
+
+    assert app.session_state["results"] == [(True, 1200, 300)]
+    assert (app.session_state["prompt_tokens"], app.session_state["completion_tokens"]) == (1200, 300)
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+import tiktoken as tk
+from data_source.lru_disk_cache import LRUDiskCache
+from pdf_qa_service.PDFSummarizer import MAP_PROMPT, PDFSummarizer
+
+
+def byte_encoding():
+    # ネットワークに依存しないよう、1バイトを1トークンとするエンコーダを使用する
+    return tk.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+class FakeChatModel:
+    """predict の呼び出しを記録し、短い要約を返すローカルの偽のチャットモデル。"""
+
+    def __init__(self, fail_on=None, delay=0.0):
+        self.prompts = []
+        self.fail_on = fail_on
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def predict(self, prompt):
+        with self._lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if self.fail_on is not None and self.fail_on in prompt:
+                raise RuntimeError("upstream error")
+            return f"S{len(self.prompts):03d}"
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, tokens=0):
+        self.acquired.append(tokens)
+        return 0.0
+
+
+def create_summarizer(model, cache=None, **kwargs):
+    cache = cache or LRUDiskCache()
+    return PDFSummarizer(model, "gpt-3.5-turbo", byte_encoding(), cache=cache, **kwargs)
+
+
+def test_summarize_maps_every_chunk_and_reduces_to_one_summary():
+    model = FakeChatModel()
+    progress = []
+    summarizer = create_summarizer(model, chunk_tokens=10)
+
+    summary = summarizer.summarize(
+        "hash", ["abcdefghijklmnopqrstuvwxyz0123", "ABCDEFGHIJKLMNOPQRST"], progress.append
+    )
+
+    map_prompts = [prompt for prompt in model.prompts if prompt.startswith(MAP_PROMPT[:20])]
+    # 2ページを空行で連結した52バイトが、10トークンごとの6チャンクに分割される
+    assert len(map_prompts) == 6
+    assert summary.startswith("S")
+    assert [p.stage for p in progress if p.stage == "map"] == ["map"] * 6
+    assert progress[5].completed == progress[5].total == 6
+    # 4トークンの要約を10トークン以内にまとめるため、6 -> 3 -> 2 -> 1 と段階的に統合する
+    assert [p.stage for p in progress if p.completed == p.total] == [
+        "map",
+        "reduce 1",
+        "reduce 2",
+        "reduce 3",
+    ]
+    assert summarizer.prompt_tokens > 0
+    assert summarizer.completion_tokens == 4 * len(model.prompts)
+
+
+def test_summarize_returns_empty_string_for_empty_document():
+    model = FakeChatModel()
+
+    assert create_summarizer(model).summarize("hash", ["", ""]) == ""
+    assert model.prompts == []
+
+
+def test_rerun_after_failure_only_summarizes_missing_chunks():
+    cache = LRUDiskCache()
+    pages = ["aaaaaaaaaa", "bbbbbbbbbb", "cccccccccc"]
+    failing_model = FakeChatModel(fail_on="bbbb")
+
+    with pytest.raises(RuntimeError):
+        create_summarizer(failing_model, cache, chunk_tokens=12).summarize("hash", pages)
+    # 失敗したチャンク以外も要約を終えてからエラーとなる
+    assert len(failing_model.prompts) == 3
+
+    model = FakeChatModel()
+    summarizer = create_summarizer(model, cache, chunk_tokens=12)
+    summarizer.summarize("hash", pages)
+
+    map_prompts = [prompt for prompt in model.prompts if prompt.startswith(MAP_PROMPT[:20])]
+    assert len(map_prompts) == 1
+    assert "bbbb" in map_prompts[0]
+
+
+def test_summarize_bounds_concurrency_and_acquires_rate_limit_per_request():
+    model = FakeChatModel(delay=0.02)
+    rate_limiter = FakeRateLimiter()
+    summarizer = create_summarizer(model, chunk_tokens=10, max_workers=2, rate_limiter=rate_limiter)
+
+    summarizer.summarize("hash", [" ".join(str(i) for i in range(30))])
+
+    assert model.max_active <= 2
+    assert len(rate_limiter.acquired) == len(model.prompts)
+    assert sum(rate_limiter.acquired) == summarizer.prompt_tokens
+
+
+def test_cached_summary_is_reused_across_summarizers():
+    cache = LRUDiskCache()
+    first_model, second_model = FakeChatModel(), FakeChatModel()
+
+    first = create_summarizer(first_model, cache).summarize("hash", ["same text"])
+    second_summarizer = create_summarizer(second_model, cache)
+    second = second_summarizer.summarize("hash", ["same text"])
+
+    assert first == second
+    assert second_model.prompts == []
+    assert second_summarizer.prompt_tokens == 0
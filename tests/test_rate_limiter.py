@@ -0,0 +1,100 @@
+import openai
+import pytest
+from data_source.rate_limiter import DeploymentRateLimiter, get_retry_after, retry_with_backoff
+
+
+class FakeClock:
+    """sleepで時刻が進む擬似的な時計"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def create_rate_limit_error(headers=None):
+    return openai.error.RateLimitError("Too Many Requests", http_status=429, headers=headers)
+
+
+def test_rate_limiter_delays_requests_over_requests_per_minute():
+    clock = FakeClock()
+    limiter = DeploymentRateLimiter(requests_per_minute=60, clock=clock, sleep=clock.sleep)
+    for _ in range(60):
+        assert limiter.acquire() == 0.0
+    # 61件目は1リクエスト分（1秒）が補充されるまで待機する
+    assert limiter.acquire() == pytest.approx(1.0)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_rate_limiter_delays_requests_over_tokens_per_minute():
+    clock = FakeClock()
+    limiter = DeploymentRateLimiter(tokens_per_minute=6000, clock=clock, sleep=clock.sleep)
+    assert limiter.acquire(6000) == 0.0
+    assert limiter.acquire(1000) == pytest.approx(10.0)
+
+
+def test_rate_limiter_rejects_requests_that_would_wait_too_long():
+    clock = FakeClock()
+    limiter = DeploymentRateLimiter(
+        tokens_per_minute=600, max_wait_seconds=5, clock=clock, sleep=clock.sleep
+    )
+    assert limiter.acquire(600) == 0.0
+    with pytest.raises(openai.error.RateLimitError):
+        limiter.acquire(100)
+    assert clock.sleeps == []
+    # 拒否したリクエストの予約は取り消される
+    clock.now += 5
+    assert limiter.acquire(50) == 0.0
+
+
+def test_rate_limiter_without_limits_never_waits():
+    limiter = DeploymentRateLimiter()
+    assert limiter.acquire(10**9) == 0.0
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after": "7"}, 7.0),
+        ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+        ({}, None),
+        ({"retry-after": "invalid"}, None),
+    ],
+)
+def test_get_retry_after(headers, expected):
+    assert get_retry_after(create_rate_limit_error(headers)) == expected
+
+
+def test_retry_with_backoff_honours_retry_after():
+    clock = FakeClock()
+    errors = [create_rate_limit_error({"retry-after": "3"})]
+
+    def call():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert retry_with_backoff(call, sleep=clock.sleep, jitter=lambda: 0.0) == "ok"
+    assert clock.sleeps == [3.0]
+
+
+def test_retry_with_backoff_uses_exponential_delays_and_gives_up():
+    clock = FakeClock()
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise create_rate_limit_error()
+
+    with pytest.raises(openai.error.RateLimitError):
+        retry_with_backoff(
+            call, max_retries=3, base_delay=1.0, max_delay=3.0, sleep=clock.sleep, jitter=lambda: 1.0
+        )
+    assert len(calls) == 4
+    assert clock.sleeps == [1.0, 2.0, 3.0]
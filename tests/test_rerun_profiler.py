@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+from logs.log_decorator import log_decorator
+from logs.rerun_profiler import RerunProfiler, create_rerun_profiler, get_active_profiler
+
+logger = logging.getLogger("tests.rerun_profiler")
+
+
+@log_decorator(logger)
+def inner():
+    return 1
+
+
+@log_decorator(logger)
+def outer():
+    return inner() + inner()
+
+
+def test_profiler_records_decorated_calls_as_nested_sections():
+    with RerunProfiler() as profiler:
+        assert get_active_profiler() is profiler
+        outer()
+    assert get_active_profiler() is None
+
+    assert list(profiler.sections) == [("outer",), ("outer", "inner")]
+    assert profiler.sections[("outer", "inner")][0] == 2
+    breakdown = profiler.format_breakdown().splitlines()
+    assert breakdown[0].startswith("total: ")
+    assert breakdown[1].startswith("  outer: ")
+    assert breakdown[2].startswith("    inner: ") and breakdown[2].endswith(" x2")
+    assert profiler.format_cprofile() == ""
+
+
+def test_profiler_captures_cprofile():
+    with RerunProfiler(capture_cprofile=True) as profiler:
+        outer()
+    assert "outer" in profiler.format_cprofile()
+
+
+def test_calls_outside_profiler_are_not_recorded():
+    profiler = RerunProfiler()
+    outer()
+    assert profiler.sections == {}
+
+
+@pytest.mark.parametrize(
+    "env, query_mode, random_value, expected",
+    [
+        ({}, "", 0.0, None),
+        ({"PROFILE_RERUNS": "1"}, "", 0.5, False),
+        ({"PROFILE_RERUNS": "1"}, "", 0.05, True),
+        ({}, "1", 0.5, False),
+        ({"PROFILE_CPROFILE_RATE": "0"}, "cprofile", 0.5, True),
+    ],
+)
+def test_create_rerun_profiler(monkeypatch, env, query_mode, random_value, expected):
+    monkeypatch.delenv("PROFILE_RERUNS", raising=False)
+    monkeypatch.delenv("PROFILE_CPROFILE_RATE", raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    profiler = create_rerun_profiler(query_mode, random_value=lambda: random_value)
+    if expected is None:
+        assert profiler is None
+    else:
+        assert profiler.captures_cprofile is expected
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from chat_session.ResponseCache import ResponseCache, make_request_key
+from data_source.langchain.lang_chain_chat_model_factory import ModelParameters
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_model_parameters(**kwargs):
+    parameters = dict(
+        max_tokens=2048,
+        temperature=0.0,
+        top_p=0.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        deployment_name="gpt-35-turbo",
+    )
+    parameters.update(kwargs)
+    return ModelParameters(**parameters)
+
+
+MESSAGES = [{"role": "system", "content": ""}, {"role": "user", "content": "こんにちは"}]
+
+
+def test_make_request_key_is_stable_and_ignores_cached_token_counts():
+    messages_with_tokens = [dict(m, tokens={"gpt-3.5-turbo": 1}) for m in MESSAGES]
+    assert make_request_key(MESSAGES, create_model_parameters()) == make_request_key(
+        messages_with_tokens, create_model_parameters()
+    )
+
+
+def test_make_request_key_changes_with_messages_and_parameters():
+    key = make_request_key(MESSAGES, create_model_parameters())
+    assert key != make_request_key(MESSAGES[:1], create_model_parameters())
+    assert key != make_request_key(MESSAGES, create_model_parameters(temperature=0.1))
+    assert key != make_request_key(MESSAGES, create_model_parameters(deployment_name="gpt-4"))
+
+
+def test_response_cache_counts_hits_and_misses():
+    cache = ResponseCache()
+    assert cache.get("key") is None
+    cache.set("key", "response")
+    assert cache.get("key") == "response"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_response_cache_evicts_least_recently_used_entry():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+
+
+def test_response_cache_expires_entries_after_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(ttl_seconds=10, clock=clock)
+    cache.set("key", "response")
+    clock.now += 11
+    assert cache.get("key") is None
+
+
+def test_response_cache_persists_entries_on_disk(tmp_path):
+    clock = FakeClock()
+    ResponseCache(cache_dir=str(tmp_path), clock=clock).set("key", "応答")
+
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_seconds=10, clock=clock)
+    assert cache.get("key") == "応答"
+    assert cache.stats()["entries"] == 1
+
+    clock.now += 11
+    assert ResponseCache(cache_dir=str(tmp_path), ttl_seconds=10, clock=clock).get("key") is None
+
+
+@pytest.mark.parametrize("content", ['{"response": "応答"}', '["応答"]', '{"created_at": "now", "response": ""}'])
+def test_response_cache_treats_malformed_disk_entries_as_misses(tmp_path, content):
+    (tmp_path / "key.json").write_text(content, encoding="utf-8")
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    assert cache.get("key") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_response_cache_removes_temp_file_when_write_fails(tmp_path, monkeypatch):
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail_replace)
+    ResponseCache(cache_dir=str(tmp_path)).set("key", "応答")
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,61 @@
+import tiktoken as tk
+from pdf_qa_service.embedder import HashingEmbedder
+from pdf_qa_service.pdf_extractor import PDFDocument
+from pdf_qa_service.retrieval import DocumentIndexStore, build_qa_messages, retrieve
+from pdf_qa_service.text_chunker import TextChunk
+from pdf_qa_service.VectorIndex import SearchResult
+
+
+def byte_encoding():
+    return tk.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder(dimension=64)
+    vectors = embedder.embed(["東京タワーの高さ", "東京タワーの高さ", ""])
+
+    assert vectors.shape == (3, 64)
+    assert (vectors[0] == vectors[1]).all()
+    assert abs(float(vectors[0] @ vectors[0]) - 1.0) < 1e-5
+    assert not vectors[2].any()
+
+
+def test_retrieve_finds_relevant_page_across_documents(tmp_path):
+    manual = PDFDocument(
+        "manual", "manual.pdf", ["Install the printer driver.", "Replace the toner cartridge."]
+    )
+    guide = PDFDocument(
+        "guide", "guide.pdf", ["東京タワーの高さは333メートルです。", "富士山の標高は3776メートルです。"]
+    )
+    embedder = HashingEmbedder()
+    store = DocumentIndexStore(str(tmp_path))
+    indexes = [store.get(document, embedder, byte_encoding()) for document in (manual, guide)]
+
+    results = retrieve(indexes, "How do I replace the toner?", embedder, top_k=2)
+    assert (results[0].chunk.document_hash, results[0].chunk.page_number) == ("manual", 2)
+    results = retrieve(indexes, "東京タワーの高さは？", embedder, top_k=1)
+    assert (results[0].chunk.document_hash, results[0].chunk.page_number) == ("guide", 1)
+
+    # 保存したインデックスは別の保管先からも読み込める
+    reloaded = DocumentIndexStore(str(tmp_path)).get(manual, embedder, byte_encoding())
+    assert [chunk.text for chunk in reloaded.chunks] == [chunk.text for chunk in indexes[0].chunks]
+
+
+def test_build_qa_messages_includes_only_chunks_within_budget():
+    results = [
+        SearchResult(0.9, TextChunk("doc", 3, 0, "first excerpt", 10)),
+        SearchResult(0.8, TextChunk("doc", 4, 1, "second excerpt", 10)),
+    ]
+    messages, used = build_qa_messages(
+        "question?", results, {"doc": "doc.pdf"}, max_context_tokens=15
+    )
+
+    assert used == results[:1]
+    assert "[doc.pdf, page 3]\nfirst excerpt" in messages[1]["content"]
+    assert "second excerpt" not in messages[1]["content"]
+    assert messages[1]["content"].endswith("Question: question?")
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+from chat_session.SingleFlight import SingleFlight
+
+
+def test_concurrent_identical_requests_share_one_upstream_stream():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    upstream_calls = []
+
+    def start():
+        upstream_calls.append(1)
+        yield "Hello"
+        # 後続のリクエストが購読を開始するまで上流の受信を止める
+        release.wait(timeout=5)
+        yield ", world"
+
+    leader = single_flight.stream("key", start)
+    assert next(leader) == "Hello"
+    follower = single_flight.stream("key", start)
+    release.set()
+
+    # 後から購読したリクエストも、購読前に受信済みの差分から受け取る
+    assert list(follower) == ["Hello", ", world"]
+    assert list(leader) == [", world"]
+    assert upstream_calls == [1]
+    assert (single_flight.leaders, single_flight.followers) == (1, 1)
+
+
+def test_completed_request_is_not_shared_with_later_requests():
+    single_flight = SingleFlight()
+    assert list(single_flight.stream("key", lambda: iter(["first"]))) == ["first"]
+    assert list(single_flight.stream("key", lambda: iter(["second"]))) == ["second"]
+    assert single_flight.leaders == 2
+
+
+def test_different_keys_are_not_shared():
+    single_flight = SingleFlight()
+    assert list(single_flight.stream("a", lambda: iter(["A"]))) == ["A"]
+    assert list(single_flight.stream("b", lambda: iter(["B"]))) == ["B"]
+    assert single_flight.followers == 0
+
+
+def test_upstream_error_is_raised_to_every_subscriber():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def start():
+        yield "partial"
+        release.wait(timeout=5)
+        raise RuntimeError("upstream error")
+
+    leader = single_flight.stream("key", start)
+    follower = single_flight.stream("key", start)
+    release.set()
+    for subscriber in (leader, follower):
+        assert next(subscriber) == "partial"
+        with pytest.raises(RuntimeError):
+            next(subscriber)
+
+
+class ClosableUpstream:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield "Hello"
+        # close されるまで次の差分を受信しない
+        self.closed.wait(timeout=5)
+
+
+def test_upstream_is_closed_when_every_subscriber_leaves():
+    single_flight = SingleFlight()
+    upstream = ClosableUpstream()
+    upstream.close = upstream.closed.set
+
+    leader = single_flight.stream("key", lambda: upstream)
+    follower = single_flight.stream("key", lambda: upstream)
+    assert next(leader) == "Hello"
+
+    leader.close()
+    # 購読者が残っている間は上流を閉じない
+    assert not upstream.closed.is_set()
+    follower.close()
+    assert upstream.closed.wait(timeout=5)
+    assert list(follower) == []
+
+    # 打ち切ったストリームには相乗りしない
+    assert list(single_flight.stream("key", lambda: iter(["new"]))) == ["new"]
+    assert single_flight.leaders == 2
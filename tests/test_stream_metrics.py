@@ -0,0 +1,131 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from chat_session.GenerationJob import GenerationJob
+from chat_session.stream_metrics import (
+    INTER_TOKEN_GAP_METRIC,
+    NETWORK_WAIT_METRIC,
+    RENDER_TIME_METRIC,
+    STREAMS_METRIC,
+    TIME_TO_FIRST_TOKEN_METRIC,
+    TOKENS_PER_SECOND_METRIC,
+    StreamMetrics,
+)
+from logs.metrics import MetricsRegistry
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LABELS = (("model", "gpt-4-turbo"),)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stream_metrics_records_ttft_gaps_and_tokens_per_second():
+    registry = MetricsRegistry()
+    clock = FakeClock()
+    metrics = StreamMetrics("gpt-4-turbo", registry, clock)
+
+    for now in [0.5, 0.6, 0.8, 1.0]:
+        clock.now = now
+        metrics.observe_delta()
+    clock.now = 1.2
+    metrics.finish("completed")
+    metrics.record(completion_tokens=10)
+    # 2回目以降の記録は無視される
+    metrics.record(completion_tokens=10)
+
+    assert metrics.time_to_first_token == pytest.approx(0.5)
+    assert metrics.stream_duration == pytest.approx(1.2)
+    assert registry.get_histograms(TIME_TO_FIRST_TOKEN_METRIC)[LABELS].sum == pytest.approx(0.5)
+    assert registry.get_histograms(INTER_TOKEN_GAP_METRIC)[LABELS].count == 3
+    assert registry.get_histograms(TOKENS_PER_SECOND_METRIC)[LABELS].sum == pytest.approx(20.0)
+    assert registry.get_histograms(TOKENS_PER_SECOND_METRIC)[LABELS].count == 1
+    assert registry.get_counters(STREAMS_METRIC)[LABELS + (("status", "completed"),)].value == 1
+
+
+def test_track_separates_network_wait_from_render_time():
+    registry = MetricsRegistry()
+    clock = FakeClock()
+    metrics = StreamMetrics("gpt-4-turbo", registry, clock)
+
+    def deltas():
+        for delta in ["a", "b"]:
+            clock.now += 1.0  # 受信待ち
+            yield delta
+
+    for _ in metrics.track(deltas()):
+        clock.now += 0.25  # 描画
+    metrics.record(completion_tokens=2)
+
+    assert metrics.network_wait_seconds == pytest.approx(2.0)
+    assert metrics.render_seconds == pytest.approx(0.5)
+    assert registry.get_histograms(NETWORK_WAIT_METRIC)[LABELS].sum == pytest.approx(2.0)
+    assert registry.get_histograms(RENDER_TIME_METRIC)[LABELS].sum == pytest.approx(0.5)
+
+
+def test_generation_job_reports_deltas_and_status_to_metrics():
+    registry = MetricsRegistry()
+
+    def start():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    metrics = StreamMetrics("gpt-4-turbo", registry)
+    GenerationJob("gpt-4-turbo", start, metrics=metrics).run()
+
+    assert metrics.delta_count == 1
+    assert metrics.status == "error"
+    assert registry.get_counters(STREAMS_METRIC)[LABELS + (("status", "error"),)].value == 1
+
+
+def test_record_is_sent_through_application_insights_handler():
+    # ログ設定はプロセスごとに一度だけ適用されるため、INSTRUMENTATION_KEY を設定した新しいプロセスで確認する
+    code = """
+import json
+from chat_session.stream_metrics import StreamMetrics, metrics_logger
+from logs.app_logger import set_logging
+
+handler = next(h for h in metrics_logger.handlers if type(h).__name__ == "AzureLogHandler")
+sent = []
+handler.emit = lambda record: sent.append(record.custom_dimensions)
+metrics = StreamMetrics("gpt-3.5-turbo")
+metrics.observe_delta()
+metrics.finish("completed")
+metrics.record(completion_tokens=3)
+print(json.dumps({
+    "sent": sent,
+    "app_handlers": [type(h).__name__ for h in set_logging("lower.sub").handlers],
+    "propagate": metrics_logger.propagate,
+}))
+"""
+    env = {
+        **os.environ,
+        "INSTRUMENTATION_KEY": "00000000-0000-0000-0000-000000000000",
+        "INGESTION_ENDPOINT": "http://127.0.0.1:9",
+        "LIVE_ENDPOINT": "http://127.0.0.1:9",
+    }
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPOSITORY_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    assert [dimensions["completion_tokens"] for dimensions in result["sent"]] == [3]
+    assert result["sent"][0]["model"] == "gpt-3.5-turbo"
+    # アプリのログはApplication Insightsに送信しない
+    assert "AzureLogHandler" not in result["app_handlers"]
+    assert result["propagate"] is False
@@ -0,0 +1,52 @@
+from chat_session.StreamingRenderer import STREAMING_CURSOR, StreamingRenderer
+
+
+class FakePlaceholder:
+    def __init__(self):
+        self.rendered = []
+
+    def markdown(self, text):
+        self.rendered.append(text)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_streaming_renderer_throttles_repaints_by_frame_rate():
+    placeholder, clock = FakePlaceholder(), FakeClock()
+    renderer = StreamingRenderer(placeholder, frame_rate=10, char_threshold=None, clock=clock)
+    for i in range(100):
+        clock.now = i * 0.01
+        renderer.append("a")
+
+    # 1秒間に100回受信しても、描画は10フレーム分に間引かれる
+    assert len(placeholder.rendered) == 10
+    assert all(text.endswith(STREAMING_CURSOR) for text in placeholder.rendered)
+    assert renderer.finish() == "a" * 100
+    assert placeholder.rendered[-1] == "a" * 100
+
+
+def test_streaming_renderer_repaints_when_char_threshold_is_reached():
+    placeholder, clock = FakePlaceholder(), FakeClock()
+    renderer = StreamingRenderer(placeholder, frame_rate=1, char_threshold=5, clock=clock)
+    renderer.append("ab")
+    renderer.append("cd")
+    renderer.append("efg")
+    assert placeholder.rendered == ["ab" + STREAMING_CURSOR, "abcdefg" + STREAMING_CURSOR]
+
+
+def test_streaming_renderer_ignores_empty_deltas_and_always_flushes_final_text():
+    placeholder, clock = FakePlaceholder(), FakeClock()
+    renderer = StreamingRenderer(placeholder, frame_rate=1, char_threshold=None, clock=clock)
+    renderer.append("Hello")
+    renderer.append(None)
+    renderer.append("")
+    renderer.append(", world")
+    assert renderer.finish() == "Hello, world"
+    assert placeholder.rendered == ["Hello" + STREAMING_CURSOR, "Hello, world"]
+    assert renderer.render_count == 2
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import chat_session.SummaryMemory as summary_memory_module
+from chat_session.SummaryMemory import SummaryMemory, create_openai_summarizer
+from costs.get_token_count import TOKENS_PER_MESSAGE
+
+MODEL_VERSION = "gpt-3.5-turbo"
+
+
+def create_messages(count, token_count):
+    # 先頭のシステムメッセージと、トークン数をキャッシュ済みの会話を生成する
+    messages = [{"role": "system", "content": "", "tokens": {MODEL_VERSION: 0}}]
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append(
+            {"role": role, "content": f"message {i}", "tokens": {MODEL_VERSION: token_count}}
+        )
+    return messages
+
+
+def fake_summarizer(previous_summary, messages):
+    summary = previous_summary + "".join(f"[{m['content']}]" for m in messages)
+    return summary, 100, 10
+
+
+def test_maybe_summarize_does_nothing_below_threshold():
+    memory = SummaryMemory()
+    messages = create_messages(4, 10)
+    assert not memory.maybe_summarize(messages, MODEL_VERSION, 1000, fake_summarizer)
+    assert memory.build_history(messages) == messages
+
+
+def test_maybe_summarize_folds_older_turns_into_summary():
+    memory = SummaryMemory()
+    messages = create_messages(10, 100 - TOKENS_PER_MESSAGE)
+    # 閾値は500トークンのため、直近の250トークンに収まる2件を残して要約される
+    assert memory.maybe_summarize(messages, MODEL_VERSION, 500, fake_summarizer)
+    memory.wait(timeout=5)
+
+    assert memory.summarized_until == 9
+    assert memory.summary == "".join(f"[message {i}]" for i in range(8))
+    history = memory.build_history(messages)
+    assert history[0] is messages[0]
+    assert history[1]["role"] == "system"
+    assert memory.summary in history[1]["content"]
+    assert history[2:] == messages[9:]
+
+
+def test_maybe_summarize_keeps_unsummarized_history_when_summarizer_fails():
+    def failing_summarizer(previous_summary, messages):
+        raise RuntimeError("upstream error")
+
+    memory = SummaryMemory()
+    messages = create_messages(10, 100)
+    assert memory.maybe_summarize(messages, MODEL_VERSION, 500, failing_summarizer)
+    memory.wait(timeout=5)
+
+    assert memory.summarized_until == 0
+    assert memory.build_history(messages) == messages
+
+
+def test_completed_summary_usage_is_taken_once_per_model():
+    memory = SummaryMemory()
+    messages = create_messages(10, 100)
+    assert memory.maybe_summarize(messages, MODEL_VERSION, 500, fake_summarizer)
+    memory.wait(timeout=5)
+
+    assert memory.take_usage("gpt-4") == (0, 0)
+    assert memory.take_usage(MODEL_VERSION) == (100, 10)
+    assert memory.take_usage(MODEL_VERSION) == (0, 0)
+
+
+class RecordingClient:
+    def __init__(self):
+        self.requests = []
+
+    def create_chat_completion(self, estimated_tokens=0, **params):
+        self.requests.append((estimated_tokens, params))
+        message = SimpleNamespace(content="A short summary.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_openai_summarizer_reserves_tokens_and_reports_usage(monkeypatch):
+    client = RecordingClient()
+    monkeypatch.setattr(summary_memory_module, "get_openai_client", lambda model_version: client)
+    summarize = create_openai_summarizer(MODEL_VERSION)
+
+    summary, prompt_tokens, completion_tokens = summarize("", [{"role": "user", "content": "Hello"}])
+
+    [(estimated_tokens, params)] = client.requests
+    assert summary == "A short summary."
+    assert prompt_tokens > 0 and completion_tokens > 0
+    # プロンプトと応答の最大トークン数の合計をレート制限の枠として確保する
+    assert estimated_tokens == prompt_tokens + params["max_tokens"]
+    assert all(set(message) == {"role", "content"} for message in params["messages"])
@@ -0,0 +1,39 @@
+import pytest
+import tiktoken as tk
+from pdf_qa_service.text_chunker import TextChunk, chunk_pages
+
+
+def byte_encoding():
+    # ネットワークに依存しないよう、1バイトを1トークンとするエンコーダを使用する
+    return tk.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+def test_chunks_are_token_bounded_with_overlap_and_do_not_cross_pages():
+    pages = ["abcdefghij" * 3, "", "xyz"]
+    chunks = chunk_pages("hash", pages, byte_encoding(), chunk_tokens=12, overlap_tokens=4)
+
+    assert [chunk.text for chunk in chunks] == [
+        "abcdefghijab",
+        "ijabcdefghij",
+        "ghijabcdefgh",
+        "efghij",
+        "xyz",
+    ]
+    assert [chunk.page_number for chunk in chunks] == [1, 1, 1, 1, 3]
+    assert [chunk.chunk_index for chunk in chunks] == [0, 1, 2, 3, 4]
+    assert all(chunk.token_count <= 12 for chunk in chunks)
+
+
+def test_chunk_round_trips_through_dict():
+    chunk = TextChunk("hash", 2, 5, "text", 4)
+    assert vars(TextChunk.from_dict(chunk.to_dict())) == vars(chunk)
+
+
+def test_overlap_must_be_smaller_than_chunk():
+    with pytest.raises(ValueError):
+        chunk_pages("hash", ["text"], byte_encoding(), chunk_tokens=4, overlap_tokens=4)
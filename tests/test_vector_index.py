@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pytest
+from pdf_qa_service.text_chunker import TextChunk
+from pdf_qa_service.VectorIndex import VectorIndex
+
+
+def make_chunks(count):
+    return [TextChunk("hash", 1, i, f"chunk {i}", 2) for i in range(count)]
+
+
+def random_vectors(count, dimension=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+
+
+def test_exact_search_returns_most_similar_chunks_in_order():
+    vectors = random_vectors(100)
+    index = VectorIndex()
+    index.add(make_chunks(60), vectors[:60])
+    # 容量を超えて追加しても既存のベクトルは保持される
+    index.add(make_chunks(100)[60:], vectors[60:])
+
+    results = index.search(vectors[42], top_k=3)
+    assert len(index) == 100
+    assert results[0].chunk.chunk_index == 42
+    assert results[0].score > 0.99
+    assert [r.score for r in results] == sorted((r.score for r in results), reverse=True)
+
+
+def test_ivf_search_finds_nearest_chunks():
+    vectors = random_vectors(2000, seed=1)
+    index = VectorIndex()
+    index.add(make_chunks(2000), vectors)
+    index.build_ivf(n_lists=20)
+
+    hits = 0
+    for i in range(0, 2000, 100):
+        exact = index.search(vectors[i], top_k=1)
+        approximate = index.search(vectors[i], top_k=1, n_probe=4)
+        hits += exact[0].chunk.chunk_index == approximate[0].chunk.chunk_index
+    assert hits == 20
+    assert index.list_offsets[-1] == 2000
+
+
+def test_save_and_load_as_memory_map(tmp_path):
+    vectors = random_vectors(50, seed=2)
+    index = VectorIndex()
+    index.add(make_chunks(50), vectors)
+    index.build_ivf(n_lists=5)
+    index.save(str(tmp_path))
+
+    loaded = VectorIndex.load(str(tmp_path))
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.has_ivf
+    assert [r.chunk.chunk_index for r in loaded.search(vectors[7], 3)] == [
+        r.chunk.chunk_index for r in index.search(vectors[7], 3)
+    ]
+
+    # 読み込んだインデックスにも追加できる
+    loaded.add([TextChunk("hash", 2, 50, "new", 1)], random_vectors(1, seed=3))
+    assert len(loaded) == 51
+    assert not loaded.has_ivf
+
+
+def test_search_on_empty_index():
+    assert VectorIndex().search(np.ones(4), top_k=5) == []
+
+
+def test_failed_save_keeps_the_previous_index(tmp_path, monkeypatch):
+    vectors = random_vectors(50, seed=4)
+    index = VectorIndex()
+    index.add(make_chunks(50), vectors)
+    index.save(str(tmp_path))
+
+    index.build_ivf(n_lists=5)
+    original_save = np.save
+
+    def failing_save(path, array):
+        if str(path).endswith("centroids.npy"):
+            raise OSError("disk full")
+        original_save(path, array)
+
+    monkeypatch.setattr(np, "save", failing_save)
+    with pytest.raises(OSError):
+        index.save(str(tmp_path))
+
+    # 書き込み途中のファイルは公開されず、前回の保存をそのまま読み込める
+    loaded = VectorIndex.load(str(tmp_path))
+    assert len(loaded) == 50
+    assert not loaded.has_ivf
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")]
+
+
+def test_repeated_saves_keep_current_and_previous_versions(tmp_path):
+    index = VectorIndex()
+    index.add(make_chunks(10), random_vectors(10, seed=5))
+    for _ in range(3):
+        index.save(str(tmp_path))
+
+    assert VectorIndex.exists(str(tmp_path))
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("version-")]) == 2
+    assert len(VectorIndex.load(str(tmp_path))) == 10